@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Module to maintain pre-aggregated summary tables of privatisation plans.
+
+agg_plan_revenue holds plan counts and forecast revenue sums per organization and plan
+year, agg_plan_objects holds privatization object counts per region, organization, plan
+year and purpose. Both are updated incrementally with the deltas of every ingest batch,
+inside the batch transaction, and can be rebuilt from the fact tables with --rebuild.
+
+Each plan version counts once: a reprocessed version is stored again in the fact tables
+under new globalids, but its batch adds nothing, and a reload or rebuild reading several
+copies of a version counts one. Sums are exact DECIMAL values; a malformed sum is NULL,
+as in the *_amount columns, and adds nothing.
+"""
+
+import argparse
+from collections import Counter, defaultdict
+from decimal import Decimal
+from itertools import chain
+from db_utils import get_db_connection, create_table_sqlite_to_sqlserver, increment_rows, optimize_database
+from normalize import to_amount
+
+REVENUE_TABLE = 'agg_plan_revenue'
+REVENUE_KEYS = ['org_code', 'plan_year']
+REVENUE_VALUES = ['plans', 'sum_first_year', 'sum_second_year', 'sum_third_year']
+
+OBJECTS_TABLE = 'agg_plan_objects'
+OBJECTS_KEYS = ['subject_rf_code', 'org_code', 'plan_year', 'purpose_code']
+OBJECTS_VALUES = ['objects']
+
+AGGREGATE_TABLES = {
+    REVENUE_TABLE: [
+        'org_code NVARCHAR(20) NOT NULL',
+        'plan_year INTEGER NOT NULL',
+        'plans INTEGER',
+        'sum_first_year DECIMAL(18,2)',
+        'sum_second_year DECIMAL(18,2)',
+        'sum_third_year DECIMAL(18,2)',
+        'PRIMARY KEY (org_code, plan_year)'
+    ],
+    OBJECTS_TABLE: [
+        'subject_rf_code NVARCHAR(20) NOT NULL',
+        'org_code NVARCHAR(20) NOT NULL',
+        'plan_year INTEGER NOT NULL',
+        'purpose_code NVARCHAR(20) NOT NULL',
+        'objects INTEGER',
+        'PRIMARY KEY (subject_rf_code, org_code, plan_year, purpose_code)'
+    ]
+}
+
+# Grouping dimensions available to the query CLI
+DIMENSIONS = {
+    'region': 'subject_rf_code',
+    'org': 'org_code',
+    'year': 'plan_year',
+    'purpose': 'purpose_code'
+}
+
+PLAN_FIELDS = ['regnum', 'version', 'org_code', 'planing_period', 'signing_date', 'publish_date',
+               'sum_first_year', 'sum_second_year', 'sum_third_year']
+OBJECT_FIELDS = ['id', 'plan_version', 'subject_rf_code', 'purpose_code']
+
+READ_CHUNK = 10000
+
+
+def create_tables(cursor):
+    """Create the aggregate tables"""
+    for table_name, columns in AGGREGATE_TABLES.items():
+        create_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
+        cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+
+
+def add_amount(total, value):
+    """Add a forecast sum published as text to a running Decimal total; missing or malformed sums add nothing"""
+    amount = to_amount(value)
+    if amount is None:
+        return total
+    return Decimal(amount) if total is None else total + Decimal(amount)
+
+
+def version_key(reg_num, version):
+    """Return the (regnum, version) a plan row or an object row (id, plan_version) belongs to"""
+    return reg_num, int(version or 0)
+
+
+def plan_year(plan):
+    """Return the first year of a plan's planning period, falling back to its signing or publish date"""
+    for field in ('planing_period', 'signing_date', 'publish_date'):
+        value = plan.get(field)
+        if value and str(value)[:4].isdigit():
+            return int(str(value)[:4])
+    return 0
+
+
+def plan_deltas(plans):
+    """
+    Compute revenue deltas for plan rows (dicts with PLAN_FIELDS), counting every version
+    once. Returns them with the (org_code, plan_year) of every version, used to place its
+    objects, and the number of copies of every version among the rows.
+    """
+    totals = defaultdict(lambda: [0, None, None, None])
+    context = {}
+    copies = Counter()
+    for plan in plans:
+        version = version_key(plan.get('regnum'), plan.get('version'))
+        copies[version] += 1
+        if copies[version] > 1:
+            continue
+        key = (plan.get('org_code') or '', plan_year(plan))
+        context[version] = key
+        total = totals[key]
+        total[0] += 1
+        total[1] = add_amount(total[1], plan.get('sum_first_year'))
+        total[2] = add_amount(total[2], plan.get('sum_second_year'))
+        total[3] = add_amount(total[3], plan.get('sum_third_year'))
+    return [key + tuple(total) for key, total in totals.items()], context, copies
+
+
+def object_deltas(objects, context, copies):
+    """
+    Compute object count deltas for (regnum, plan_version, subject_rf_code, purpose_code)
+    tuples. The objects of a version present in several copies are counted for one copy.
+    """
+    counts = defaultdict(int)
+    repeated = defaultdict(int)
+    for reg_num, plan_version, subject_rf_code, purpose_code in objects:
+        version = version_key(reg_num, plan_version)
+        org_code, year = context.get(version, ('', 0))
+        key = (subject_rf_code or '', org_code, year, purpose_code or '')
+        if copies.get(version, 1) > 1:
+            repeated[(key, version)] += 1
+        else:
+            counts[key] += 1
+    for (key, version), count in repeated.items():
+        counts[key] += count // copies[version]
+    return [key + (count,) for key, count in counts.items()]
+
+
+def object_tuples(adapter, object_rows):
+    """Return the OBJECT_FIELDS values of privatizationobjects rows"""
+    object_columns = adapter.columns('privatizationobjects')
+    positions = [object_columns.index(name) for name in OBJECT_FIELDS]
+    return [tuple(row[i] for i in positions) for row in object_rows]
+
+
+def stored_versions(conn, plans):
+    """Return the (regnum, version) of plans already in the fact table under another globalid (reprocessed)"""
+    cursor = conn.cursor()
+    stored = set()
+    for plan in plans:
+        cursor.execute("""
+            SELECT COUNT(*) FROM privatisationplanlist WHERE regnum = ? AND version = ? AND globalid <> ?
+        """, (plan['regnum'], plan['version'], plan['globalid']))
+        if cursor.fetchone()[0]:
+            stored.add(version_key(plan['regnum'], plan['version']))
+    return stored
+
+
+def apply_batch(conn, adapter, rows):
+    """Add the deltas of the plan versions of an ingest batch not counted before, the caller commits"""
+    plan_rows = rows.get('privatisationplanlist', [])
+    object_rows = rows.get('privatizationobjects', [])
+    if not plan_rows and not object_rows:
+        return
+
+    plan_columns = adapter.columns('privatisationplanlist')
+    plans = [dict(zip(plan_columns, row)) for row in plan_rows]
+    # The fact rows of the batch are written already; an older copy of a version means it was counted
+    stored = stored_versions(conn, plans)
+    revenue, context, copies = plan_deltas(plan for plan in plans
+                                           if version_key(plan['regnum'], plan['version']) not in stored)
+    increment_rows(conn, REVENUE_TABLE, REVENUE_KEYS, REVENUE_VALUES, revenue)
+
+    objects = [item for item in object_tuples(adapter, object_rows) if version_key(*item[:2]) not in stored]
+    increment_rows(conn, OBJECTS_TABLE, OBJECTS_KEYS, OBJECTS_VALUES, object_deltas(objects, context, copies))
+
+
+def negate(deltas, keys):
+    """Turn delta rows (key values followed by values) into the deltas that subtract them"""
+    return [row[:keys] + tuple(None if value is None else -value for value in row[keys:]) for row in deltas]
+
+
+def retract_batch(conn, adapter, rows):
+    """Subtract the deltas of fact rows about to be removed (a partition reload), the caller commits"""
+    plan_columns = adapter.columns('privatisationplanlist')
+    revenue, context, copies = plan_deltas(dict(zip(plan_columns, row))
+                                           for row in rows.get('privatisationplanlist', []))
+    increment_rows(conn, REVENUE_TABLE, REVENUE_KEYS, REVENUE_VALUES, negate(revenue, len(REVENUE_KEYS)))
+
+    objects = object_tuples(adapter, rows.get('privatizationobjects', []))
+    increment_rows(conn, OBJECTS_TABLE, OBJECTS_KEYS, OBJECTS_VALUES,
+                   negate(object_deltas(objects, context, copies), len(OBJECTS_KEYS)))
+
+
+def rebuild_aggregates():
+    """Recompute the aggregate tables from privatisationplanlist and privatizationobjects"""
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+    create_tables(cursor)
+    cursor.execute(f"DELETE FROM {REVENUE_TABLE}")
+    cursor.execute(f"DELETE FROM {OBJECTS_TABLE}")
+
+    cursor.execute(f"SELECT {', '.join(PLAN_FIELDS)} FROM privatisationplanlist")
+    revenue, context, copies = plan_deltas(dict(zip(PLAN_FIELDS, row)) for row in cursor.fetchall())
+    increment_rows(conn, REVENUE_TABLE, REVENUE_KEYS, REVENUE_VALUES, revenue)
+
+    # Objects are read chunk by chunk, the plan context of 35k plans fits in memory
+    cursor.execute(f"SELECT {', '.join(OBJECT_FIELDS)} FROM privatizationobjects")
+    chunks = iter(lambda: cursor.fetchmany(READ_CHUNK), [])
+    counts = object_deltas(chain.from_iterable(chunks), context, copies)
+    increment_rows(conn, OBJECTS_TABLE, OBJECTS_KEYS, OBJECTS_VALUES, counts)
+
+    conn.commit()
+    optimize_database(conn)
+    conn.close()
+    print(f"Aggregates rebuilt: {len(revenue)} revenue rows, {len(counts)} object rows")
+    return len(revenue), len(counts)
+
+
+def filter_clause(year=None, org=None, region=None, purpose=None):
+    """Build a WHERE clause and its parameters from the query filters"""
+    conditions = []
+    params = []
+    for column, value in (('plan_year', year), ('org_code', org), ('subject_rf_code', region),
+                          ('purpose_code', purpose)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+
+def query_revenue(year=None, org=None):
+    """Return (org_code, plan_year, plans, sums...) rows of the revenue summary"""
+    where, params = filter_clause(year=year, org=org)
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(REVENUE_KEYS + REVENUE_VALUES)} FROM {REVENUE_TABLE} {where}
+        ORDER BY plan_year, org_code
+    """, params)
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def query_objects(group_by, year=None, org=None, region=None, purpose=None):
+    """Return object counts grouped by the given dimensions (region, org, year, purpose)"""
+    columns = [DIMENSIONS[name] for name in group_by]
+    where, params = filter_clause(year=year, org=org, region=region, purpose=purpose)
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(columns)}, SUM(objects) FROM {OBJECTS_TABLE} {where}
+        GROUP BY {', '.join(columns)}
+        ORDER BY SUM(objects) DESC
+    """, params)
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain and query privatisation plan aggregate tables')
+    parser.add_argument('--createdb', action='store_true', help='Create the aggregate tables')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the aggregates from the fact tables')
+    parser.add_argument('--revenue', action='store_true', help='Show forecast revenue per organization and year')
+    parser.add_argument('--objects', action='store_true', help='Show privatization object counts')
+    parser.add_argument('--by', default='region', help=f"Object grouping: comma separated {', '.join(DIMENSIONS)}")
+    parser.add_argument('--year', type=int, help='Filter by plan year')
+    parser.add_argument('--org', help='Filter by organization code')
+    parser.add_argument('--region', help='Filter by subject RF code (objects only)')
+    parser.add_argument('--purpose', help='Filter by purpose code (objects only)')
+
+    args = parser.parse_args()
+
+    if args.createdb:
+        conn = get_db_connection()
+        create_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        print("Aggregate tables created successfully.")
+
+    if args.rebuild:
+        rebuild_aggregates()
+
+    if args.revenue:
+        for row in query_revenue(args.year, args.org):
+            print('\t'.join(str(value) for value in row))
+
+    if args.objects:
+        group_by = [name.strip() for name in args.by.split(',')]
+        unknown = [name for name in group_by if name not in DIMENSIONS]
+        if unknown:
+            parser.error(f"Unknown dimensions: {', '.join(unknown)}")
+        for row in query_objects(group_by, args.year, args.org, args.region, args.purpose):
+            print('\t'.join(str(value) for value in row))
+
+    if not any([args.createdb, args.rebuild, args.revenue, args.objects]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Module with a read-only HTTP query API over the plan, object, decision and NSI tables.
+
+GET /plans, /objects, /decisions and /nsi/<NSIType> return {"items": [...], "next": ...}:
+rows in globalid order, a page of ?limit= rows after the ?after= key (keyset pagination,
+so deep pages cost the same as the first), only the ?fields= columns, and filters on
+indexed columns (e.g. /plans?org_code=...&published_from=2025-01-01).
+
+Responses are kept in an LRU cache with an ETag; a client sending If-None-Match gets 304.
+The cache is valid for one value of the ingest watermark (db_utils.mark_ingested, advanced
+after every load), which is re-read at most every few seconds, so repeated dashboard
+queries are answered from memory until new data is loaded.
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse
+from db_utils import get_db_connection, get_db_type, read_watermark
+from normalize import to_day, to_month, to_utc
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+CACHE_ENTRIES = 1024
+WATERMARK_INTERVAL = 5.0
+
+KEY_COLUMN = 'globalid'
+
+# Resource: (table, {query parameter: (indexed column, operator, value converter)})
+RESOURCES = {
+    'plans': ('privatisationplanlist', {
+        'regnum': ('regnum', '=', None),
+        'org_code': ('org_code', '=', None),
+        'published_from': ('publish_date_utc', '>=', to_utc),
+        'published_to': ('publish_date_utc', '<', to_utc),
+        'publish_month': ('publish_month', '=', None),
+        'signed_from': ('signing_day', '>=', to_day),
+        'signed_to': ('signing_day', '<', to_day)
+    }),
+    'objects': ('privatizationobjects', {
+        'subject_rf_code': ('subject_rf_code', '=', None),
+        'purpose_code': ('purpose_code', '=', None),
+        'publish_month': ('publish_month', '=', None)
+    }),
+    'decisions': ('privatizationdecisions', {
+        'plan_number': ('plan_number', '=', None),
+        'published_from': ('publish_date_utc', '>=', to_utc),
+        'published_to': ('publish_date_utc', '<', to_utc),
+        'publish_month': ('publish_month', '=', None)
+    })
+}
+
+# Date filters also constrain the publish month, the partition key of the fact tables
+# (partitions.py), so SQL Server reads only the partitions of the requested months
+PARTITION_FILTERS = {
+    'published_from': ('publish_month', '>=', to_month),
+    'published_to': ('publish_month', '<=', to_month)
+}
+
+NSI_TYPE_RE = re.compile(r'^\w+$')
+
+
+class ResponseCache:
+    """LRU cache of (ETag, body) per request, emptied when the ingest watermark moves"""
+
+    def __init__(self, max_entries=CACHE_ENTRIES, watermark_interval=WATERMARK_INTERVAL):
+        self.max_entries = max_entries
+        self.watermark_interval = watermark_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.watermark = None
+        self.checked = None
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self):
+        """Return the current watermark, reading it from the database at most every watermark_interval seconds"""
+        with self.lock:
+            now = time.monotonic()
+            if self.checked is None or now - self.checked >= self.watermark_interval:
+                conn = get_db_connection('read')
+                watermark = read_watermark(conn)
+                conn.close()
+                if watermark != self.watermark:
+                    self.entries.clear()
+                    self.watermark = watermark
+                self.checked = now
+            return self.watermark
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry, watermark):
+        with self.lock:
+            # A response read before the watermark moved must not be cached under the new one
+            if watermark != self.watermark:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def table_columns(conn, table_name):
+    """Return the column names of a table, LookupError if it does not exist"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT * FROM {table_name} WHERE 1 = 0")
+    except Exception:
+        raise LookupError(f"No table {table_name}")
+    return [column[0] for column in cursor.description]
+
+
+def query_table(conn, table_name, filters, params):
+    """Return a page of rows of a table as {"items": [...], "next": key of the last row or None}"""
+    unknown = set(params) - set(filters) - {'fields', 'limit', 'after'}
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}. Filters: {', '.join(filters) or 'none'}")
+
+    columns = table_columns(conn, table_name)
+    fields = [field for field in params.get('fields', '').split(',') if field] or columns
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    try:
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be a number")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+
+    conditions = []
+    values = []
+    for name, (column, operator, converter) in filters.items():
+        if name in params:
+            value = converter(params[name]) if converter else params[name]
+            if value is None:
+                raise ValueError(f"Malformed {name}: {params[name]}")
+            conditions.append(f"{column} {operator} ?")
+            values.append(value)
+            if name in PARTITION_FILTERS:
+                column, operator, converter = PARTITION_FILTERS[name]
+                conditions.append(f"{column} {operator} ?")
+                values.append(converter(params[name]))
+    if 'after' in params:
+        conditions.append(f"{KEY_COLUMN} > ?")
+        values.append(params['after'])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    # One row more than the page tells whether there is a next page
+    select_list = ', '.join([KEY_COLUMN] + fields)
+    if get_db_type() == 'SQLSERVER':
+        query = f"SELECT TOP ({limit + 1}) {select_list} FROM {table_name} {where} ORDER BY {KEY_COLUMN}"
+    else:
+        query = f"SELECT {select_list} FROM {table_name} {where} ORDER BY {KEY_COLUMN} LIMIT {limit + 1}"
+    cursor = conn.cursor()
+    cursor.execute(query, values)
+    rows = cursor.fetchall()
+
+    page = rows[:limit]
+    return {
+        'items': [dict(zip(fields, row[1:])) for row in page],
+        'next': page[-1][0] if len(rows) > limit else None
+    }
+
+
+def route(conn, path, params):
+    """Answer a request path: the resource list, a resource or an NSI type"""
+    parts = [part for part in path.split('/') if part]
+    if not parts:
+        return {'resources': [f'/{name}' for name in RESOURCES] + ['/nsi/<NSIType>']}
+    if len(parts) == 1 and parts[0] in RESOURCES:
+        table_name, filters = RESOURCES[parts[0]]
+        return query_table(conn, table_name, filters, params)
+    if len(parts) == 2 and parts[0] == 'nsi' and NSI_TYPE_RE.match(parts[1]):
+        return query_table(conn, f'nsi_{parts[1]}', {}, params)
+    raise LookupError(f"No resource {path}")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """GET handler answering from the server's response cache, querying the database on a miss"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        key = f"{url.path}?{urlencode(sorted(params.items()))}"
+        cache = self.server.cache
+
+        watermark = cache.refresh()
+        entry = cache.get(key)
+        if entry is None:
+            conn = get_db_connection('read')
+            try:
+                body = json.dumps(route(conn, url.path, params), ensure_ascii=False, default=str).encode('utf-8')
+            except LookupError as e:
+                self.send_json(404, {'error': str(e)})
+                return
+            except ValueError as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            except Exception as e:
+                # The client gets a JSON error instead of a dropped connection; the cause goes to the log
+                self.log_error("Error answering %s: %r", self.path, e)
+                self.send_json(500, {'error': 'Internal server error'})
+                return
+            finally:
+                conn.close()
+            entry = (f'"{watermark}-{hashlib.sha1(body).hexdigest()[:16]}"', body)
+            cache.put(key, entry, watermark)
+
+        etag, body = entry
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # Clients revalidate every time; a 304 costs no database query either
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Ingest-Watermark', str(watermark))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(host='127.0.0.1', port=8080, cache_entries=CACHE_ENTRIES, watermark_interval=WATERMARK_INTERVAL):
+    """Create the API server (port 0 picks a free port); call serve_forever() to run it"""
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.cache = ResponseCache(cache_entries, watermark_interval)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read-only HTTP query API over the loaded tables')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--cache-size', type=int, default=CACHE_ENTRIES, help='Responses kept in the cache')
+    parser.add_argument('--watermark-interval', type=float, default=WATERMARK_INTERVAL,
+                        help='Seconds between checks of the ingest watermark')
+
+    args = parser.parse_args()
+    server = create_server(args.host, args.port, args.cache_size, args.watermark_interval)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
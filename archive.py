@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Module to compact the monthly registry files (loaded/data-*.json) of a dataset into one
+indexed archive, so looking up a regNum or reloading the registry does not re-parse every file.
+
+The archive is a single SQLite file in the dataset directory (registry-archive.db): one row
+per listObjects entry with its source file, regNum, documentType and publishDate, indexed by
+(regnum, publishdate) and (documenttype, publishdate). Readers open it read-only with
+memory-mapped I/O, so a lookup touches only the index and data pages it needs.
+
+Entries are zlib-compressed one by one with a preset dictionary sampled from the first
+archived file: registry entries share most of their bytes, so this compresses about as well
+as the whole file while each entry can still be decompressed on its own.
+Compaction is incremental: files already archived with the same size are skipped.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import zlib
+from datetime import datetime
+
+ARCHIVE_FILE = 'registry-archive.db'
+
+# Entries sampled into the compression dictionary, and its size limit (zlib window)
+DICTIONARY_ENTRIES = 200
+DICTIONARY_SIZE = 32768
+
+ARCHIVE_WRITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536'
+]
+
+ARCHIVE_READ_PRAGMAS = [
+    'PRAGMA query_only=ON',
+    'PRAGMA mmap_size=1073741824'
+]
+
+ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS archive_meta (
+        name TEXT PRIMARY KEY,
+        value BLOB
+    )""",
+    """CREATE TABLE IF NOT EXISTS archive_files (
+        id INTEGER PRIMARY KEY,
+        filename TEXT NOT NULL UNIQUE,
+        size INTEGER,
+        entries INTEGER,
+        archived TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER PRIMARY KEY,
+        file_id INTEGER NOT NULL,
+        regnum TEXT,
+        documenttype TEXT,
+        publishdate TEXT,
+        entry BLOB NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_entries_regnum ON entries (regnum, publishdate)",
+    "CREATE INDEX IF NOT EXISTS ix_entries_documenttype ON entries (documenttype, publishdate)",
+    "CREATE INDEX IF NOT EXISTS ix_entries_file_id ON entries (file_id)"
+]
+
+
+def archive_path(directory):
+    """Return the archive file of a dataset directory"""
+    return os.path.join(directory, ARCHIVE_FILE)
+
+
+def open_archive(directory, write=False):
+    """Open the archive of a dataset directory, read-only and memory-mapped unless write is set"""
+    path = archive_path(directory)
+    if write:
+        conn = sqlite3.connect(path)
+        pragmas = ARCHIVE_WRITE_PRAGMAS
+    else:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No registry archive in {directory}, run archive.py --compact first")
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        pragmas = ARCHIVE_READ_PRAGMAS
+    for pragma in pragmas:
+        conn.execute(pragma)
+    return conn
+
+
+def encode_entry(obj):
+    """Serialize a registry entry as compact JSON bytes"""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def entry_compressor(dictionary):
+    """Return a compressor primed with the archive's preset dictionary"""
+    return zlib.compressobj(zdict=dictionary)
+
+
+def compress_entry(data, compressor):
+    """Compress one entry with a copy of the primed compressor (priming again per entry is slower)"""
+    compressor = compressor.copy()
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_entry(data, dictionary):
+    """Decompress one entry back to its dict"""
+    decompressor = zlib.decompressobj(zdict=dictionary)
+    return json.loads(decompressor.decompress(data) + decompressor.flush())
+
+
+def archive_dictionary(cursor, objects):
+    """Return the archive's compression dictionary, sampling it from objects when the archive has none"""
+    cursor.execute("SELECT value FROM archive_meta WHERE name = 'dictionary'")
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    # zlib uses the end of the dictionary first, so the sample is kept from the end
+    dictionary = b''.join(encode_entry(obj) for obj in objects[:DICTIONARY_ENTRIES])[-DICTIONARY_SIZE:]
+    cursor.execute("INSERT INTO archive_meta (name, value) VALUES ('dictionary', ?)", (dictionary,))
+    return dictionary
+
+
+def read_dictionary(conn):
+    """Return the compression dictionary of an open archive"""
+    row = conn.execute("SELECT value FROM archive_meta WHERE name = 'dictionary'").fetchone()
+    return row[0] if row else b''
+
+
+def source_files(directory):
+    """Return the registry data-*.json files already moved to the loaded/ subdirectory"""
+    loaded = os.path.join(directory, 'loaded')
+    if not os.path.isdir(loaded):
+        return []
+    return sorted(
+        os.path.join(loaded, filename)
+        for filename in os.listdir(loaded)
+        if filename.startswith('data-') and filename.endswith('.json')
+    )
+
+
+def compact(directory, files=None):
+    """
+    Add registry files (by default all of loaded/data-*.json) to the dataset's archive.
+    A file that changed size since it was archived replaces its earlier entries.
+    Returns the number of entries archived.
+    """
+    conn = open_archive(directory, write=True)
+    cursor = conn.cursor()
+    for statement in ARCHIVE_SCHEMA:
+        cursor.execute(statement)
+    cursor.execute("SELECT filename, size FROM archive_files")
+    archived_sizes = dict(cursor.fetchall())
+    compressor = None
+
+    archived = 0
+    for filepath in files if files is not None else source_files(directory):
+        filename = os.path.basename(filepath)
+        size = os.path.getsize(filepath)
+        if archived_sizes.get(filename) == size:
+            continue
+
+        with open(filepath, 'r', encoding='utf-8') as f:
+            objects = json.load(f).get('listObjects', [])
+        # Empty registry files must not become the dictionary sample
+        if compressor is None and objects:
+            compressor = entry_compressor(archive_dictionary(cursor, objects))
+
+        cursor.execute("SELECT id FROM archive_files WHERE filename = ?", (filename,))
+        row = cursor.fetchone()
+        if row:
+            file_id = row[0]
+            cursor.execute("DELETE FROM entries WHERE file_id = ?", (file_id,))
+        else:
+            cursor.execute("INSERT INTO archive_files (filename) VALUES (?)", (filename,))
+            file_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO entries (file_id, regnum, documenttype, publishdate, entry) VALUES (?, ?, ?, ?, ?)",
+            [(file_id, obj.get('regNum'), obj.get('documentType'), obj.get('publishDate'),
+              compress_entry(encode_entry(obj), compressor)) for obj in objects]
+        )
+        cursor.execute("UPDATE archive_files SET size = ?, entries = ?, archived = ? WHERE id = ?",
+                       (size, len(objects), datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), file_id))
+        conn.commit()
+        archived += len(objects)
+        print(f"Archived {len(objects)} entries of {filename}")
+
+    if archived:
+        cursor.execute("ANALYZE")
+        conn.commit()
+    conn.close()
+    return archived
+
+
+def find_entries(directory, reg_num=None, document_type=None, date_from=None, date_to=None):
+    """
+    Return (filename, entry) of archived registry entries matching a regNum, documentType and
+    publishDate range (date_from inclusive, date_to exclusive), in publish order.
+    """
+    conditions = []
+    params = []
+    for column, operator, value in (('regnum', '=', reg_num), ('documenttype', '=', document_type),
+                                    ('publishdate', '>=', date_from), ('publishdate', '<', date_to)):
+        if value is not None:
+            conditions.append(f"{column} {operator} ?")
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    conn = open_archive(directory)
+    dictionary = read_dictionary(conn)
+    cursor = conn.execute(f"""
+        SELECT f.filename, e.entry FROM entries e JOIN archive_files f ON f.id = e.file_id
+        {where} ORDER BY e.publishdate, e.id
+    """, params)
+    entries = [(filename, decompress_entry(entry, dictionary)) for filename, entry in cursor.fetchall()]
+    conn.close()
+    return entries
+
+
+def file_entries(directory):
+    """Yield (filename, original size, listObjects) of every archived file in file name order"""
+    conn = open_archive(directory)
+    dictionary = read_dictionary(conn)
+    files = conn.execute("SELECT id, filename, size FROM archive_files ORDER BY filename").fetchall()
+    for file_id, filename, size in files:
+        cursor = conn.execute("SELECT entry FROM entries WHERE file_id = ? ORDER BY id", (file_id,))
+        yield filename, size, [decompress_entry(entry, dictionary) for (entry,) in cursor.fetchall()]
+    conn.close()
+
+
+def main():
+    from datasets import ADAPTERS, get_adapter
+
+    parser = argparse.ArgumentParser(description='Indexed archive of registry data-*.json files')
+    parser.add_argument('--dataset', default='privatizationPlans', help=f"Dataset name or identifier ({', '.join(ADAPTERS)})")
+    parser.add_argument('--compact', action='store_true', help='Add loaded/data-*.json files to the archive')
+    parser.add_argument('--regnum', help='Show archived entries of a registry number')
+    parser.add_argument('--type', dest='document_type', help='Only entries of this documentType')
+    parser.add_argument('--from', dest='date_from', metavar='DATE', help='Only entries published from DATE')
+    parser.add_argument('--to', dest='date_to', metavar='DATE', help='Only entries published before DATE')
+
+    args = parser.parse_args()
+    directory = get_adapter(args.dataset).directory
+
+    if args.compact:
+        archived = compact(directory)
+        print(f"Archived {archived} registry entries into {archive_path(directory)}")
+
+    lookup = any([args.regnum, args.document_type, args.date_from, args.date_to])
+    if lookup:
+        for filename, entry in find_entries(directory, args.regnum, args.document_type, args.date_from, args.date_to):
+            print(f"{entry.get('publishDate')}\t{entry.get('documentType')}\t{entry.get('regNum')}\t"
+                  f"{filename}\t{entry.get('href')}")
+
+    if not any([args.compact, lookup]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Module to normalize cadastral numbers and keep an index of every place a property
+appears in: privatization plan objects (kadNumber) and privatization decisions
+(cadastral numbers mentioned in the object description).
+
+The full history of a parcel is then one index seek on cadastral_index.kad_number.
+"""
+
+import argparse
+import re
+from datetime import datetime
+from db_utils import (get_db_connection, create_index_sql, create_table_sqlite_to_sqlserver, optimize_database,
+                      upsert_rows)
+
+CADASTRAL_TABLE = 'cadastral_index'
+
+CADASTRAL_COLUMNS = [
+    'kad_number NVARCHAR(40) NOT NULL',
+    'regnum NVARCHAR(36) NOT NULL',
+    'documenttype NVARCHAR(50) NOT NULL',
+    'object_number NVARCHAR(40) NOT NULL',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'publish_date NVARCHAR(30)',
+    'raw_value TEXT'
+]
+CADASTRAL_KEY_COLUMNS = ['kad_number', 'regnum', 'documenttype', 'object_number']
+CADASTRAL_FIELDS = [definition.split()[0] for definition in CADASTRAL_COLUMNS]
+
+# Region:district:quarter:number, written with optional spaces and various colon-like separators
+KAD_NUMBER_RE = re.compile(r'(?<!\d)(\d{1,2})\s*[:：]\s*(\d{1,2})\s*[:：]\s*(\d{5,7})\s*[:：]\s*(\d{1,10})(?!\d)')
+
+READ_CHUNK = 10000
+
+
+def create_tables(cursor):
+    """Create the cadastral index table and its lookup indexes"""
+    create_sql = (f"CREATE TABLE IF NOT EXISTS {CADASTRAL_TABLE} ({', '.join(CADASTRAL_COLUMNS)}, "
+                  f"PRIMARY KEY ({', '.join(CADASTRAL_KEY_COLUMNS)}))")
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+    cursor.execute(create_index_sql(f'ix_{CADASTRAL_TABLE}_regnum', CADASTRAL_TABLE, ['regnum']))
+
+
+def normalize_kad_number(region, district, quarter, number):
+    """Format cadastral number parts as RR:DD:QQQQQQQ:N (zero-padded, no leading zeros in the number)"""
+    return f"{int(region):02d}:{int(district):02d}:{int(quarter):07d}:{int(number)}"
+
+
+def find_kad_numbers(text):
+    """Return the normalized cadastral numbers found in a text, in order of appearance, without repeats"""
+    if not text:
+        return []
+    found = []
+    for match in KAD_NUMBER_RE.finditer(text):
+        kad_number = normalize_kad_number(*match.groups())
+        if kad_number not in found:
+            found.append(kad_number)
+    return found
+
+
+def index_rows(reg_num, document_type, object_number, publish_date, texts, now):
+    """Build cadastral index rows for the numbers found in the texts of one object"""
+    rows = []
+    for text in texts:
+        for kad_number in find_kad_numbers(text):
+            rows.append((kad_number, reg_num, document_type, object_number or '', now, now, publish_date, text))
+    return rows
+
+
+def plan_object_rows(objects, publish_dates, now):
+    """Index rows for (regnum, object_number, kad_number, name) of plan objects"""
+    rows = []
+    for reg_num, object_number, kad_number, name in objects:
+        rows.extend(index_rows(reg_num, 'privatizationPlan', object_number, publish_dates.get(reg_num),
+                               [kad_number, name], now))
+    return rows
+
+
+def decision_rows(decisions, now):
+    """Index rows for (regnum, object_number, publish_date, object_name) of decisions"""
+    rows = []
+    for reg_num, object_number, publish_date, object_name in decisions:
+        rows.extend(index_rows(reg_num, 'privatizationDecision', object_number, publish_date, [object_name], now))
+    return rows
+
+
+def write_rows(conn, rows):
+    """Upsert index rows, keeping one row per (kad_number, regnum, documenttype, object_number)"""
+    rows = list({row[:4]: row for row in rows}.values())
+    return upsert_rows(conn, CADASTRAL_TABLE, CADASTRAL_FIELDS, rows, CADASTRAL_KEY_COLUMNS)
+
+
+def pick(columns, rows, names):
+    """Project row tuples to the given column names"""
+    positions = [columns.index(name) for name in names]
+    return [tuple(row[i] for i in positions) for row in rows]
+
+
+def apply_batch(conn, adapter, rows):
+    """Index the cadastral numbers of the plans and decisions of an ingest batch, the caller commits"""
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    plans = pick(adapter.columns('privatisationplanlist'), rows.get('privatisationplanlist', []),
+                 ['regnum', 'publish_date'])
+    objects = pick(adapter.columns('privatizationobjects'), rows.get('privatizationobjects', []),
+                   ['id', 'object_number', 'kad_number', 'name'])
+    decisions = pick(adapter.columns('privatizationdecisions'), rows.get('privatizationdecisions', []),
+                     ['regnum', 'object_number', 'publish_date', 'object_name'])
+
+    write_rows(conn, plan_object_rows(objects, dict(plans), now) + decision_rows(decisions, now))
+
+
+def rebuild_index():
+    """Recreate the cadastral index from privatizationobjects and privatizationdecisions"""
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+    create_tables(cursor)
+    cursor.execute(f"DELETE FROM {CADASTRAL_TABLE}")
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+    cursor.execute("SELECT regnum, publish_date FROM privatisationplanlist")
+    publish_dates = dict(cursor.fetchall())
+
+    indexed = 0
+    for query, build in (
+            ("SELECT id, object_number, kad_number, name FROM privatizationobjects",
+             lambda chunk: plan_object_rows(chunk, publish_dates, now)),
+            ("SELECT regnum, object_number, publish_date, object_name FROM privatizationdecisions",
+             lambda chunk: decision_rows(chunk, now))):
+        read_cursor = conn.cursor()
+        read_cursor.execute(query)
+        while True:
+            chunk = read_cursor.fetchmany(READ_CHUNK)
+            if not chunk:
+                break
+            indexed += write_rows(conn, build(chunk))
+        conn.commit()
+
+    optimize_database(conn)
+    conn.close()
+    print(f"Cadastral index rebuilt: {indexed} occurrences")
+    return indexed
+
+
+def parcel_history(kad_number):
+    """Return all occurrences of a cadastral number (any formatting) ordered by publish date"""
+    numbers = find_kad_numbers(kad_number)
+    if not numbers:
+        raise ValueError(f"Not a cadastral number: {kad_number}")
+
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT publish_date, documenttype, regnum, object_number, raw_value FROM {CADASTRAL_TABLE}
+        WHERE kad_number = ?
+        ORDER BY publish_date, documenttype, regnum
+    """, (numbers[0],))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cadastral number index across plans and decisions')
+    parser.add_argument('kad_number', nargs='?', help='Cadastral number to show the history of')
+    parser.add_argument('--createdb', action='store_true', help='Create the cadastral index table')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from plans and decisions')
+
+    args = parser.parse_args()
+
+    if args.createdb:
+        conn = get_db_connection()
+        create_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        print("Cadastral index table created successfully.")
+
+    if args.rebuild:
+        rebuild_index()
+
+    if args.kad_number:
+        for publish_date, document_type, reg_num, object_number, raw_value in parcel_history(args.kad_number):
+            print(f"{publish_date}\t{document_type}\t{reg_num}\t{object_number}\t{raw_value[:80]}")
+
+    if not any([args.createdb, args.rebuild, args.kad_number]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Module with the single command line entry point: cli.py <command> [options].
+
+A command runs the main() of the script implementing it, imported only when the command
+is run. Heavy dependencies (requests, pandas, python-dotenv, pyodbc) are imported by the
+code paths that use them, so short commands such as ingest --createdb start quickly.
+"""
+
+import argparse
+import importlib
+import sys
+
+# Command: ('module:function' implementing it, description)
+COMMANDS = {
+    'download': ('metadownload:main', 'Download the registry files listed in meta.json'),
+    'ingest': ('main:main', 'Create the database, load the registry and process documents'),
+    'masterdata': ('masterdata:main', 'Create and fill the NSI tables'),
+    'export': ('createexcel_privplans:main', 'Export privatisation plans to Excel'),
+    'diagnose': ('cli:diagnose', 'Check the database configuration and connection'),
+    'pipeline': ('orchestrator:main', 'Run the daily load as a graph of stages'),
+    'watch': ('watch:main', 'Poll meta.json and load new files continuously'),
+    'queue': ('workqueue:main', 'Fill and work the shared document queue'),
+    'api': ('api:main', 'Serve the read-only HTTP query API'),
+    'partitions': ('partitions:main', 'Partition the fact tables by month and reload months'),
+    'replicate': ('replicate:main', 'Replicate tables between the SQLite and SQL Server databases'),
+    'simulate': ('portal_simulator:main', 'Serve the sample files as a local portal with injected faults')
+}
+
+DIAGNOSE_TABLES = ['privatisationplans', 'privatisationplanlist', 'privatizationobjects', 'privatizationdecisions',
+                   'organizations', 'rawdocuments', 'quarantine']
+
+
+def diagnose():
+    """Print the configured database, whether it can be opened and the row counts of the main tables"""
+    parser = argparse.ArgumentParser(description='Check the database configuration and connection')
+    parser.parse_args()
+
+    from db_utils import get_db_connection, get_db_type, read_watermark
+
+    db_type = get_db_type()
+    print(f"Database type: {db_type}")
+    if db_type == 'SQLSERVER':
+        from sqlserver_helper import check_odbc_drivers
+        if not check_odbc_drivers():
+            return 1
+
+    try:
+        conn = get_db_connection('read')
+    except Exception as e:
+        print(f"Connection failed: {str(e)}")
+        return 1
+    cursor = conn.cursor()
+    for table_name in DIAGNOSE_TABLES:
+        try:
+            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+            print(f"{table_name}: {cursor.fetchone()[0]} rows")
+        except Exception:
+            print(f"{table_name}: missing")
+    print(f"Ingest watermark: {read_watermark(conn)}")
+    conn.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='torgi.gov.ru open data loader',
+        epilog='Commands:\n' + '\n'.join(f'  {name:<12}{description}' for name, (_, description) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS, metavar='command', help='Command to run (see below)')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='Options of the command (<command> --help)')
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    module_name, function_name = COMMANDS[args.command][0].split(':')
+    function = getattr(importlib.import_module(module_name), function_name)
+
+    # The command parses its own options, and its usage line names the command
+    sys.argv = [f'{parser.prog} {args.command}'] + args.arguments
+    return function()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,30 +3,59 @@
 Module to export privatisation plans data to Excel sheets
 """
 
-import pandas as pd
 import argparse
+import time
 from pathlib import Path
 from db_utils import get_db_connection
+from profiling import add_profile_arguments, create_profiler, profile_stage
 
+EXPORT_TABLES = ['privatisationplans', 'privatisationplanlist', 'privatizationobjects']
 
-def export_to_excel():
+# Plan rows keep only org_code; organization details are joined from the organizations table.
+# COALESCE keeps rows loaded before the normalization readable.
+EXPORT_QUERIES = {
+    'privatisationplanlist': """
+        SELECT l.globalid, l.createdate, l.updatedate, l.regnum, l.plan_number, l.plan_name,
+               l.publish_date, l.signing_date, l.planing_period, l.org_code,
+               COALESCE(o.name, l.org_name) AS org_name,
+               COALESCE(o.inn, l.org_inn) AS org_inn,
+               COALESCE(o.kpp, l.org_kpp) AS org_kpp,
+               COALESCE(o.ogrn, l.org_ogrn) AS org_ogrn,
+               COALESCE(o.org_type, l.org_type) AS org_type,
+               l.budget_code, l.budget_name, l.authority,
+               l.sum_first_year, l.sum_second_year, l.sum_third_year, l.version
+        FROM privatisationplanlist l
+        LEFT JOIN organizations o ON o.code = l.org_code
+    """
+}
+
+
+def export_to_excel(profiler=None):
     """Export privatisation plans data to Excel with separate sheets"""
-    conn = get_db_connection()
+    import pandas as pd
+
+    conn = get_db_connection('read')
 
     # Read data from tables
-    privatisation_plans_df = pd.read_sql_query("SELECT * FROM privatisationplans", conn)
-    privatisation_planlist_df = pd.read_sql_query("SELECT * FROM privatisationplanlist", conn)
-    privatization_objects_df = pd.read_sql_query("SELECT * FROM privatizationobjects", conn)
+    frames = {}
+    with profile_stage(profiler, 'export_read'):
+        for table in EXPORT_TABLES:
+            started = time.perf_counter()
+            query = EXPORT_QUERIES.get(table, f"SELECT * FROM {table}")
+            frames[table] = pd.read_sql_query(query, conn)
+            if profiler:
+                profiler.record_item('table', table, int(frames[table].memory_usage(deep=True).sum()),
+                                     time.perf_counter() - started)
 
     conn.close()
 
     # Export to Excel with separate sheets
     excel_filename = 'privatisation_plans_export.xlsx'
 
-    with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
-        privatisation_plans_df.to_excel(writer, sheet_name='privatisationplans', index=False)
-        privatisation_planlist_df.to_excel(writer, sheet_name='privatisationplanlist', index=False)
-        privatization_objects_df.to_excel(writer, sheet_name='privatizationobjects', index=False)
+    with profile_stage(profiler, 'export_write'):
+        with pd.ExcelWriter(excel_filename, engine='openpyxl') as writer:
+            for table in EXPORT_TABLES:
+                frames[table].to_excel(writer, sheet_name=table, index=False)
 
     print(f"Data exported to {excel_filename}")
 
@@ -34,11 +63,15 @@ def export_to_excel():
 def main():
     parser = argparse.ArgumentParser(description='Export privatisation plans data to Excel')
     parser.add_argument('--export', action='store_true', help='Export data to Excel')
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
+    profiler = create_profiler(args)
     
     if args.export:
-        export_to_excel()
+        export_to_excel(profiler)
+        if profiler:
+            profiler.write_report()
     else:
         parser.print_help()
 
@@ -0,0 +1,721 @@
+#!/usr/bin/env python3
+"""
+Module with pluggable adapters for the datasets listed in list.json and a shared
+streaming download -> parse -> batch-write engine used by all of them
+"""
+
+import argparse
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import uuid
+from db_utils import (get_db_connection, add_missing_columns, create_index_sql, create_table_sqlite_to_sqlserver,
+                      optimize_database, upsert_rows)
+from mappings import registry_extractor, structure_version
+from validation import (QUARANTINE_COLUMNS, REGISTRY_REQUIRED, WARNING, Sampler, add_validation_arguments,
+                        document_validator, missing_properties, quarantine_row, registry_validator)
+from profiling import add_profile_arguments, create_profiler, profile_stage
+from registry_merge import RegistryIndex
+from writers import PartitionedWriter, add_writer_arguments, default_writers
+import archive
+import normalize
+import rawstore
+
+OPENDATA_URL = 'https://torgi.gov.ru/new/opendata/'
+
+# Retries of the HTTP session: statuses retried, attempts and the exponential backoff factor (seconds)
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.5
+# Downloads of a body cut off in transfer or not parseable as JSON, and the delay step between them
+FETCH_ATTEMPTS = 3
+FETCH_RETRY_DELAY = 1.0
+# Text of the error payload the portal returns with status 200 for a file it cannot serve
+UNAVAILABLE_MESSAGE = 'не существует или недоступен'
+
+# Columns of the registry tables filled from the listObjects of data-*.json files
+REGISTRY_COLUMNS = [
+    'globalid TEXT PRIMARY KEY',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'regnum TEXT NOT NULL',
+    'hostingorg NVARCHAR(20)',
+    'bidderorgcode NVARCHAR(20)',
+    'documenttype TEXT',
+    'publishdate TEXT',
+    'href TEXT'
+]
+
+# Columns of the generic document tables used by datasets without dedicated mappers
+DOCUMENT_COLUMNS = [
+    'globalid TEXT PRIMARY KEY',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'regnum TEXT',
+    'documenttype TEXT',
+    'doc_id TEXT',
+    'version TEXT',
+    'scheme_version TEXT',
+    'publish_date TEXT',
+    'hosting_org_code TEXT',
+    'bidder_org_code TEXT',
+    'content TEXT'
+]
+
+# Deduplicated organization dimension keyed by the portal organization code
+ORGANIZATION_COLUMNS = [
+    'code NVARCHAR(20) PRIMARY KEY',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'inn NVARCHAR(12)',
+    'kpp NVARCHAR(9)',
+    'ogrn NVARCHAR(15)',
+    'name TEXT',
+    'org_type NVARCHAR(20)'
+]
+
+DEFAULT_WORKERS = 8
+DEFAULT_BATCH_SIZE = 500
+
+# Tables whose primary key is not the first column
+TABLE_KEY_COLUMNS = {
+    rawstore.RAW_TABLE: rawstore.RAW_KEY_COLUMNS
+}
+
+
+class DatasetAdapter:
+    """
+    Describes one open data set of the portal: where its meta.json lives, which local
+    directory and registry table it uses, which tables its documents are written to and
+    which mapper turns each document type into rows.
+
+    Mappers are given as 'module:function' strings and resolved on first use, so adapters
+    can point at functions in modules that themselves import this one. A mapper is called
+    as mapper(reg_num, document_type, document) and returns {table: [row tuples]}.
+
+    With keep_raw every fetched document is also kept gzip-compressed in the raw
+    document store, so new fields can be promoted later without refetching.
+
+    Extensions are module names of derived structures maintained during ingest. An
+    extension module defines create_tables(cursor) and apply_batch(conn, adapter, rows),
+    which is called with the rows of each batch inside the batch transaction, in the
+    order the extensions are listed. An extension whose apply_batch() only adds (counters,
+    append-only indexes) also defines retract_batch(conn, adapter, rows), called with fact
+    rows about to be removed when a month is reloaded (partitions.py).
+    """
+
+    def __init__(self, identifier, directory, registry_table, tables, mappers, default_mapper=None, indexes=None,
+                 keep_raw=False, extensions=None):
+        self.identifier = identifier
+        self.directory = directory
+        self.registry_table = registry_table
+        self.tables = tables
+        self.mappers = mappers
+        self.default_mapper = default_mapper
+        self.indexes = indexes or []
+        self.keep_raw = keep_raw
+        self.extensions = extensions or []
+        self._resolved = {}
+
+    @property
+    def name(self):
+        return self.identifier.split('-', 1)[-1]
+
+    @property
+    def meta_url(self):
+        return f'{OPENDATA_URL}{self.identifier}/meta.json'
+
+    @property
+    def document_types(self):
+        return list(self.mappers)
+
+    def columns(self, table_name):
+        """Return the column names of one of the adapter tables"""
+        if table_name == self.registry_table:
+            definitions = REGISTRY_COLUMNS
+        elif table_name == 'quarantine':
+            definitions = QUARANTINE_COLUMNS
+        elif table_name == rawstore.RAW_TABLE:
+            return rawstore.columns()
+        else:
+            definitions = self.tables[table_name]
+        return [definition.split()[0] for definition in definitions]
+
+    def get_mapper(self, document_type):
+        """Resolve and cache the row mapper for a document type"""
+        if document_type not in self._resolved:
+            target = self.mappers.get(document_type, self.default_mapper)
+            if target is None:
+                self._resolved[document_type] = None
+            else:
+                module_name, function_name = target.split(':')
+                self._resolved[document_type] = getattr(importlib.import_module(module_name), function_name)
+        return self._resolved[document_type]
+
+    def get_extensions(self):
+        """Import and return the extension modules"""
+        return [importlib.import_module(module_name) for module_name in self.extensions]
+
+
+def map_generic_document(reg_num, document_type, document):
+    """Map any structured document to one row of the dataset's generic document table"""
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    common_info = document.get('commonInfo') or {}
+
+    return [(
+        str(uuid.uuid4()), now, now, reg_num, document_type,
+        document.get('id'),
+        document.get('version'),
+        document.get('schemeVersion'),
+        common_info.get('publishDate'),
+        (document.get('hostingOrg') or {}).get('code'),
+        (document.get('bidderOrg') or {}).get('code'),
+        json.dumps(document, ensure_ascii=False)
+    )]
+
+
+ADAPTERS = {
+    'privatizationPlans': DatasetAdapter(
+        identifier='7710568760-privatizationPlans',
+        directory='./privatisationplans/',
+        registry_table='privatisationplans',
+        tables={
+            'privatisationplanlist': [
+                'globalid TEXT PRIMARY KEY', 'createdate TEXT', 'updatedate TEXT', 'regnum NVARCHAR(36)',
+                'plan_number TEXT', 'plan_name TEXT', 'publish_date TEXT', 'signing_date TEXT',
+                'planing_period TEXT', 'org_code NVARCHAR(20)', 'org_name TEXT', 'org_inn TEXT', 'org_kpp TEXT',
+                'org_ogrn TEXT', 'org_type TEXT', 'budget_code TEXT', 'budget_name TEXT', 'authority TEXT',
+                'sum_first_year TEXT', 'sum_second_year TEXT', 'sum_third_year TEXT', 'version INTEGER',
+                'time_zone NVARCHAR(60)'
+            ] + normalize.column_definitions('privatisationplanlist'),
+            'privatizationobjects': [
+                'globalid TEXT PRIMARY KEY', 'createdate TEXT', 'updatedate TEXT', 'id TEXT',
+                'object_number TEXT', 'status_object TEXT', 'name TEXT', 'type TEXT', 'timing TEXT',
+                'subject_rf_code NVARCHAR(10)', 'subject_rf_name TEXT', 'location TEXT', 'purpose_code NVARCHAR(20)',
+                'purpose_name TEXT', 'kad_number TEXT', 'plan_version INTEGER', 'publish_month NVARCHAR(7)'
+            ],
+            'privatizationdecisions': [
+                'globalid TEXT PRIMARY KEY', 'createdate TEXT', 'updatedate TEXT', 'regnum NVARCHAR(36)',
+                'decision_number TEXT', 'publish_date TEXT', 'hosting_org_code NVARCHAR(20)',
+                'bidder_org_code NVARCHAR(20)', 'plan_number NVARCHAR(36)', 'object_number TEXT', 'object_name TEXT',
+                'object_type TEXT', 'start_price TEXT', 'privatization_reason TEXT', 'time_zone NVARCHAR(60)'
+            ] + normalize.column_definitions('privatizationdecisions'),
+            'organizations': ORGANIZATION_COLUMNS
+        },
+        mappers={
+            'privatizationPlan': 'main:map_privatization_plan',
+            'privatizationDecision': 'main:map_privatization_decision'
+        },
+        indexes=[
+            ('ix_privatisationplans_hostingorg', 'privatisationplans', ['hostingorg']),
+            ('ix_privatisationplanlist_org_code', 'privatisationplanlist', ['org_code']),
+            ('ix_organizations_inn', 'organizations', ['inn']),
+            ('ix_privatizationdecisions_plan_number', 'privatizationdecisions', ['plan_number']),
+            ('ix_privatisationplanlist_publish_date_utc', 'privatisationplanlist', ['publish_date_utc']),
+            ('ix_privatisationplanlist_signing_day', 'privatisationplanlist', ['signing_day']),
+            ('ix_privatizationdecisions_publish_date_utc', 'privatizationdecisions', ['publish_date_utc']),
+            ('ix_privatisationplanlist_regnum', 'privatisationplanlist', ['regnum']),
+            ('ix_privatizationobjects_subject_rf_code', 'privatizationobjects', ['subject_rf_code']),
+            ('ix_privatizationobjects_purpose_code', 'privatizationobjects', ['purpose_code']),
+            ('ix_privatisationplanlist_publish_month', 'privatisationplanlist', ['publish_month']),
+            ('ix_privatizationobjects_publish_month', 'privatizationobjects', ['publish_month']),
+            ('ix_privatizationdecisions_publish_month', 'privatizationdecisions', ['publish_month'])
+        ],
+        keep_raw=True,
+        extensions=['aggregates', 'search', 'cadastral', 'history', 'plandiff']
+    ),
+    'organization': DatasetAdapter(
+        identifier='7710568760-organization',
+        directory='./organization/',
+        registry_table='organization',
+        tables={'organizations': ORGANIZATION_COLUMNS},
+        mappers={},
+        default_mapper='organizations:map_organization_document',
+        indexes=[('ix_organizations_inn', 'organizations', ['inn'])]
+    ),
+    'notice': DatasetAdapter(
+        identifier='7710568760-notice',
+        directory='./notice/',
+        registry_table='notice',
+        tables={'notice_documents': DOCUMENT_COLUMNS},
+        mappers={},
+        default_mapper='datasets:map_notice_document'
+    ),
+    'contract': DatasetAdapter(
+        identifier='7710568760-contract',
+        directory='./contract/',
+        registry_table='contract',
+        tables={'contract_documents': DOCUMENT_COLUMNS},
+        mappers={},
+        default_mapper='datasets:map_contract_document'
+    )
+}
+
+
+def map_notice_document(reg_num, document_type, document):
+    """Map a notice document to the notice_documents table"""
+    return {'notice_documents': map_generic_document(reg_num, document_type, document)}
+
+
+def map_contract_document(reg_num, document_type, document):
+    """Map a contract document to the contract_documents table"""
+    return {'contract_documents': map_generic_document(reg_num, document_type, document)}
+
+
+def get_adapter(name):
+    """Return the adapter registered under a short name or a full list.json identifier"""
+    for key, adapter in ADAPTERS.items():
+        if name in (key, adapter.identifier):
+            return adapter
+    raise ValueError(f"Unknown dataset: {name}. Available: {', '.join(ADAPTERS)}")
+
+
+def create_session(workers=DEFAULT_WORKERS):
+    """Create an HTTP session with keep-alive connection pooling and retries on 429/5xx"""
+    # requests is imported by the commands that download, not by every command using the adapters
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=['GET'],
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=workers, pool_maxsize=workers)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def create_tables(adapter):
+    """Create the registry and document tables of a dataset"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    create_sql = f"CREATE TABLE IF NOT EXISTS {adapter.registry_table} ({', '.join(REGISTRY_COLUMNS)})"
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+
+    create_sql = f"CREATE TABLE IF NOT EXISTS quarantine ({', '.join(QUARANTINE_COLUMNS)})"
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+    add_missing_columns(cursor, 'quarantine', QUARANTINE_COLUMNS)
+
+    for table_name, columns in adapter.tables.items():
+        create_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
+        cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+        for column_name in add_missing_columns(cursor, table_name, columns):
+            print(f"Added column {table_name}.{column_name}")
+
+    if adapter.keep_raw:
+        rawstore.create_raw_tables(cursor)
+
+    for extension in adapter.get_extensions():
+        extension.create_tables(cursor)
+
+    for index_name, table_name, columns in adapter.indexes:
+        try:
+            cursor.execute(create_index_sql(index_name, table_name, columns))
+        except Exception as e:
+            # Tables created before the column got a bounded type cannot be indexed on SQL Server
+            print(f"Warning: Could not create index {index_name}: {str(e)}")
+
+    conn.commit()
+    conn.close()
+
+
+def download_meta(adapter):
+    """Download the dataset's meta.json and all data/structure files it lists into loaded/"""
+    from metadownload import download_file, download_meta_files
+
+    os.makedirs(adapter.directory, exist_ok=True)
+    meta_file = os.path.join(adapter.directory, 'meta.json')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    if download_file(adapter.meta_url, meta_file):
+        download_meta_files(meta_file, os.path.join(adapter.directory, 'loaded'))
+
+
+def registry_files(adapter):
+    """Return the registry data-*.json files waiting in the dataset directory"""
+    if not os.path.isdir(adapter.directory):
+        return []
+    return sorted(
+        os.path.join(adapter.directory, filename)
+        for filename in os.listdir(adapter.directory)
+        if filename.startswith('data-') and filename.endswith('.json')
+    )
+
+
+def registry_sources(files):
+    """Yield (filepath, size, listObjects) of registry files"""
+    for filepath in files:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        yield filepath, os.path.getsize(filepath), data.get('listObjects', [])
+
+
+def load_registry(adapter, files=None, batch_size=DEFAULT_BATCH_SIZE, profiler=None, validate_sample=1.0,
+                  from_archive=False):
+    """
+    Load registry entries (listObjects) of data-*.json files into the registry table.
+    With from_archive the entries are read from the dataset's registry archive (archive.py)
+    instead of the JSON files. A validate_sample share of entries is checked against the
+    file's structure version. Entries without a regnum, document type or href go to the
+    quarantine table instead; other violations are recorded there as warnings and the
+    entry is loaded (its document is fetched like any other). The files
+    are merged first (registry_merge.py), so only the newest entry per regnum and document
+    type is written, once, however many overlapping files list it.
+    """
+    columns = adapter.columns(adapter.registry_table)
+    quarantine_columns = adapter.columns('quarantine')
+    sample = Sampler(validate_sample)
+    index = RegistryIndex()
+    conn = get_db_connection('ingest')
+    loaded = 0
+
+    if from_archive:
+        sources = archive.file_entries(adapter.directory)
+    else:
+        sources = registry_sources(files if files is not None else registry_files(adapter))
+
+    started = time.perf_counter()
+    for rank, (filepath, size, objects) in enumerate(sources):
+        # Entries are read with the extractor compiled for the file's structure version
+        version = structure_version(filepath)
+        extract = registry_extractor(version)
+        validate = registry_validator(version)
+        now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        rejected = []
+        warned = []
+        for obj in objects:
+            errors = validate(obj) if validate is not None and sample() else []
+            missing = missing_properties(obj, REGISTRY_REQUIRED)
+            if missing:
+                rejected.append(quarantine_row(adapter.identifier, os.path.basename(filepath), obj.get('regNum'),
+                                               obj.get('documentType'), missing + errors, obj, now))
+                continue
+            if errors:
+                warned.append(quarantine_row(adapter.identifier, os.path.basename(filepath), obj.get('regNum'),
+                                             obj.get('documentType'), errors, obj, now, WARNING))
+            index.add(extract(obj), rank)
+        upsert_rows(conn, 'quarantine', quarantine_columns, rejected + warned)
+        conn.commit()
+        if rejected:
+            print(f"Quarantined {len(rejected)} invalid entries of {os.path.basename(filepath)}")
+        if warned:
+            print(f"Loaded {len(warned)} entries of {os.path.basename(filepath)} with schema warnings")
+
+        if profiler:
+            profiler.record_item('file', os.path.basename(filepath), size, time.perf_counter() - started)
+        started = time.perf_counter()
+
+    if index.duplicates:
+        print(f"Merged {index.seen} registry entries into {len(index)}, {index.duplicates} superseded")
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    rows = []
+    for values in index.rows():
+        rows.append((str(uuid.uuid4()), now, now) + values)
+        if len(rows) >= batch_size:
+            loaded += upsert_rows(conn, adapter.registry_table, columns, rows)
+            conn.commit()
+            rows = []
+    loaded += upsert_rows(conn, adapter.registry_table, columns, rows)
+    conn.commit()
+
+    optimize_database(conn)
+    conn.close()
+    return loaded
+
+
+def select_documents(adapter):
+    """
+    Return (regnum, documenttype, href) of the registry entries that reference a document,
+    only the newest entry per regnum and document type over all loads
+    """
+    index = RegistryIndex(['regnum', 'documenttype', 'publishdate', 'href'])
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    # Of entries published at the same time, the one loaded last wins
+    cursor.execute(f"""
+        SELECT regnum, documenttype, publishdate, href FROM {adapter.registry_table}
+        WHERE href IS NOT NULL
+        ORDER BY createdate
+    """)
+    index.add_all(tuple(row) for row in cursor)
+    conn.close()
+    return index.records()
+
+
+def portal_error(document):
+    """Return the message of a portal error payload ({"error": ...}), None for a regular file"""
+    if isinstance(document, dict) and 'error' in document:
+        return str(document['error'])
+    return None
+
+
+def fetch_content(session, url, timeout=60):
+    """
+    Download a JSON file and return (content bytes, parsed JSON). Statuses 429/5xx are retried
+    by the session; a body cut off in transfer or not parseable as JSON is downloaded again, up
+    to FETCH_ATTEMPTS times. The portal's error payload ("... не существует или недоступен")
+    raises LookupError without retrying, so it is never stored as the file.
+    """
+    import requests
+
+    for attempt in range(1, FETCH_ATTEMPTS + 1):
+        try:
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            document = response.json()
+            break
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError, ValueError):
+            if attempt == FETCH_ATTEMPTS:
+                raise
+            time.sleep(FETCH_RETRY_DELAY * attempt)
+
+    message = portal_error(document)
+    if message is not None:
+        raise LookupError(message)
+    return response.content, document
+
+
+def fetch_document(session, href, keep_raw=False):
+    """
+    Download one document and return (parsed JSON, size in bytes, compressed raw bytes).
+    The raw bytes are only compressed when keep_raw is set, in the download thread.
+    """
+    content, document = fetch_content(session, href)
+    raw = rawstore.compress(content) if keep_raw else None
+    return document, len(content), raw
+
+
+def fetch_documents(records, workers=DEFAULT_WORKERS, session=None, keep_raw=False):
+    """
+    Download documents concurrently, keeping at most 2 * workers requests in flight.
+    Yields (record, document, size, seconds, error, raw) as downloads complete.
+    """
+    session = session or create_session(workers)
+    pending = {}
+    records = iter(records)
+
+    def submit(executor, record):
+        started = time.perf_counter()
+        future = executor.submit(fetch_document, session, record[2], keep_raw)
+        pending[future] = (record, started)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record in records:
+            submit(executor, record)
+            if len(pending) >= workers * 2:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record, started = pending.pop(future)
+                try:
+                    document, size, raw = future.result()
+                    yield record, document, size, time.perf_counter() - started, None, raw
+                except Exception as e:
+                    yield record, None, None, time.perf_counter() - started, e, None
+
+                next_record = next(records, None)
+                if next_record is not None:
+                    submit(executor, next_record)
+
+
+def map_document(adapter, reg_num, document, validate=None, source=None, raw=None):
+    """
+    Map a downloaded document to {table: [rows]} with the adapter's mapper for its type.
+    When validate() returns True the document is checked first and, if it lacks a required
+    path, written to the quarantine table instead; other violations are recorded there as
+    warnings and the document is mapped. Compressed raw bytes, if given, go to the raw store.
+    """
+    structured_obj = document.get('exportObject', {}).get('structuredObject', {})
+    rows = {}
+
+    if raw is not None and adapter.keep_raw:
+        now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        rows[rawstore.RAW_TABLE] = [rawstore.raw_row(reg_num, source, document, raw, now)]
+
+    if not structured_obj and validate is not None and validate():
+        now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        errors = ['exportObject.structuredObject: required value is missing']
+        return {'quarantine': [quarantine_row(adapter.identifier, source, reg_num, None, errors, document, now)]}
+
+    for structured_type, content in structured_obj.items():
+        mapper = adapter.get_mapper(structured_type)
+        if mapper is None:
+            continue
+
+        if validate is not None:
+            validator = document_validator(structured_type)
+            errors, warnings = validator(content) if validator is not None and validate() else ([], [])
+            now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+            if errors:
+                rows.setdefault('quarantine', []).append(quarantine_row(
+                    adapter.identifier, source, reg_num, structured_type, errors + warnings, content, now))
+                continue
+            if warnings:
+                rows.setdefault('quarantine', []).append(quarantine_row(
+                    adapter.identifier, source, reg_num, structured_type, warnings, content, now, WARNING))
+
+        for table_name, table_rows in mapper(reg_num, structured_type, content).items():
+            rows.setdefault(table_name, []).extend(table_rows)
+    return rows
+
+
+def write_batch(conn, adapter, rows):
+    """Write accumulated rows of all tables and commit them as one transaction"""
+    written = 0
+    for table_name, table_rows in rows.items():
+        columns = adapter.columns(table_name)
+        key_columns = TABLE_KEY_COLUMNS.get(table_name, columns[:1])
+        key_positions = [columns.index(column) for column in key_columns]
+        # Keep only the last row per primary key, e.g. one row per organization code
+        table_rows = list({tuple(row[i] for i in key_positions): row for row in table_rows}.values())
+        written += upsert_rows(conn, table_name, columns, table_rows, key_columns)
+    # Derived tables are updated in the same transaction, so they never disagree with the facts
+    for extension in adapter.get_extensions():
+        extension.apply_batch(conn, adapter, rows)
+    conn.commit()
+    return written
+
+
+def process_documents(adapter, records=None, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                      profiler=None, validate_sample=1.0, session=None, failures=None, writers=1, optimize=True):
+    """
+    Download, parse and write all documents referenced in the dataset registry.
+    Documents are fetched concurrently and their rows written in batches of
+    batch_size documents, one transaction per batch. A validate_sample share of
+    documents is validated; invalid ones go to the quarantine table. A long-running
+    caller can pass its own session to keep the connections warm, and a failures
+    list to collect (href, error) of the documents that failed. With several writers
+    the batches are written in parallel, partitioned by registry number (writers.py).
+    A caller running it for many small batches (workqueue.py) passes optimize=False and
+    refreshes the statistics and the watermark once at the end.
+    """
+    if records is None:
+        records = select_documents(adapter)
+
+    conn = get_db_connection('ingest')
+    session = session or create_session(workers)
+    sink = PartitionedWriter(adapter, writers, batch_size) if writers > 1 else None
+    rows = {}
+    in_batch = 0
+    processed = 0
+    failed = 0
+    sample = Sampler(validate_sample)
+
+    try:
+        fetched = fetch_documents(records, workers, session, adapter.keep_raw)
+        for record, document, size, seconds, error, raw in fetched:
+            reg_num, document_type, href = record
+            if error is not None:
+                print(f"Error processing document {href}: {str(error)}")
+                failed += 1
+                if failures is not None:
+                    failures.append((href, str(error)))
+                continue
+
+            try:
+                document_rows = map_document(adapter, reg_num, document, sample, href, raw)
+            except Exception as e:
+                print(f"Error processing document {href}: {str(e)}")
+                failed += 1
+                if failures is not None:
+                    failures.append((href, str(e)))
+                continue
+
+            processed += 1
+            in_batch += 1
+            if profiler:
+                profiler.record_item('document', href, size, seconds)
+
+            if sink is not None:
+                sink.add(reg_num, document_rows)
+                if in_batch >= batch_size:
+                    print(f"Processed {processed} documents ({failed} failed)")
+                    in_batch = 0
+                continue
+
+            for table_name, table_rows in document_rows.items():
+                rows.setdefault(table_name, []).extend(table_rows)
+            if in_batch >= batch_size:
+                write_batch(conn, adapter, rows)
+                print(f"Processed {processed} documents ({failed} failed)")
+                rows = {}
+                in_batch = 0
+
+        if sink is not None:
+            sink.close()
+        else:
+            write_batch(conn, adapter, rows)
+        if optimize:
+            optimize_database(conn)
+    finally:
+        # Also after a failure: the writer threads are stopped and the connection is released
+        if sink is not None:
+            sink.close()
+        conn.close()
+    print(f"Processed {processed} documents ({failed} failed)")
+    return processed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download and process open data sets listed in list.json')
+    parser.add_argument('--dataset', required=True, help=f"Dataset name or identifier ({', '.join(ADAPTERS)})")
+    parser.add_argument('--createdb', action='store_true', help='Create dataset tables')
+    parser.add_argument('--download', action='store_true', help='Download meta.json and the files it lists')
+    parser.add_argument('--upload', action='store_true', help='Load registry data-*.json files into the database')
+    parser.add_argument('--from-archive', action='store_true',
+                        help='With --upload, read registry entries from the registry archive (archive.py)')
+    parser.add_argument('--processdocs', action='store_true', help='Download and process registry documents')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent document downloads')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Documents per write transaction')
+    add_writer_arguments(parser)
+    add_validation_arguments(parser)
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    adapter = get_adapter(args.dataset)
+    profiler = create_profiler(args)
+
+    if args.createdb:
+        print(f"Creating tables for {adapter.identifier}...")
+        with profile_stage(profiler, 'createdb'):
+            create_tables(adapter)
+
+    if args.download:
+        print(f"Downloading {adapter.meta_url}...")
+        with profile_stage(profiler, 'download'):
+            download_meta(adapter)
+
+    if args.upload:
+        print(f"Loading registry files of {adapter.identifier}...")
+        with profile_stage(profiler, 'upload'):
+            loaded = load_registry(adapter, batch_size=args.batch_size, profiler=profiler,
+                                   validate_sample=args.validate_sample, from_archive=args.from_archive)
+        print(f"Loaded {loaded} registry entries into {adapter.registry_table}")
+
+    if args.processdocs:
+        print(f"Processing documents of {adapter.identifier}...")
+        with profile_stage(profiler, 'processdocs'):
+            process_documents(adapter, workers=args.workers, batch_size=args.batch_size, profiler=profiler,
+                              validate_sample=args.validate_sample, writers=args.writers or default_writers())
+
+    if not any([args.createdb, args.download, args.upload, args.processdocs]):
+        parser.print_help()
+
+    if profiler:
+        profiler.write_report()
+
+
+if __name__ == '__main__':
+    main()
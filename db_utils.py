@@ -1,20 +1,71 @@
 import os
 import sqlite3
-from dotenv import load_dotenv
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
 
-# Load environment variables from .env file
-load_dotenv()
+SQLITE_DATABASE = 'torgi.db'
 
-def get_db_connection():
+# Exact sums (Decimal) are bound as text on SQLite; pyodbc binds them as DECIMAL
+sqlite3.register_adapter(Decimal, str)
+
+# Single-row counter advanced after every load, so readers can tell whether loaded data changed
+WATERMARK_TABLE = 'ingest_watermark'
+
+# SQLite settings for bulk loads: WAL lets readers work during a load and fsyncs only at
+# checkpoints, NORMAL sync is safe in WAL mode, a 256 MB page cache and 1 GB of mmap keep
+# index pages in memory
+SQLITE_INGEST_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-262144',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=1073741824'
+]
+
+SQLITE_READ_PRAGMAS = [
+    'PRAGMA query_only=ON',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=1073741824'
+]
+
+
+@lru_cache(maxsize=None)
+def load_environment():
+    """
+    Loads environment variables from the .env file once, on the first database access
+    rather than at import, so commands that never touch the database start without it.
+    Variables already set in the environment take precedence.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def get_db_connection(mode=None, db_type=None, database=None):
     """
     Creates and returns a database connection based on the TORGIDB environment variable.
     If TORGIDB=SQLITE (default), returns a SQLite connection.
     If TORGIDB=SQLSERVER, returns a MS SQL Server connection.
+
+    mode='ingest' tunes SQLite for bulk loads (WAL, relaxed sync, large cache); the caller
+    writes each batch in one transaction and commits it. mode='read' opens SQLite read-only
+    and asks SQL Server for read-only intent. db_type and database (the SQLite file or the
+    SQL Server database) override the configured ones, to open both backends at once.
     """
-    db_type = os.getenv('TORGIDB', 'SQLITE').upper()
+    load_environment()
+    db_type = (db_type or os.getenv('TORGIDB', 'SQLITE')).upper()
     
     if db_type == 'SQLITE':
-        return sqlite3.connect('torgi.db')
+        database = database or SQLITE_DATABASE
+        if mode == 'read':
+            conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+            pragmas = SQLITE_READ_PRAGMAS
+        else:
+            conn = sqlite3.connect(database)
+            pragmas = SQLITE_INGEST_PRAGMAS if mode == 'ingest' else []
+        for pragma in pragmas:
+            conn.execute(pragma)
+        return conn
     elif db_type == 'SQLSERVER':
         # Import pyodbc only when needed to avoid import errors when not available
         try:
@@ -24,7 +75,7 @@ def get_db_connection():
         
         # Get SQL Server connection parameters from environment variables
         server = os.getenv('SQL_SERVER', 'localhost')
-        database = os.getenv('SQL_DATABASE', 'torgi')
+        database = database or os.getenv('SQL_DATABASE', 'torgi')
         username = os.getenv('SQL_USERNAME')
         password = os.getenv('SQL_PASSWORD')
         driver = os.getenv('SQL_DRIVER', '{ODBC Driver 17 for SQL Server}')
@@ -35,7 +86,10 @@ def get_db_connection():
         else:
             # Use Windows authentication
             conn_str = f'DRIVER={driver};SERVER={server};DATABASE={database};Trusted_Connection=yes'
-        
+
+        if mode == 'read':
+            conn_str += ';ApplicationIntent=ReadOnly'
+
         return pyodbc.connect(conn_str)
     else:
         raise ValueError(f"Unsupported database type: {db_type}. Use 'SQLITE' or 'SQLSERVER'.")
@@ -158,11 +212,12 @@ WHEN NOT MATCHED THEN
         conn.close()
 
 
-def create_table_sqlite_to_sqlserver(sqlite_sql):
+def create_table_sqlite_to_sqlserver(sqlite_sql, db_type=None):
     """
-    Converts SQLite CREATE TABLE statements to SQL Server compatible syntax.
+    Converts SQLite CREATE TABLE statements to SQL Server compatible syntax
+    when the configured (or the given) database type is SQLSERVER.
     """
-    db_type = os.getenv('TORGIDB', 'SQLITE').upper()
+    db_type = db_type or os.getenv('TORGIDB', 'SQLITE').upper()
     
     if db_type == 'SQLSERVER':
         # Import pyodbc only when needed to avoid import errors when not available
@@ -175,6 +230,9 @@ def create_table_sqlite_to_sqlserver(sqlite_sql):
         # Convert SQLite-specific syntax to SQL Server
         sql_server_sql = sqlite_sql
 
+        # Replace BLOB with VARBINARY(MAX)
+        sql_server_sql = sql_server_sql.replace('BLOB', 'VARBINARY(MAX)')
+
         # Replace AUTOINCREMENT with IDENTITY
         sql_server_sql = sql_server_sql.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'INT IDENTITY(1,1) PRIMARY KEY')
 
@@ -208,4 +266,173 @@ END
         else:
             return sql_server_sql
     else:
-        return sqlite_sql
\ No newline at end of file
+        return sqlite_sql
+
+def get_db_type():
+    """Returns the configured database type (SQLITE or SQLSERVER)"""
+    load_environment()
+    return os.getenv('TORGIDB', 'SQLITE').upper()
+
+
+def connection_type(conn):
+    """Returns the database type (SQLITE or SQLSERVER) of an open connection"""
+    return 'SQLITE' if isinstance(conn, sqlite3.Connection) else 'SQLSERVER'
+
+
+def upsert_rows(conn, table_name, columns, rows, key_columns=None):
+    """
+    Writes a batch of rows into a table with a single executemany call.
+    The first column is treated as the primary key unless key_columns is given.
+    The caller owns the connection and decides when to commit, so a whole batch
+    can be written in one transaction.
+    """
+    if not rows:
+        return 0
+
+    cursor = conn.cursor()
+    placeholders = ', '.join(['?' for _ in columns])
+    key_columns = key_columns or columns[:1]
+
+    if get_db_type() == 'SQLSERVER':
+        column_list = ', '.join([f'[{col}]' for col in columns])
+        match_clause = ' AND '.join([f'target.[{col}] = source.[{col}]' for col in key_columns])
+        update_set_clause = ', '.join([f'target.[{col}] = source.[{col}]' for col in columns if col not in key_columns])
+        # HOLDLOCK keeps parallel writers (writers.py) from both inserting a key neither of them found
+        query = f"""
+MERGE [{table_name}] WITH (HOLDLOCK) AS target
+USING (VALUES ({placeholders})) AS source ({column_list})
+ON {match_clause}
+WHEN MATCHED THEN
+    UPDATE SET {update_set_clause}
+WHEN NOT MATCHED THEN
+    INSERT ({column_list})
+    VALUES ({', '.join([f'source.[{col}]' for col in columns])});
+"""
+        # Send the whole batch in one round-trip instead of one per row
+        cursor.fast_executemany = True
+    else:
+        query = f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    cursor.executemany(query, rows)
+    return len(rows)
+
+
+def increment_rows(conn, table_name, key_columns, value_columns, rows):
+    """
+    Adds a batch of deltas to counter rows: each row is key values followed by value deltas.
+    Missing rows are inserted with the deltas as their values. NULL counts as nothing to add,
+    so a sum stays NULL only while all its deltas are. The caller commits.
+    """
+    if not rows:
+        return 0
+
+    cursor = conn.cursor()
+    columns = key_columns + value_columns
+    placeholders = ', '.join(['?' for _ in columns])
+
+    if get_db_type() == 'SQLSERVER':
+        column_list = ', '.join([f'[{col}]' for col in columns])
+        match_clause = ' AND '.join([f'target.[{col}] = source.[{col}]' for col in key_columns])
+        increment_clause = ', '.join([f'target.[{col}] = COALESCE(target.[{col}] + source.[{col}], target.[{col}], '
+                                      f'source.[{col}])' for col in value_columns])
+        query = f"""
+MERGE [{table_name}] WITH (HOLDLOCK) AS target
+USING (VALUES ({placeholders})) AS source ({column_list})
+ON {match_clause}
+WHEN MATCHED THEN
+    UPDATE SET {increment_clause}
+WHEN NOT MATCHED THEN
+    INSERT ({column_list})
+    VALUES ({', '.join([f'source.[{col}]' for col in columns])});
+"""
+        cursor.fast_executemany = True
+    else:
+        increment_clause = ', '.join([f'{col} = COALESCE({col} + excluded.{col}, {col}, excluded.{col})'
+                                      for col in value_columns])
+        query = (f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) "
+                 f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {increment_clause}")
+
+    cursor.executemany(query, rows)
+    return len(rows)
+
+
+def optimize_database(conn=None):
+    """
+    Refreshes planner statistics after a load: ANALYZE and PRAGMA optimize on SQLite,
+    sp_updatestats on SQL Server. Every load ends here, so it also advances the ingest watermark.
+    """
+    own_connection = conn is None
+    conn = conn or get_db_connection()
+    mark_ingested(conn)
+    cursor = conn.cursor()
+
+    if connection_type(conn) == 'SQLSERVER':
+        cursor.execute("EXEC sp_updatestats")
+    else:
+        # Sample at most 1000 rows per index so ANALYZE stays fast on large tables
+        cursor.execute("PRAGMA analysis_limit=1000")
+        cursor.execute("ANALYZE")
+        cursor.execute("PRAGMA optimize")
+    conn.commit()
+
+    if own_connection:
+        conn.close()
+
+
+def mark_ingested(conn):
+    """Advances the ingest watermark; the caller commits"""
+    cursor = conn.cursor()
+    create_sql = f"CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (name NVARCHAR(20) PRIMARY KEY, value INTEGER, updatedate TEXT)"
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql, connection_type(conn)))
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    cursor.execute(f"UPDATE {WATERMARK_TABLE} SET value = value + 1, updatedate = ? WHERE name = 'ingest'", (now,))
+    if cursor.rowcount == 0:
+        cursor.execute(f"INSERT INTO {WATERMARK_TABLE} (name, value, updatedate) VALUES ('ingest', 1, ?)", (now,))
+
+
+def read_watermark(conn):
+    """Returns the ingest watermark, 0 if nothing was loaded yet"""
+    try:
+        row = conn.cursor().execute(f"SELECT value FROM {WATERMARK_TABLE} WHERE name = 'ingest'").fetchone()
+    except Exception:
+        # The table is created by the first load
+        return 0
+    return row[0] if row else 0
+
+
+def add_missing_columns(cursor, table_name, column_definitions):
+    """
+    Adds columns declared in column_definitions that an existing table does not have yet,
+    so tables created by an older version of the scripts keep working. Returns the added names.
+    """
+    cursor.execute(f"SELECT * FROM {table_name} WHERE 1 = 0")
+    existing = {column[0].lower() for column in cursor.description}
+    add_keyword = 'ADD' if get_db_type() == 'SQLSERVER' else 'ADD COLUMN'
+
+    added = []
+    for definition in column_definitions:
+        name = definition.split()[0]
+        # Key constraints cannot be added to an existing table this way
+        if name.lower() in existing or name.upper() == 'PRIMARY' or 'PRIMARY KEY' in definition.upper():
+            continue
+        column_sql = create_table_sqlite_to_sqlserver(definition)
+        cursor.execute(f"ALTER TABLE {table_name} {add_keyword} {column_sql}")
+        added.append(name)
+    return added
+
+
+def create_index_sql(index_name, table_name, columns, unique=False):
+    """
+    Returns a CREATE INDEX statement that is safe to run repeatedly on SQLite and SQL Server.
+    Indexed text columns must be declared with a bounded length (e.g. NVARCHAR(20)) to be
+    indexable on SQL Server.
+    """
+    unique_sql = 'UNIQUE ' if unique else ''
+    column_list = ', '.join(columns)
+
+    if get_db_type() == 'SQLSERVER':
+        return f"""
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='{index_name}' AND object_id = OBJECT_ID('{table_name}'))
+    CREATE {unique_sql}INDEX {index_name} ON {table_name} ({column_list})
+"""
+    return f"CREATE {unique_sql}INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_list})"
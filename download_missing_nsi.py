@@ -5,17 +5,25 @@ Script to download missing NSI data files from torgi-portal
 
 import json
 import os
-import requests
 import time
-from datetime import datetime
 
+# Pause between requests to the portal, in seconds
+REQUEST_DELAY = 1
 
-def download_missing_nsi_files():
-    """Download missing NSI files from the portal"""
+
+def download_missing_nsi_files(structure_file='./masterdata/data-20220101T0000-20251222T0000-structure-20250101.json',
+                                session=None, delay=REQUEST_DELAY):
+    """
+    Download missing NSI files listed in a masterdata registry file from the portal,
+    pausing delay seconds between requests
+    """
+    import requests
+    from datasets import create_session, fetch_content
+
+    # The session retries 429/5xx and keeps the connection open between files
+    session = session or create_session(1)
     
     # Load the structure file to get all NSI types and their URLs
-    structure_file = './masterdata/data-20220101T0000-20251222T0000-structure-20250101.json'
-
     with open(structure_file, 'r', encoding='utf-8') as f:
         structure_data = json.load(f)
 
@@ -42,28 +50,23 @@ def download_missing_nsi_files():
             print(f"Attempting to download: {nsi_type} from {href}")
             
             try:
-                # Try to download the file
-                response = requests.get(href, timeout=30)
+                # Try to download the file; a body cut off in transfer is downloaded again
+                content, _ = fetch_content(session, href, timeout=30)
+                
+                # Save the file through a temporary name: existing files are skipped on the next run
+                with open(f'{local_file_path}.part', 'wb') as f:
+                    f.write(content)
+                os.replace(f'{local_file_path}.part', local_file_path)
+                print(f"Successfully downloaded: {filename}")
                 
-                if response.status_code == 200:
-                    # Check if the response contains an error message
-                    if '"error"' in response.text or 'не существует или недоступен' in response.text:
-                        print(f"Downloaded file {filename} contains an error message. Skipping.")
-                        # Don't save the error message as a file
-                    else:
-                        # Save the file
-                        with open(local_file_path, 'w', encoding='utf-8') as f:
-                            f.write(response.text)
-                        print(f"Successfully downloaded: {filename}")
-                else:
-                    print(f"Failed to download {filename}. Status code: {response.status_code}")
-                    print(f"Response: {response.text[:200]}...")  # Show first 200 chars of response
-                    
-            except requests.exceptions.RequestException as e:
+            except LookupError as e:
+                # Don't save the error message as a file
+                print(f"Downloaded file {filename} contains an error message. Skipping. {str(e)}")
+            except (requests.exceptions.RequestException, ValueError) as e:
                 print(f"Error downloading {filename}: {str(e)}")
             
             # Be respectful to the server - add a small delay
-            time.sleep(1)
+            time.sleep(delay)
 
 
 def main():
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Module to keep every published version of a privatization plan with its validity interval.
+
+plan_history has one row per (regnum, version) valid from the version's publish date until
+the publish date of the next version (valid_to is NULL for the current version), both in UTC
+so plans published in different time zones compare correctly;
+plan_object_history holds the objects of each version. Ingest opens the interval of a new
+version and closes the interval of the previous one, so "the plan as of a date" is a range
+lookup on (regnum, valid_from) instead of a reconstruction from all versions.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+from datetime import datetime
+from db_utils import (get_db_connection, add_missing_columns, create_index_sql, create_table_sqlite_to_sqlserver,
+                      optimize_database, upsert_rows)
+from normalize import to_utc
+
+PLAN_HISTORY_TABLE = 'plan_history'
+OBJECT_HISTORY_TABLE = 'plan_object_history'
+
+PLAN_HISTORY_COLUMNS = [
+    'regnum NVARCHAR(36) NOT NULL',
+    'version INTEGER NOT NULL',
+    'valid_from NVARCHAR(30)',
+    'valid_to NVARCHAR(30)',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'plan_number TEXT',
+    'plan_name TEXT',
+    'signing_date TEXT',
+    'planing_period TEXT',
+    'org_code NVARCHAR(20)',
+    'budget_code TEXT',
+    'budget_name TEXT',
+    'authority TEXT',
+    'sum_first_year TEXT',
+    'sum_second_year TEXT',
+    'sum_third_year TEXT'
+]
+PLAN_HISTORY_KEYS = ['regnum', 'version']
+
+OBJECT_HISTORY_COLUMNS = [
+    'regnum NVARCHAR(36) NOT NULL',
+    'version INTEGER NOT NULL',
+    'object_number NVARCHAR(40) NOT NULL',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'status_object TEXT',
+    'name TEXT',
+    'type TEXT',
+    'timing TEXT',
+    'subject_rf_code TEXT',
+    'subject_rf_name TEXT',
+    'location TEXT',
+    'purpose_code TEXT',
+    'purpose_name TEXT',
+    'kad_number TEXT',
+    'object_hash NVARCHAR(32)'
+]
+OBJECT_HISTORY_KEYS = ['regnum', 'version', 'object_number']
+
+PLAN_HISTORY_FIELDS = [definition.split()[0] for definition in PLAN_HISTORY_COLUMNS]
+OBJECT_HISTORY_FIELDS = [definition.split()[0] for definition in OBJECT_HISTORY_COLUMNS]
+
+# Fact table columns copied into the history tables
+PLAN_COPY_FIELDS = PLAN_HISTORY_FIELDS[6:]
+OBJECT_COPY_FIELDS = OBJECT_HISTORY_FIELDS[5:-1]
+
+
+def create_tables(cursor):
+    """Create the plan history tables and the validity interval index"""
+    for table_name, columns, keys in ((PLAN_HISTORY_TABLE, PLAN_HISTORY_COLUMNS, PLAN_HISTORY_KEYS),
+                                      (OBJECT_HISTORY_TABLE, OBJECT_HISTORY_COLUMNS, OBJECT_HISTORY_KEYS)):
+        create_sql = (f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)}, "
+                      f"PRIMARY KEY ({', '.join(keys)}))")
+        cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+        add_missing_columns(cursor, table_name, columns)
+    cursor.execute(create_index_sql(f'ix_{PLAN_HISTORY_TABLE}_validity', PLAN_HISTORY_TABLE,
+                                    ['regnum', 'valid_from', 'valid_to']))
+
+
+def close_intervals(cursor, reg_num, version, valid_from, now):
+    """
+    Fit a version into the interval chain of its plan: it is valid until the next newer
+    version starts, and older versions overlapping it are closed at its start (and get
+    updatedate now, so replication picks the change up). Returns the valid_to of the
+    version. Versions may arrive in any order.
+    """
+    cursor.execute(f"""
+        SELECT MIN(valid_from) FROM {PLAN_HISTORY_TABLE}
+        WHERE regnum = ? AND version > ?
+    """, (reg_num, version))
+    valid_to = cursor.fetchone()[0]
+
+    cursor.execute(f"""
+        UPDATE {PLAN_HISTORY_TABLE} SET valid_to = ?, updatedate = ?
+        WHERE regnum = ? AND version < ? AND (valid_to IS NULL OR valid_to > ?)
+    """, (valid_from, now, reg_num, version, valid_from))
+    return valid_to
+
+
+def object_hash(values):
+    """Hash the content fields of an object, so unchanged objects of two versions compare by one value"""
+    content = json.dumps(list(values), ensure_ascii=False, default=str)
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def history_rows(plans, objects, now):
+    """
+    Build history rows from fact rows (dicts) of one batch.
+    Returns {(regnum, version): (plan dict, [object history rows])}.
+
+    An object without a number is keyed by its content hash, the same in every version it
+    is unchanged in. A number repeated within a version gets the hash of each further
+    object appended, so distinct objects sharing a number are all kept.
+    """
+    versions = {}
+    for plan in plans:
+        versions[(plan['regnum'], int(plan.get('version') or 0))] = (plan, [])
+
+    numbers = {}
+    for item in objects:
+        key = (item['id'], int(item.get('plan_version') or 0))
+        if key not in versions:
+            continue
+        values = tuple(item.get(field) for field in OBJECT_COPY_FIELDS)
+        content_hash = object_hash(values)
+        object_number = item.get('object_number') or f'#{content_hash}'
+        taken = numbers.setdefault(key, set())
+        if object_number in taken:
+            object_number = f'{object_number[:31]}#{content_hash[:8]}'
+        taken.add(object_number)
+        versions[key][1].append(key + (object_number, now, now) + values + (content_hash,))
+    return versions
+
+
+def write_history(conn, versions, now):
+    """Insert plan versions into the history tables and adjust the validity intervals"""
+    cursor = conn.cursor()
+    object_rows = []
+    # Older versions first and one at a time, so versions of one plan in the same batch chain correctly
+    for (reg_num, version), (plan, objects) in sorted(versions.items(), key=lambda entry: entry[0][1]):
+        valid_from = plan.get('publish_date_utc')
+        valid_to = close_intervals(cursor, reg_num, version, valid_from, now)
+        plan_row = (reg_num, version, valid_from, valid_to, now, now) + tuple(plan.get(field)
+                                                                           for field in PLAN_COPY_FIELDS)
+        upsert_rows(conn, PLAN_HISTORY_TABLE, PLAN_HISTORY_FIELDS, [plan_row], PLAN_HISTORY_KEYS)
+        # A republished version replaces its previous object set
+        cursor.execute(f"DELETE FROM {OBJECT_HISTORY_TABLE} WHERE regnum = ? AND version = ?", (reg_num, version))
+        object_rows.extend(objects)
+
+    # Only identical objects listed twice share a key by now; they are stored once
+    upsert_rows(conn, OBJECT_HISTORY_TABLE, OBJECT_HISTORY_FIELDS,
+                list({row[:3]: row for row in object_rows}.values()), OBJECT_HISTORY_KEYS)
+    return len(versions)
+
+
+def apply_batch(conn, adapter, rows):
+    """Record the plan versions of an ingest batch in the history tables, the caller commits"""
+    plan_rows = rows.get('privatisationplanlist', [])
+    if not plan_rows:
+        return
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    plan_columns = adapter.columns('privatisationplanlist')
+    object_columns = adapter.columns('privatizationobjects')
+    versions = history_rows([dict(zip(plan_columns, row)) for row in plan_rows],
+                            [dict(zip(object_columns, row)) for row in rows.get('privatizationobjects', [])], now)
+    write_history(conn, versions, now)
+
+
+def rebuild_history():
+    """Rebuild the history tables from all plan versions kept in the raw document store"""
+    from datasets import get_adapter
+    from main import map_privatization_plan
+
+    adapter = get_adapter('privatizationPlans')
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+    create_tables(cursor)
+    cursor.execute(f"DELETE FROM {PLAN_HISTORY_TABLE}")
+    cursor.execute(f"DELETE FROM {OBJECT_HISTORY_TABLE}")
+
+    read_cursor = conn.cursor()
+    read_cursor.execute("""
+        SELECT regnum, content FROM rawdocuments
+        WHERE documenttype = 'privatizationPlan'
+        ORDER BY regnum, version
+    """)
+    rebuilt = 0
+    for reg_num, content in read_cursor.fetchall():
+        document = json.loads(gzip.decompress(content))
+        plan = document['exportObject']['structuredObject']['privatizationPlan']
+        apply_batch(conn, adapter, map_privatization_plan(reg_num, 'privatizationPlan', plan))
+        rebuilt += 1
+    conn.commit()
+    optimize_database(conn)
+    conn.close()
+    print(f"Plan history rebuilt: {rebuilt} versions")
+    return rebuilt
+
+
+def plan_as_of(reg_num, moment):
+    """Return the plan version (dict) valid at a moment (ISO date or date-time, UTC unless it has an offset), or None"""
+    moment = to_utc(moment) or moment
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(PLAN_HISTORY_FIELDS)} FROM {PLAN_HISTORY_TABLE}
+        WHERE regnum = ? AND valid_from <= ? AND (valid_to IS NULL OR valid_to > ?)
+    """, (reg_num, moment, moment))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(zip(PLAN_HISTORY_FIELDS, row)) if row else None
+
+
+def objects_of_version(reg_num, version):
+    """Return the objects (dicts) of one plan version"""
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(OBJECT_HISTORY_FIELDS)} FROM {OBJECT_HISTORY_TABLE}
+        WHERE regnum = ? AND version = ?
+        ORDER BY object_number
+    """, (reg_num, version))
+    rows = [dict(zip(OBJECT_HISTORY_FIELDS, row)) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def plan_versions(reg_num):
+    """Return (version, valid_from, valid_to) of all stored versions of a plan"""
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT version, valid_from, valid_to FROM {PLAN_HISTORY_TABLE}
+        WHERE regnum = ?
+        ORDER BY version
+    """, (reg_num,))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Versioned (as-of) history of privatization plans')
+    parser.add_argument('regnum', nargs='?', help='Plan registry number')
+    parser.add_argument('--as-of', metavar='DATE',
+                        help='Show the plan version valid at DATE (YYYY-MM-DD[THH:MM:SS], UTC unless it has an offset)')
+    parser.add_argument('--createdb', action='store_true', help='Create the history tables')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the history from the raw document store')
+
+    args = parser.parse_args()
+
+    if args.createdb:
+        conn = get_db_connection()
+        create_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        print("Plan history tables created successfully.")
+
+    if args.rebuild:
+        rebuild_history()
+
+    if args.regnum and args.as_of:
+        plan = plan_as_of(args.regnum, args.as_of)
+        if plan is None:
+            print(f"No version of {args.regnum} was valid at {args.as_of}")
+        else:
+            print(f"Version {plan['version']} ({plan['valid_from']} - {plan['valid_to'] or 'current'})")
+            for item in objects_of_version(args.regnum, plan['version']):
+                print(f"  {item['object_number']}\t{item['status_object']}\t{item['name']}")
+    elif args.regnum:
+        for version, valid_from, valid_to in plan_versions(args.regnum):
+            print(f"{version}\t{valid_from}\t{valid_to or 'current'}")
+
+    if not any([args.createdb, args.rebuild, args.regnum]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,16 @@ Main module for downloading and processing open data from torgi.gov.ru
 """
 
 import argparse
-import os
-import sys
 from datetime import datetime
-import json
 import uuid
-import requests
-from urllib.parse import urljoin
-from db_utils import get_db_connection, execute_query, create_table_sqlite_to_sqlserver
+from db_utils import get_db_connection, create_table_sqlite_to_sqlserver
+from datasets import (DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, create_session, create_tables, fetch_document,
+                      get_adapter, load_registry, map_document, process_documents, write_batch)
+from mappings import document_extractor
+from organizations import organization_row
+from profiling import add_profile_arguments, create_profiler, profile_stage
+from validation import add_validation_arguments
+from writers import add_writer_arguments, default_writers
 
 
 def create_database():
@@ -26,8 +28,8 @@ def create_database():
             createdate TEXT,
             updatedate TEXT,
             regnum TEXT NOT NULL,
-            hostingorg TEXT,
-            bidderorgcode TEXT,
+            hostingorg NVARCHAR(20),
+            bidderorgcode NVARCHAR(20),
             documenttype TEXT,
             publishdate TEXT,
             href TEXT
@@ -41,13 +43,13 @@ def create_database():
             globalid TEXT PRIMARY KEY,
             createdate TEXT,
             updatedate TEXT,
-            regnum TEXT,
+            regnum NVARCHAR(36),
             plan_number TEXT,
             plan_name TEXT,
             publish_date TEXT,
             signing_date TEXT,
             planing_period TEXT,
-            org_code TEXT,
+            org_code NVARCHAR(20),
             org_name TEXT,
             org_inn TEXT,
             org_kpp TEXT,
@@ -58,7 +60,16 @@ def create_database():
             authority TEXT,
             sum_first_year TEXT,
             sum_second_year TEXT,
-            sum_third_year TEXT
+            sum_third_year TEXT,
+            version INTEGER,
+            time_zone NVARCHAR(60),
+            publish_date_utc DATETIME2,
+            signing_day DATE,
+            created_at DATETIME2,
+            sum_first_year_amount DECIMAL(18,2),
+            sum_second_year_amount DECIMAL(18,2),
+            sum_third_year_amount DECIMAL(18,2),
+            publish_month NVARCHAR(7)
         )
     '''
     cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
@@ -75,12 +86,14 @@ def create_database():
             name TEXT,
             type TEXT,
             timing TEXT,
-            subject_rf_code TEXT,
+            subject_rf_code NVARCHAR(10),
             subject_rf_name TEXT,
             location TEXT,
-            purpose_code TEXT,
+            purpose_code NVARCHAR(20),
             purpose_name TEXT,
-            kad_number TEXT
+            kad_number TEXT,
+            plan_version INTEGER,
+            publish_month NVARCHAR(7)
         )
     '''
     cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
@@ -88,138 +101,81 @@ def create_database():
     conn.commit()
     conn.close()
 
+    # Create the organization dimension and the indexes declared by the dataset adapter
+    create_tables(get_adapter('privatizationPlans'))
 
-def load_privatisation_data():
-    """Load privatisation data from JSON files into database tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    # Load data from privatisationplans data files
-    priv_dir = './privatisationplans/'
-    for filename in os.listdir(priv_dir):
-        if filename.startswith('data-') and filename.endswith('.json'):
-            filepath = os.path.join(priv_dir, filename)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+def load_privatisation_data(profiler=None, batch_size=DEFAULT_BATCH_SIZE, validate_sample=1.0, files=None):
+    """Load privatisation data from JSON files (by default those waiting in privatisationplans/) into database tables"""
+    # Registry entries are written in batches, one transaction per batch
+    return load_registry(get_adapter('privatizationPlans'), files=files, batch_size=batch_size, profiler=profiler,
+                         validate_sample=validate_sample)
 
-                for obj in data.get('listObjects', []):
-                    global_id = str(uuid.uuid4())
-                    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
-                    # Insert into privatisationplans table
-                    # Using execute_query function to handle differences between SQLite and SQL Server
-                    execute_query('''
-                        INSERT OR REPLACE INTO privatisationplans
-                        (globalid, createdate, updatedate, regnum, hostingorg, bidderorgcode, documenttype, publishdate, href)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        global_id, now, now,
-                        obj.get('regNum'),
-                        obj.get('hostingOrg'),
-                        obj.get('bidderOrgCode'),
-                        obj.get('documentType'),
-                        obj.get('publishDate'),
-                        obj.get('href')
-                    ))
+def map_privatization_plan(reg_num, document_type, plan_data):
+    """Map a privatizationPlan document to rows of privatisationplanlist, privatizationobjects and organizations"""
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
+    # Dispatch to the extractor compiled for this document's scheme version
+    extract = document_extractor(document_type, plan_data.get('schemeVersion'))
+    rows = extract(plan_data, reg_num, now, new_global_id)
 
-def download_and_process_document(href_url, reg_num):
-    """Download and process individual document from href"""
-    try:
-        response = requests.get(href_url)
-        response.raise_for_status()
+    org_row = organization_row(plan_data.get('hostingOrg', {}), now)
+    rows['organizations'] = [org_row] if org_row else []
+    return rows
 
-        doc_data = response.json()
-        export_obj = doc_data.get('exportObject', {})
-        structured_obj = export_obj.get('structuredObject', {})
 
-        # Process different types of documents
-        if 'privatizationPlan' in structured_obj:
-            plan_data = structured_obj['privatizationPlan']
+def map_privatization_decision(reg_num, document_type, decision_data):
+    """Map a privatizationDecision document to rows of privatizationdecisions and organizations"""
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    rows = document_extractor(document_type, decision_data.get('schemeVersion'))(decision_data, reg_num, now,
+                                                                               new_global_id)
 
-            global_id = str(uuid.uuid4())
-            now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    org_row = organization_row(decision_data.get('bidderOrg', {}), now)
+    rows['organizations'] = [org_row] if org_row else []
+    return rows
 
-            common_info = plan_data.get('commonInfo', {})
-            hosting_org = plan_data.get('hostingOrg', {})
-            planing_period = plan_data.get('planingPeriodInfo', {})
-            budget_revenue = plan_data.get('budgetRevenueForecast', {})
 
-            # Insert into privatisationplanlist table
-            execute_query('''
-                INSERT OR REPLACE INTO privatisationplanlist
-                (globalid, createdate, updatedate, regnum, plan_number, plan_name,
-                publish_date, signing_date, planing_period, org_code, org_name,
-                org_inn, org_kpp, org_ogrn, org_type, budget_code, budget_name,
-                authority, sum_first_year, sum_second_year, sum_third_year)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                global_id, now, now, reg_num,
-                common_info.get('planNumber'),
-                common_info.get('name'),
-                common_info.get('publishDate'),
-                planing_period.get('signingDate'),
-                planing_period.get('planingPeriod'),
-                hosting_org.get('code'),
-                hosting_org.get('name'),
-                hosting_org.get('INN'),
-                hosting_org.get('KPP'),
-                hosting_org.get('OGRN'),
-                hosting_org.get('orgType'),
-                budget_revenue.get('budget', {}).get('code'),
-                budget_revenue.get('budget', {}).get('name'),
-                budget_revenue.get('authority'),
-                budget_revenue.get('sumFirstYear'),
-                budget_revenue.get('sumSecondYear'),
-                budget_revenue.get('sumThirdYear')
-            ))
+def new_global_id():
+    """Generate a globalid value"""
+    return str(uuid.uuid4())
 
-            # Process privatization objects
-            for obj in plan_data.get('privatizationObjects', []):
-                obj_global_id = str(uuid.uuid4())
 
-                subject_rf = obj.get('subjectRF', {})
-                purpose = obj.get('purpose', {})
+def download_and_process_document(href_url, reg_num, session=None):
+    """Download and process individual document from href, returning its size in bytes"""
+    adapter = get_adapter('privatizationPlans')
+    try:
+        # The session retries 429/5xx, fetch_document also a body cut off in transfer
+        document, size, raw = fetch_document(session or create_session(1), href_url, adapter.keep_raw)
 
-                execute_query('''
-                    INSERT OR REPLACE INTO privatizationobjects
-                    (globalid, createdate, updatedate, id, object_number, status_object,
-                    name, type, timing, subject_rf_code, subject_rf_name, location,
-                    purpose_code, purpose_name, kad_number)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    obj_global_id, now, now, reg_num,
-                    obj.get('objectNumber'),
-                    obj.get('statusObject'),
-                    obj.get('name'),
-                    obj.get('type'),
-                    obj.get('timing'),
-                    subject_rf.get('code'),
-                    subject_rf.get('name'),
-                    obj.get('location'),
-                    purpose.get('code'),
-                    purpose.get('name'),
-                    obj.get('kadNumber')
-                ))
+        conn = get_db_connection()
+        try:
+            write_batch(conn, adapter, map_document(adapter, reg_num, document, source=href_url, raw=raw))
+        finally:
+            conn.close()
+
+        return size
 
     except Exception as e:
         print(f"Error processing document {href_url}: {str(e)}")
-
-
-def process_all_documents():
-    """Process all documents referenced in the privatisation plans"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Get all records with href from privatisationplans
-    cursor.execute("SELECT regnum, href FROM privatisationplans WHERE href IS NOT NULL")
-    records = cursor.fetchall()
-
-    for reg_num, href in records:
-        print(f"Processing document for regnum: {reg_num}")
-        download_and_process_document(href, reg_num)
-
-    conn.close()
+        return None
+
+
+def process_all_documents(profiler=None, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                          validate_sample=1.0, queue=False, writers=1):
+    """
+    Process all documents referenced in the privatisation plans. With queue the documents
+    are taken in leased batches from the shared queue (workqueue.py --fill), so several
+    processes or machines can split them; writers sets the parallel database writers.
+    """
+    adapter = get_adapter('privatizationPlans')
+    if queue:
+        from workqueue import run_worker
+        return run_worker(adapter, workers=workers, batch_size=batch_size, profiler=profiler,
+                          validate_sample=validate_sample, writers=writers)
+    # Documents are downloaded concurrently and written in batches by the shared dataset engine
+    return process_documents(adapter, workers=workers, batch_size=batch_size,
+                             profiler=profiler, validate_sample=validate_sample, writers=writers)
 
 
 def main():
@@ -227,27 +183,44 @@ def main():
     parser.add_argument('--createdb', action='store_true', help='Create database tables')
     parser.add_argument('--privplansupload', action='store_true', help='Upload privatisation plans data')
     parser.add_argument('--processdocs', action='store_true', help='Process document files')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent document downloads')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows/documents per write transaction')
+    parser.add_argument('--queue', action='store_true',
+                        help='With --processdocs take documents from the shared queue (workqueue.py --fill)')
+    add_writer_arguments(parser)
+    add_validation_arguments(parser)
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
+    profiler = create_profiler(args)
     
     # Create database if requested
     if args.createdb:
         print("Creating database tables...")
-        create_database()
+        with profile_stage(profiler, 'createdb'):
+            create_database()
         print("Database tables created successfully.")
     
     # Upload privatisation plans data if requested
     if args.privplansupload:
         print("Loading privatisation data...")
-        load_privatisation_data()
+        with profile_stage(profiler, 'privplansupload'):
+            load_privatisation_data(profiler, batch_size=args.batch_size,
+                                    validate_sample=args.validate_sample)
         print("Privatisation data loaded successfully.")
     
     # Process document files if requested
     if args.processdocs:
         print("Processing document files...")
-        process_all_documents()
+        with profile_stage(profiler, 'processdocs'):
+            process_all_documents(profiler, workers=args.workers, batch_size=args.batch_size,
+                                  validate_sample=args.validate_sample, queue=args.queue,
+                                  writers=args.writers or default_writers())
         print("Document files processed successfully.")
     
+    if profiler:
+        profiler.write_report()
+    
     # If no arguments provided, show help
     if not any([args.createdb, args.privplansupload, args.processdocs]):
         parser.print_help()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Module with structure-version aware field mappings compiled into extractor functions.
+
+Registry entries (listObjects of data-*.json) are described by the published
+structure-*.json files, so one registry extractor is compiled per structure version
+from the properties the structure declares. Document contents are described by
+DOCUMENT_SPECS per document type and schemeVersion. Each spec is compiled once into a
+straight-line Python function and cached, so the hot path does no per-field lookups
+of mapping tables.
+"""
+
+import glob
+import json
+import os
+import re
+from functools import lru_cache
+from normalize import CONVERTERS
+
+# Registry columns and the listObjects properties they are read from, in order of preference
+REGISTRY_FIELDS = [
+    ('regnum', ('regNum', 'code')),
+    ('hostingorg', ('hostingOrg',)),
+    ('bidderorgcode', ('bidderOrgCode',)),
+    ('documenttype', ('documentType',)),
+    ('publishdate', ('publishDate',)),
+    ('href', ('href',))
+]
+
+# Directories searched for structure-*.json files
+STRUCTURE_DIRS = [
+    './privatisationplans/',
+    './privatisationplans/loaded/',
+    './masterdata/',
+    './masterdata/loaded/'
+]
+
+# Special sources available to every spec besides JSON paths:
+#   $uuid - a new globalid, $now - the row timestamp, $regnum - registry number of the document,
+#   $doc.<path> - a path from the document root (for list items), None - always NULL
+#   (the column is kept for compatibility but filled elsewhere)
+# A tuple starting with '$<converter>' passes the values of the other sources to a converter
+# of normalize.py, e.g. ('$to_amount', 'startPrice') fills a DECIMAL shadow column.
+PLAN_LIST_FIELDS = [
+    ('globalid', '$uuid'),
+    ('createdate', '$now'),
+    ('updatedate', '$now'),
+    ('regnum', '$regnum'),
+    ('plan_number', 'commonInfo.planNumber'),
+    ('plan_name', 'commonInfo.name'),
+    ('publish_date', 'commonInfo.publishDate'),
+    ('signing_date', 'planingPeriodInfo.signingDate'),
+    ('planing_period', 'planingPeriodInfo.planingPeriod'),
+    ('org_code', 'hostingOrg.code'),
+    # Organization details live in the organizations table, keyed by org_code
+    ('org_name', None),
+    ('org_inn', None),
+    ('org_kpp', None),
+    ('org_ogrn', None),
+    ('org_type', None),
+    ('budget_code', 'budgetRevenueForecast.budget.code'),
+    ('budget_name', 'budgetRevenueForecast.budget.name'),
+    ('authority', 'budgetRevenueForecast.authority'),
+    ('sum_first_year', 'budgetRevenueForecast.sumFirstYear'),
+    ('sum_second_year', 'budgetRevenueForecast.sumSecondYear'),
+    ('sum_third_year', 'budgetRevenueForecast.sumThirdYear'),
+    ('version', 'version'),
+    ('time_zone', 'commonInfo.timeZone.name'),
+    ('publish_date_utc', ('$to_utc', 'commonInfo.publishDate', 'commonInfo.timeZone.name')),
+    ('signing_day', ('$to_day', 'planingPeriodInfo.signingDate')),
+    ('created_at', ('$to_datetime', '$now')),
+    ('sum_first_year_amount', ('$to_amount', 'budgetRevenueForecast.sumFirstYear')),
+    ('sum_second_year_amount', ('$to_amount', 'budgetRevenueForecast.sumSecondYear')),
+    ('sum_third_year_amount', ('$to_amount', 'budgetRevenueForecast.sumThirdYear')),
+    ('publish_month', ('$to_month', 'commonInfo.publishDate', 'commonInfo.timeZone.name'))
+]
+
+PLAN_OBJECT_FIELDS = [
+    ('globalid', '$uuid'),
+    ('createdate', '$now'),
+    ('updatedate', '$now'),
+    ('id', '$regnum'),
+    ('object_number', 'objectNumber'),
+    ('status_object', 'statusObject'),
+    ('name', 'name'),
+    ('type', 'type'),
+    ('timing', 'timing'),
+    ('subject_rf_code', 'subjectRF.code'),
+    ('subject_rf_name', 'subjectRF.name'),
+    ('location', 'location'),
+    ('purpose_code', 'purpose.code'),
+    ('purpose_name', 'purpose.name'),
+    ('kad_number', 'kadNumber'),
+    ('plan_version', '$doc.version'),
+    ('publish_month', ('$to_month', '$doc.commonInfo.publishDate', '$doc.commonInfo.timeZone.name'))
+]
+
+
+DECISION_FIELDS = [
+    ('globalid', '$uuid'),
+    ('createdate', '$now'),
+    ('updatedate', '$now'),
+    ('regnum', '$regnum'),
+    ('decision_number', 'commonInfo.decisionNumber'),
+    ('publish_date', 'commonInfo.publishDate'),
+    ('hosting_org_code', 'hostingOrg.code'),
+    ('bidder_org_code', 'bidderOrg.code'),
+    ('plan_number', 'privatizationObject.planNumber'),
+    ('object_number', 'privatizationObject.objectNumber'),
+    ('object_name', 'privatizationObject.name'),
+    ('object_type', 'privatizationObject.type'),
+    ('start_price', 'startPrice'),
+    ('privatization_reason', 'privatizationReason'),
+    ('time_zone', 'commonInfo.timeZone.name'),
+    ('publish_date_utc', ('$to_utc', 'commonInfo.publishDate', 'commonInfo.timeZone.name')),
+    ('created_at', ('$to_datetime', '$now')),
+    ('start_price_amount', ('$to_amount', 'startPrice')),
+    ('publish_month', ('$to_month', 'commonInfo.publishDate', 'commonInfo.timeZone.name'))
+]
+
+
+def override_fields(fields, overrides):
+    """Return a copy of a field list with the sources of some columns replaced"""
+    return [(column, overrides.get(column, source)) for column, source in fields]
+
+
+# Document specs per document type and the first schemeVersion they apply to.
+# A spec is {table: (list path or None, fields)}; a list path produces one row per item.
+# Since scheme 4.3 budget and authority are published on the plan itself, not in the forecast.
+DOCUMENT_SPECS = {
+    'privatizationPlan': {
+        '0': {
+            'privatisationplanlist': (None, PLAN_LIST_FIELDS),
+            'privatizationobjects': ('privatizationObjects', PLAN_OBJECT_FIELDS)
+        },
+        '4.3': {
+            'privatisationplanlist': (None, override_fields(PLAN_LIST_FIELDS, {
+                'budget_code': ('budget.code', 'budgetRevenueForecast.budget.code'),
+                'budget_name': ('budget.name', 'budgetRevenueForecast.budget.name'),
+                'authority': ('authority', 'budgetRevenueForecast.authority')
+            })),
+            'privatizationobjects': ('privatizationObjects', PLAN_OBJECT_FIELDS)
+        }
+    },
+    'privatizationDecision': {
+        '0': {
+            'privatizationdecisions': (None, DECISION_FIELDS)
+        }
+    }
+}
+
+
+def version_key(version):
+    """Sort key for dotted scheme versions such as '4.3' or '4.10'"""
+    return tuple(int(part) if part.isdigit() else 0 for part in str(version).split('.'))
+
+
+def structure_version(filepath):
+    """Extract the structure version from a registry file name (data-...-structure-20230401.json)"""
+    match = re.search(r'structure-(\d+)\.json$', os.path.basename(filepath))
+    return match.group(1) if match else None
+
+
+@lru_cache(maxsize=None)
+def load_structure(version):
+    """Load the structure-<version>.json file, or None if it is not available locally"""
+    for directory in STRUCTURE_DIRS:
+        for path in glob.glob(os.path.join(directory, f'structure-{version}.json')):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    return None
+
+
+def list_object_definition(structure):
+    """Return the definition of the registry list object (PlanListObject, NsiListObject, ...)"""
+    items = structure.get('definitions', {}).get('ListObjects', {}).get('items', {})
+    ref = items.get('$ref', '')
+    return structure.get('definitions', {}).get(ref.split('/')[-1], {})
+
+
+def child(value, key):
+    """Read a property of a JSON object; a list, string or number on the path has none"""
+    return value.get(key) if isinstance(value, dict) else None
+
+
+def path_expression(var, path):
+    """Build a Python expression reading a dotted JSON path from a variable (None if the path is absent)"""
+    expression = var
+    for key in path.split('.'):
+        expression = f"child({expression}, {key!r})"
+    return expression
+
+
+def source_expression(var, source):
+    """Build a Python expression for a field source (path, alternative paths or special value)"""
+    if source is None:
+        return 'None'
+    if source == '$uuid':
+        return 'new_id()'
+    if source == '$now':
+        return 'now'
+    if source == '$regnum':
+        return 'reg_num'
+    if isinstance(source, tuple) and source[0].startswith('$'):
+        arguments = ', '.join(source_expression(var, argument) for argument in source[1:])
+        return f"{source[0][1:]}({arguments})"
+    if isinstance(source, tuple):
+        return '(' + ' or '.join(path_expression(var, path) for path in source) + ')'
+    if source.startswith('$doc.'):
+        return path_expression('doc', source[len('$doc.'):])
+    return path_expression(var, source)
+
+
+def compile_function(name, source):
+    """Compile generated source and return the function it defines"""
+    # Converters of typed columns and path steps are available to every generated function
+    namespace = dict(CONVERTERS, child=child)
+    exec(compile(source, f'<{name}>', 'exec'), namespace)
+    return namespace[name]
+
+
+@lru_cache(maxsize=None)
+def registry_extractor(version):
+    """
+    Compile an extractor returning registry column values of a listObjects entry for a
+    structure version. Properties the structure does not declare are compiled as NULL.
+    """
+    structure = load_structure(version) if version else None
+    declared = None
+    if structure is not None:
+        declared = set(list_object_definition(structure).get('properties', {}))
+
+    expressions = []
+    for column, properties in REGISTRY_FIELDS:
+        available = [prop for prop in properties if declared is None or prop in declared]
+        expressions.append(source_expression('obj', tuple(available)) if available else 'None')
+
+    source = f"def extract(obj):\n    return ({', '.join(expressions)},)\n"
+    return compile_function('extract', source)
+
+
+def resolve_spec_version(document_type, scheme_version):
+    """Pick the newest spec version not newer than the document's schemeVersion"""
+    versions = sorted(DOCUMENT_SPECS.get(document_type, {}), key=version_key)
+    chosen = None
+    for version in versions:
+        if scheme_version is None or version_key(version) <= version_key(scheme_version):
+            chosen = version
+    return chosen
+
+
+@lru_cache(maxsize=None)
+def document_extractor(document_type, scheme_version):
+    """
+    Compile the extractor for a (document type, scheme version) pair. The extractor is
+    called as extract(document, reg_num, now, new_id) and returns {table: [row tuples]}.
+    Returns None if there is no spec for the document type.
+    """
+    spec_version = resolve_spec_version(document_type, scheme_version)
+    if spec_version is None:
+        return None
+    spec = DOCUMENT_SPECS[document_type][spec_version]
+
+    lines = ['def extract(doc, reg_num, now, new_id):', '    rows = {}']
+    for table_name, (list_path, fields) in spec.items():
+        if list_path is None:
+            values = ', '.join(source_expression('doc', source) for _, source in fields)
+            lines.append(f"    rows[{table_name!r}] = [({values},)]")
+        else:
+            values = ', '.join(source_expression('item', source) for _, source in fields)
+            lines.append(f"    rows[{table_name!r}] = [({values},) for item in ({path_expression('doc', list_path)} or ())]")
+    lines.append('    return rows')
+
+    return compile_function('extract', '\n'.join(lines) + '\n')
+
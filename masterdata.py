@@ -5,32 +5,63 @@ Module to create and populate master data tables from masterdata JSON files
 
 import json
 import os
-import requests
 import argparse
+import time
 from datetime import datetime
-import uuid
-from db_utils import get_db_connection, execute_query, create_table_sqlite_to_sqlserver
+from db_utils import (get_db_connection, add_missing_columns, create_table_sqlite_to_sqlserver, optimize_database,
+                      upsert_rows)
+from mappings import structure_version
+from profiling import add_profile_arguments, create_profiler, profile_stage
+from validation import (ERROR, NSI_REGISTRY_REQUIRED, QUARANTINE_COLUMNS, WARNING, Sampler, add_validation_arguments,
+                        missing_properties, quarantine_row, registry_validator)
 
 
-def create_nsi_tables():
-    """Create NSI tables based on data-20220101T0000-20251222T0000-structure-20250101.json"""
-    conn = get_db_connection()
+NSI_REGISTRY_FILE = './masterdata/data-20220101T0000-20251222T0000-structure-20250101.json'
+
+
+def create_nsi_tables(profiler=None, validate_sample=1.0, structure_file=NSI_REGISTRY_FILE):
+    """Create NSI tables for the NSI types listed in a masterdata registry file (by default the full export)"""
+    # The columnar transform needs pandas, imported only when NSI tables are built
+    from transform import record_rows, template_columns
+
+    conn = get_db_connection('ingest')
     cursor = conn.cursor()
 
     # Load the structure file to get NSI types
-    structure_file = './masterdata/data-20220101T0000-20251222T0000-structure-20250101.json'
-
     with open(structure_file, 'r', encoding='utf-8') as f:
         structure_data = json.load(f)
 
+    # Entries without an NSI type or href are quarantined instead of loaded; other mismatches
+    # with masterdata/structure-*.json are recorded as warnings
+    create_sql = f"CREATE TABLE IF NOT EXISTS quarantine ({', '.join(QUARANTINE_COLUMNS)})"
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+    add_missing_columns(cursor, 'quarantine', QUARANTINE_COLUMNS)
+    validate = registry_validator(structure_version(structure_file))
+    sample = Sampler(validate_sample)
+
     for obj in structure_data.get('listObjects', []):
         nsi_type = obj.get('NSIType')
         href = obj.get('href')
 
+        errors = validate(obj) if validate is not None and sample() else []
+        missing = missing_properties(obj, NSI_REGISTRY_REQUIRED)
+        if missing or errors:
+            now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+            row = quarantine_row('7710568760-masterData', structure_file, None, nsi_type, missing + errors, obj, now,
+                                 severity=WARNING if not missing else ERROR)
+            upsert_rows(conn, 'quarantine', [definition.split()[0] for definition in QUARANTINE_COLUMNS], [row])
+            conn.commit()
+        if missing:
+            print(f"Warning: Invalid entry for NSI type {nsi_type}, quarantined: {'; '.join(missing + errors)}")
+            continue
+        if errors:
+            print(f"Warning: Entry for NSI type {nsi_type} does not match the structure: {'; '.join(errors)}")
+
         if nsi_type and href:
             # Process the data from local file (since online URLs may not be accessible)
             try:
                 print(f"Processing NSI type: {nsi_type}")
+                started = time.perf_counter()
 
                 # Extract filename from the href
                 filename = href.split('/')[-1]
@@ -68,86 +99,48 @@ def create_nsi_tables():
                 # Build column list from first item's keys
                 if nsi_items:
                     first_item = nsi_items[0]
-                    columns = []
-
-                    # Add standard fields first
-                    columns.append("globalid TEXT PRIMARY KEY")
-                    columns.append("createdate TEXT")
-                    columns.append("updatedate TEXT")
-
-                    # Add columns from the data, handling nested structures
-                    for key, value in first_item.items():
-                        if isinstance(value, dict):
-                            # Handle nested dictionary - create flattened columns
-                            for nested_key in value.keys():
-                                col_name = f"{key}_{nested_key}"
-                                columns.append(f"{col_name} TEXT")
-                        elif isinstance(value, list):
-                            # Handle top-level array fields - store as JSON string
-                            columns.append(f"{key} TEXT")
-                        else:
-                            # Simple field
-                            columns.append(f"{key} TEXT")
+                    # Standard fields first, then the item's keys with nested dicts flattened to <key>_<nested>
+                    columns = ['globalid TEXT PRIMARY KEY', 'createdate TEXT', 'updatedate TEXT']
+                    columns.extend(f"{column} TEXT" for column in template_columns(first_item))
 
                     # Create the table
                     create_table_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
                     cursor.execute(create_table_sqlite_to_sqlserver(create_table_sql))
 
-                    # Insert data into the table
-                    for item in nsi_items:
-                        global_id = str(uuid.uuid4())
-                        now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-
-                        # Prepare values for insertion
-                        values = [global_id, now, now]  # globalid, createdate, updatedate
-
-                        # Add values for each column based on the first item structure
-                        for key, value in first_item.items():
-                            if isinstance(value, dict):
-                                # Handle nested dictionary
-                                for nested_key in value.keys():
-                                    val = item.get(key, {}).get(nested_key)
-                                    # Convert complex objects (dicts, lists) to JSON string for storage
-                                    if isinstance(val, (dict, list)):
-                                        val = json.dumps(val, ensure_ascii=False)
-                                    values.append(val if val is not None else '')
-                            elif isinstance(value, list):
-                                # Handle top-level array fields by converting to JSON string
-                                val = item.get(key)
-                                if isinstance(val, (dict, list)):
-                                    val = json.dumps(val, ensure_ascii=False)
-                                values.append(val if val is not None else '')
-                            else:
-                                # Simple field
-                                val = item.get(key)
-                                # Convert complex objects (dicts, lists) to JSON string for storage
-                                if isinstance(val, (dict, list)):
-                                    val = json.dumps(val, ensure_ascii=False)
-                                values.append(val if val is not None else '')
-
-                        # Build INSERT query
-                        placeholders = ', '.join(['?' for _ in values])
-                        insert_sql = f"INSERT OR REPLACE INTO {table_name} VALUES ({placeholders})"
-                        execute_query(insert_sql, values)
+                    # Rows of an NSI type are built by the columnar transform, one transaction per type
+                    rows = record_rows(nsi_items, first_item)
+                    upsert_rows(conn, table_name, [column.split()[0] for column in columns], rows)
+                    conn.commit()
+
+                    if profiler:
+                        profiler.record_item('table', table_name, os.path.getsize(local_file_path),
+                                             time.perf_counter() - started)
 
             except Exception as e:
                 print(f"Error processing NSI type {nsi_type} from {href}: {str(e)}")
                 continue
 
     conn.commit()
+    optimize_database(conn)
     conn.close()
 
 
 def main():
     parser = argparse.ArgumentParser(description='Handle master data tables')
     parser.add_argument('--createdb', action='store_true', help='Create NSI tables from master data')
+    add_validation_arguments(parser)
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
+    profiler = create_profiler(args)
     
     if args.createdb:
         print("Creating NSI tables...")
-        create_nsi_tables()
+        with profile_stage(profiler, 'createdb'):
+            create_nsi_tables(profiler, validate_sample=args.validate_sample)
         print("NSI tables created and populated successfully.")
+        if profiler:
+            profiler.write_report()
     else:
         parser.print_help()
 
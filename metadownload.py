@@ -5,27 +5,31 @@ Module to download files specified in meta.json from the privatisation plans sec
 
 import json
 import os
-import requests
 from urllib.parse import urlparse
 import argparse
 
 
-def download_file(url, dest_path):
+def download_file(url, dest_path, session=None):
     """Download a file from URL to destination path if it doesn't exist"""
     if os.path.exists(dest_path):
         print(f"File already exists: {dest_path}")
         return True
+
+    from datasets import create_session, fetch_content
     
     try:
         print(f"Downloading {url}...")
-        response = requests.get(url)
-        response.raise_for_status()
+        # Retries 429/5xx and bodies cut off in transfer; an error payload is not saved
+        content, _ = fetch_content(session or create_session(1), url, timeout=300)
         
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(dest_path), exist_ok=True)
         
-        with open(dest_path, 'wb') as f:
-            f.write(response.content)
+        # Existing files are skipped, so a partial file must never appear under the final name
+        temporary = f'{dest_path}.part'
+        with open(temporary, 'wb') as f:
+            f.write(content)
+        os.replace(temporary, dest_path)
         
         print(f"Downloaded: {dest_path}")
         return True
@@ -34,9 +38,10 @@ def download_file(url, dest_path):
         return False
 
 
-def download_meta_files():
+def download_meta_files(meta_file='./privatisationplans/meta.json', loaded_dir='./privatisationplans/loaded/',
+                        session=None):
     """Download all files specified in the meta.json file"""
-    meta_file = './privatisationplans/meta.json'
+    from datasets import create_session
     
     if not os.path.exists(meta_file):
         print(f"Meta file not found: {meta_file}")
@@ -46,8 +51,9 @@ def download_meta_files():
         meta_data = json.load(f)
     
     # Create loaded directory if it doesn't exist
-    loaded_dir = './privatisationplans/loaded/'
     os.makedirs(loaded_dir, exist_ok=True)
+    # One session keeps the connection to the portal open between files
+    session = session or create_session(1)
     
     # Download data files
     data_sources = meta_data.get('data', [])
@@ -60,7 +66,7 @@ def download_meta_files():
             parsed_url = urlparse(source_url)
             filename = os.path.basename(parsed_url.path)
             dest_path = os.path.join(loaded_dir, filename)
-            download_file(source_url, dest_path)
+            download_file(source_url, dest_path, session)
     
     # Download structure files
     structure_sources = meta_data.get('structure', [])
@@ -73,7 +79,7 @@ def download_meta_files():
             parsed_url = urlparse(source_url)
             filename = os.path.basename(parsed_url.path)
             dest_path = os.path.join(loaded_dir, filename)
-            download_file(source_url, dest_path)
+            download_file(source_url, dest_path, session)
 
 
 def main():
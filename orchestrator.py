@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Module to run the daily load as a DAG of stages in one process.
+
+Each stage declares the stages it depends on and the resources it needs. Stages whose
+dependencies are done run concurrently (e.g. the NSI refresh next to the plan download),
+except that stages sharing a resource - the database, which SQLite lets only one writer
+use - run one at a time. A stage receives the outputs of its dependencies in memory,
+e.g. the list of registry files to load, so no files are moved between directories.
+
+The state of the last run is kept in pipeline-state.json; with --resume the stages that
+completed in that run are skipped and their outputs reused.
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+
+STATE_FILE = 'pipeline-state.json'
+
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+DATABASE = 'database'
+
+# data-YYYYMMDDTHHMM-YYYYMMDDTHHMM-structure-... : the second timestamp ends the period of a registry file
+PERIOD_END_RE = re.compile(r'^data-\d{8}T\d{4}-(\d{8})T\d{4}-')
+
+
+class Stage:
+    """A named step of the pipeline: function(inputs, options) -> JSON-serializable output"""
+
+    def __init__(self, name, function, depends=(), resources=()):
+        self.name = name
+        self.function = function
+        self.depends = tuple(depends)
+        self.resources = set(resources)
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def select_registry_files(filenames, period_days=0, today=None):
+    """
+    Choose the registry files to load: with period_days those whose period ends within the
+    last period_days days, otherwise only the newest file.
+    """
+    filenames = sorted(name for name in filenames if PERIOD_END_RE.match(os.path.basename(name)))
+    if not period_days:
+        return filenames[-1:]
+    cutoff = ((today or datetime.now()) - timedelta(days=period_days)).strftime('%Y%m%d')
+    return [name for name in filenames if PERIOD_END_RE.match(os.path.basename(name)).group(1) >= cutoff]
+
+
+def download_plans(inputs, options):
+    """Download meta.json of the privatization plans and the files it lists into loaded/"""
+    from datasets import download_meta, get_adapter
+    download_meta(get_adapter('privatizationPlans'))
+
+
+def select_files(inputs, options):
+    """Pick the registry files of the requested period from loaded/"""
+    from archive import source_files
+    from datasets import get_adapter
+    files = select_registry_files(source_files(get_adapter('privatizationPlans').directory), options.period_days)
+    log(f"Registry files selected: {len(files)}")
+    return files
+
+
+def archive_files(inputs, options):
+    """Add the downloaded registry files to the registry archive"""
+    from archive import compact
+    from datasets import get_adapter
+    return compact(get_adapter('privatizationPlans').directory)
+
+
+def upload_registry(inputs, options):
+    """Load the selected registry files into the registry table"""
+    from main import load_privatisation_data
+    return load_privatisation_data(files=inputs['select_files'], batch_size=options.batch_size)
+
+
+def process_docs(inputs, options):
+    """Download and process the documents referenced in the registry"""
+    from main import process_all_documents
+    from writers import default_writers
+    return list(process_all_documents(workers=options.workers, batch_size=options.batch_size,
+                                      writers=options.writers or default_writers()))
+
+
+def download_nsi(inputs, options):
+    """Download NSI files that are missing locally"""
+    from download_missing_nsi import download_missing_nsi_files
+    download_missing_nsi_files()
+
+
+def load_nsi(inputs, options):
+    """Recreate and fill the NSI tables"""
+    from masterdata import create_nsi_tables
+    create_nsi_tables()
+
+
+def export_excel(inputs, options):
+    """Export the privatization plans to Excel"""
+    from createexcel_privplans import export_to_excel
+    export_to_excel()
+
+
+def build_stages(options):
+    """Return the stages of the daily load; the NSI refresh is included with --masterdata"""
+    stages = [
+        Stage('download_plans', download_plans),
+        Stage('select_files', select_files, depends=['download_plans']),
+        Stage('archive', archive_files, depends=['download_plans']),
+        Stage('upload', upload_registry, depends=['select_files'], resources=[DATABASE]),
+        Stage('processdocs', process_docs, depends=['upload'], resources=[DATABASE]),
+        Stage('export', export_excel, depends=['processdocs'], resources=[DATABASE])
+    ]
+    if options.masterdata:
+        stages += [
+            Stage('download_nsi', download_nsi),
+            Stage('load_nsi', load_nsi, depends=['download_nsi'], resources=[DATABASE])
+        ]
+    return stages
+
+
+def load_state(path):
+    """Return the saved pipeline state, or an empty one"""
+    if not os.path.exists(path):
+        return {'stages': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    """Write the pipeline state atomically, so an interrupted run never leaves it half written"""
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temporary, path)
+
+
+def run_pipeline(stages, options, state_path=STATE_FILE, resume=False, max_workers=4):
+    """
+    Run stages in dependency order, concurrently where dependencies and resources allow.
+    A failed stage skips the stages depending on it; the others still run.
+    Returns {stage name: status}.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        unknown = [name for name in stage.depends if name not in by_name]
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {', '.join(unknown)}")
+
+    previous = load_state(state_path)['stages'] if resume else {}
+    state = {'started': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), 'stages': {}}
+    outputs = {}
+    status = {}
+    for name, saved in previous.items():
+        if name in by_name and saved.get('status') == DONE:
+            log(f"Stage {name}: done in the previous run, skipped")
+            status[name] = DONE
+            outputs[name] = saved.get('output')
+            state['stages'][name] = saved
+    save_state(state_path, state)
+
+    pending = [stage for stage in stages if stage.name not in status]
+    running = {}
+    busy = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Repeat until nothing changes, so skips propagate along chains of dependents
+            changed = True
+            while changed:
+                changed = False
+                for stage in list(pending):
+                    if any(status.get(name) in (FAILED, SKIPPED) for name in stage.depends):
+                        log(f"Stage {stage.name}: skipped, a dependency did not complete")
+                        status[stage.name] = SKIPPED
+                        state['stages'][stage.name] = {'status': SKIPPED}
+                    elif all(status.get(name) == DONE for name in stage.depends) and not stage.resources & busy:
+                        log(f"Stage {stage.name}: started")
+                        inputs = {name: outputs.get(name) for name in stage.depends}
+                        running[executor.submit(timed, stage.function, inputs, options)] = stage
+                        busy |= stage.resources
+                    else:
+                        continue
+                    pending.remove(stage)
+                    changed = True
+            save_state(state_path, state)
+            if not running:
+                if pending:
+                    raise ValueError(f"Stages with circular dependencies: {', '.join(s.name for s in pending)}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                busy -= stage.resources
+                try:
+                    output, seconds = future.result()
+                    status[stage.name] = DONE
+                    outputs[stage.name] = output
+                    state['stages'][stage.name] = {'status': DONE, 'seconds': round(seconds, 3), 'output': output}
+                    log(f"Stage {stage.name}: done in {seconds:.1f}s")
+                except Exception as e:
+                    status[stage.name] = FAILED
+                    state['stages'][stage.name] = {'status': FAILED, 'error': str(e)}
+                    log(f"Stage {stage.name}: failed: {e}")
+                    traceback.print_exc()
+            save_state(state_path, state)
+
+    state['finished'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    save_state(state_path, state)
+    return status
+
+
+def timed(function, inputs, options):
+    """Call a stage function and return (output, wall seconds)"""
+    started = time.perf_counter()
+    output = function(inputs, options)
+    return output, time.perf_counter() - started
+
+
+def main():
+    from datasets import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS
+    from writers import add_writer_arguments
+
+    parser = argparse.ArgumentParser(description='Run the daily load of privatization plans as a stage DAG')
+    parser.add_argument('period_days', nargs='?', type=int, default=0,
+                        help='Load registry files of the last PERIOD_DAYS days (default: only the newest file)')
+    parser.add_argument('--masterdata', action='store_true', help='Also refresh the NSI tables')
+    parser.add_argument('--resume', action='store_true', help='Skip the stages completed in the previous run')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent document downloads')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows/documents per write transaction')
+    parser.add_argument('--state', default=STATE_FILE, help='Pipeline state file')
+    add_writer_arguments(parser)
+
+    args = parser.parse_args()
+    status = run_pipeline(build_stages(args), args, state_path=args.state, resume=args.resume)
+    failed = [name for name, value in status.items() if value != DONE]
+    if failed:
+        log(f"Pipeline finished with incomplete stages: {', '.join(failed)}")
+        raise SystemExit(1)
+    log("Pipeline finished")
+
+
+if __name__ == '__main__':
+    main()
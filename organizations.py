@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Module to maintain the normalized organizations table fed from the 7710568760-organization
+data set and from the hosting organizations of privatisation plans
+"""
+
+import argparse
+from datetime import datetime
+from db_utils import get_db_connection, optimize_database, upsert_rows
+from datasets import ORGANIZATION_COLUMNS, create_tables, get_adapter
+
+ORGANIZATION_FIELDS = [definition.split()[0] for definition in ORGANIZATION_COLUMNS]
+
+
+def organization_row(org, now):
+    """Build an organizations row from a portal organization object, or None if it has no details"""
+    code = org.get('code')
+    # Documents often carry only the organization code; those must not overwrite full records
+    if not code or not org.get('INN'):
+        return None
+
+    return (
+        code, now, now,
+        org.get('INN'),
+        org.get('KPP'),
+        org.get('OGRN'),
+        org.get('fullName') or org.get('name'),
+        org.get('orgType')
+    )
+
+
+def map_organization_document(reg_num, document_type, document):
+    """Map a document of the organization data set to the organizations table"""
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    row = organization_row(document, now)
+    return {'organizations': [row] if row else []}
+
+
+def normalize_plan_organizations(batch_size=1000):
+    """
+    Move organization details repeated on every privatisationplanlist row into the
+    organizations table and clear them on the plan rows, which keep only org_code
+    """
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT org_code, MAX(org_inn), MAX(org_kpp), MAX(org_ogrn), MAX(org_name), MAX(org_type)
+        FROM privatisationplanlist
+        WHERE org_code IS NOT NULL AND org_inn IS NOT NULL
+        GROUP BY org_code
+    ''')
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    rows = [(code, now, now, inn, kpp, ogrn, name, org_type)
+            for code, inn, kpp, ogrn, name, org_type in cursor.fetchall()]
+
+    for start in range(0, len(rows), batch_size):
+        upsert_rows(conn, 'organizations', ORGANIZATION_FIELDS, rows[start:start + batch_size])
+    conn.commit()
+
+    # Only clear rows whose organization is now present in the dimension
+    cursor.execute('''
+        UPDATE privatisationplanlist
+        SET org_name = NULL, org_inn = NULL, org_kpp = NULL, org_ogrn = NULL, org_type = NULL, updatedate = ?
+        WHERE org_inn IS NOT NULL
+          AND org_code IN (SELECT code FROM organizations)
+    ''', (datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),))
+    cleared = cursor.rowcount
+    conn.commit()
+    optimize_database(conn)
+    conn.close()
+
+    print(f"Organizations upserted: {len(rows)}, plan rows normalized: {cleared}")
+    return len(rows), cleared
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the normalized organizations table')
+    parser.add_argument('--createdb', action='store_true', help='Create the organizations table and indexes')
+    parser.add_argument('--normalize', action='store_true',
+                        help='Move organization details from existing plan rows into the organizations table')
+
+    args = parser.parse_args()
+
+    if args.createdb:
+        print("Creating organizations table...")
+        create_tables(get_adapter('organization'))
+        print("Organizations table created successfully.")
+
+    if args.normalize:
+        print("Normalizing plan organizations...")
+        normalize_plan_organizations()
+
+    if not any([args.createdb, args.normalize]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Module to keep the fact tables partitioned by publish month and to reload one month at a time.
+
+privatisationplanlist, privatizationobjects and privatizationdecisions carry publish_month
+('YYYY-MM' of the UTC publish date, filled at ingest). On SQL Server --partition moves them
+onto a partition scheme with one partition per month (RANGE RIGHT on the month boundaries,
+all indexes aligned), so a query with a publish_month predicate reads only its partitions.
+SQLite has no table partitioning; there every fact table has an index on publish_month.
+
+--reload YYYY-MM maps the month's documents again from the raw document store (no refetch)
+into staging tables and then replaces the month in one short transaction: on SQL Server the
+live partition is switched out to a trash table and the staging partition switched in, on
+SQLite the month's rows are deleted and the staged rows copied in. Rows of the staged
+documents loaded before publish_month existed (NULL month) are removed as well, so a
+reload never leaves two copies of a document. Derived tables are
+corrected in the same transaction: extensions with a retract_batch() take back the removed
+rows, then every extension applies the new ones, as in an ingest batch.
+"""
+
+import argparse
+import json
+import re
+from datetime import date, datetime, timedelta
+from db_utils import connection_type, get_db_connection, get_db_type, optimize_database, upsert_rows
+from rawstore import RAW_TABLE, gunzip
+
+PARTITIONED_TABLES = ['privatisationplanlist', 'privatizationobjects', 'privatizationdecisions']
+PARTITION_COLUMN = 'publish_month'
+
+# Columns identifying the document (version) a fact row was mapped from
+DOCUMENT_KEYS = {
+    'privatisationplanlist': ['regnum', 'version'],
+    'privatizationobjects': ['id', 'plan_version'],
+    'privatizationdecisions': ['regnum']
+}
+
+PARTITION_FUNCTION = 'pf_publish_month'
+PARTITION_SCHEME = 'ps_publish_month'
+
+STAGING_SUFFIX = '_staging'
+TRASH_SUFFIX = '_trash'
+
+MONTH_RE = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+READ_CHUNK = 1000
+
+
+def check_month(month):
+    """Return a month given as 'YYYY-MM', ValueError otherwise (months are also inlined in DDL)"""
+    if not MONTH_RE.match(str(month)):
+        raise ValueError(f"Month must be given as YYYY-MM: {month}")
+    return month
+
+
+def next_month(month):
+    """Return the month after a 'YYYY-MM' month"""
+    year, number = map(int, check_month(month).split('-'))
+    return f'{year + number // 12:04}-{number % 12 + 1:02}'
+
+
+def raw_date_range(month):
+    """
+    Return the [from, to) range of published local dates that can fall into a UTC month:
+    the month widened by a day on both sides to cover any UTC offset
+    """
+    first = date.fromisoformat(f'{check_month(month)}-01')
+    after = date.fromisoformat(f'{next_month(month)}-01')
+    return (first - timedelta(days=1)).isoformat(), (after + timedelta(days=1)).isoformat()
+
+
+def map_month(conn, adapter, month):
+    """
+    Map the stored documents published in a month; return ({table: rows} of the partitioned
+    tables, {table: rows} of the other tables such as organizations, documents mapped)
+    """
+    from datasets import map_document
+
+    positions = {table_name: adapter.columns(table_name).index(PARTITION_COLUMN) for table_name in PARTITIONED_TABLES}
+    staged = {table_name: [] for table_name in PARTITIONED_TABLES}
+    other = {}
+    documents = 0
+
+    read_cursor = conn.cursor()
+    read_cursor.execute(f"""
+        SELECT regnum, content FROM {RAW_TABLE}
+        WHERE publish_date >= ? AND publish_date < ?
+        ORDER BY regnum, version
+    """, raw_date_range(month))
+    while True:
+        chunk = read_cursor.fetchmany(READ_CHUNK)
+        if not chunk:
+            break
+        for reg_num, content in chunk:
+            document_rows = map_document(adapter, reg_num, json.loads(gunzip(content)))
+            in_month = {table_name: [row for row in document_rows.get(table_name, [])
+                                     if row[positions[table_name]] == month]
+                        for table_name in PARTITIONED_TABLES}
+            # Documents near the month boundary belong to the neighbouring month
+            if not any(in_month.values()):
+                continue
+            documents += 1
+            for table_name, table_rows in in_month.items():
+                staged[table_name].extend(table_rows)
+            for table_name, table_rows in document_rows.items():
+                if table_name not in staged:
+                    other.setdefault(table_name, []).extend(table_rows)
+    return staged, other, documents
+
+
+def insert_rows(conn, table_name, columns, rows):
+    """Insert rows into an empty staging table with one executemany call"""
+    if not rows:
+        return
+    cursor = conn.cursor()
+    if connection_type(conn) == 'SQLSERVER':
+        cursor.fast_executemany = True
+    placeholders = ', '.join(['?' for _ in columns])
+    cursor.executemany(f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+
+def document_keys(adapter, staged):
+    """Return {table: [DOCUMENT_KEYS values]} of the documents of staged rows"""
+    keys = {}
+    for table_name in PARTITIONED_TABLES:
+        columns = adapter.columns(table_name)
+        positions = [columns.index(column) for column in DOCUMENT_KEYS[table_name]]
+        keys[table_name] = sorted({tuple(row[i] for i in positions) for row in staged[table_name]}, key=repr)
+    return keys
+
+
+def unpartitioned_condition(table_name):
+    """Return the WHERE condition of the NULL-month rows of one document"""
+    return ' AND '.join([f'{PARTITION_COLUMN} IS NULL'] + [f'{column} = ?' for column in DOCUMENT_KEYS[table_name]])
+
+
+def month_rows(conn, adapter, month, keys):
+    """
+    Read the rows of a month and the NULL-month rows of the staged documents (keys) from the
+    partitioned tables, locked until the caller commits (SQL Server)
+    """
+    hint = 'WITH (UPDLOCK, HOLDLOCK)' if connection_type(conn) == 'SQLSERVER' else ''
+    cursor = conn.cursor()
+    rows = {}
+    for table_name in PARTITIONED_TABLES:
+        select = f"SELECT {', '.join(adapter.columns(table_name))} FROM {table_name} {hint}"
+        cursor.execute(f"{select} WHERE {PARTITION_COLUMN} = ?", (month,))
+        rows[table_name] = [tuple(row) for row in cursor.fetchall()]
+        for key in keys[table_name]:
+            cursor.execute(f"{select} WHERE {unpartitioned_condition(table_name)}", key)
+            rows[table_name].extend(tuple(row) for row in cursor.fetchall())
+    return rows
+
+
+def delete_unpartitioned(cursor, keys):
+    """Delete the NULL-month rows of the staged documents, which no partition switch or month delete reaches"""
+    for table_name in PARTITIONED_TABLES:
+        if keys[table_name]:
+            cursor.executemany(f"DELETE FROM {table_name} WHERE {unpartitioned_condition(table_name)}",
+                               keys[table_name])
+
+
+def table_indexes(cursor, table_name):
+    """Return (name, unique, clustered, key columns) of the indexes of a SQL Server table, clustered first"""
+    cursor.execute("""
+        SELECT i.name, i.is_unique, i.type_desc, c.name
+        FROM sys.indexes i
+        JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE i.object_id = OBJECT_ID(?) AND ic.key_ordinal > 0
+        ORDER BY i.index_id, ic.key_ordinal
+    """, (table_name,))
+    indexes = {}
+    for name, unique, type_desc, column in cursor.fetchall():
+        indexes.setdefault(name, (name, bool(unique), type_desc == 'CLUSTERED', []))[3].append(column)
+    return sorted(indexes.values(), key=lambda index: not index[2])
+
+
+def index_sql(index, table_name, drop_existing=False):
+    """Return a CREATE INDEX statement placing an index on the partition scheme"""
+    name, unique, clustered, columns = index
+    kind = ('UNIQUE ' if unique else '') + ('CLUSTERED' if clustered else 'NONCLUSTERED')
+    options = ' WITH (DROP_EXISTING = ON)' if drop_existing else ''
+    return (f"CREATE {kind} INDEX {name} ON {table_name} ({', '.join(columns)}){options} "
+            f"ON {PARTITION_SCHEME}({PARTITION_COLUMN})")
+
+
+def create_partition_scheme(cursor):
+    """Create the monthly partition function and scheme, with boundaries for the months already loaded"""
+    months = set()
+    for table_name in PARTITIONED_TABLES:
+        cursor.execute(f"SELECT DISTINCT {PARTITION_COLUMN} FROM {table_name} WHERE {PARTITION_COLUMN} IS NOT NULL")
+        months.update(row[0] for row in cursor.fetchall() if MONTH_RE.match(row[0]))
+    boundaries = sorted(months | {next_month(month) for month in months})
+    cursor.execute(f"""
+IF NOT EXISTS (SELECT * FROM sys.partition_functions WHERE name = '{PARTITION_FUNCTION}')
+    CREATE PARTITION FUNCTION {PARTITION_FUNCTION} (NVARCHAR(7))
+    AS RANGE RIGHT FOR VALUES ({', '.join(f"'{month}'" for month in boundaries)})
+""")
+    cursor.execute(f"""
+IF NOT EXISTS (SELECT * FROM sys.partition_schemes WHERE name = '{PARTITION_SCHEME}')
+    CREATE PARTITION SCHEME {PARTITION_SCHEME} AS PARTITION {PARTITION_FUNCTION} ALL TO ([PRIMARY])
+""")
+
+
+def ensure_boundaries(cursor, month):
+    """Split the partition function so the month has a partition of its own"""
+    for boundary in (check_month(month), next_month(month)):
+        cursor.execute(f"""
+IF NOT EXISTS (SELECT * FROM sys.partition_range_values v
+               JOIN sys.partition_functions f ON f.function_id = v.function_id
+               WHERE f.name = '{PARTITION_FUNCTION}' AND CAST(v.value AS NVARCHAR(7)) = '{boundary}')
+BEGIN
+    ALTER PARTITION SCHEME {PARTITION_SCHEME} NEXT USED [PRIMARY];
+    ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() SPLIT RANGE ('{boundary}');
+END
+""")
+
+
+def is_partitioned(cursor, table_name):
+    """Tell whether a SQL Server table is stored on the partition scheme"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM sys.indexes i JOIN sys.partition_schemes s ON s.data_space_id = i.data_space_id
+        WHERE i.object_id = OBJECT_ID(?) AND i.index_id <= 1 AND s.name = ?
+    """, (table_name, PARTITION_SCHEME))
+    return cursor.fetchone()[0] > 0
+
+
+def partition_table(cursor, table_name):
+    """
+    Move a fact table onto the partition scheme: the globalid primary key becomes a unique
+    clustered index on (globalid, publish_month), the other indexes are rebuilt aligned
+    """
+    if is_partitioned(cursor, table_name):
+        return False
+
+    cursor.execute("SELECT name FROM sys.key_constraints WHERE parent_object_id = OBJECT_ID(?) AND type = 'PK'",
+                   (table_name,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute(f"ALTER TABLE {table_name} DROP CONSTRAINT {row[0]}")
+    cursor.execute(index_sql((f'cx_{table_name}', True, True, ['globalid', PARTITION_COLUMN]), table_name))
+    for index in table_indexes(cursor, table_name):
+        if not index[2]:
+            cursor.execute(index_sql(index, table_name, drop_existing=True))
+    return True
+
+
+def clone_table(cursor, table_name, clone_name):
+    """Create an empty copy of a partitioned table with the same aligned indexes, as SWITCH requires"""
+    cursor.execute(f"IF OBJECT_ID('{clone_name}') IS NOT NULL DROP TABLE {clone_name}")
+    cursor.execute(f"SELECT TOP 0 * INTO {clone_name} FROM {table_name}")
+    for index in table_indexes(cursor, table_name):
+        cursor.execute(index_sql(index, clone_name))
+
+
+def partition_tables():
+    """Fill publish_month of rows loaded before it existed and partition the fact tables (SQL Server)"""
+    from normalize import backfill
+
+    backfill(['privatisationplanlist', 'privatizationdecisions'])
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+    # Objects take the month of the plan version they belong to
+    cursor.execute(f"""
+        UPDATE privatizationobjects SET {PARTITION_COLUMN} = (
+            SELECT MAX(p.{PARTITION_COLUMN}) FROM privatisationplanlist p
+            WHERE p.regnum = privatizationobjects.id AND p.version = privatizationobjects.plan_version
+        ), updatedate = ?
+        WHERE {PARTITION_COLUMN} IS NULL
+    """, (datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),))
+    print(f"Filled {PARTITION_COLUMN} of {cursor.rowcount} privatization objects")
+    conn.commit()
+
+    if get_db_type() != 'SQLSERVER':
+        print(f"SQLite has no table partitioning, month queries use the {PARTITION_COLUMN} indexes")
+        conn.close()
+        return
+
+    create_partition_scheme(cursor)
+    for table_name in PARTITIONED_TABLES:
+        if partition_table(cursor, table_name):
+            print(f"Partitioned {table_name} by {PARTITION_COLUMN}")
+    conn.commit()
+    conn.close()
+
+
+def switch_sqlserver(cursor, month):
+    """Swap the month's partition for the staged one: live partition out to trash, staging in"""
+    cursor.execute(f"SELECT $PARTITION.{PARTITION_FUNCTION}(?)", (month,))
+    number = cursor.fetchone()[0]
+    for table_name in PARTITIONED_TABLES:
+        cursor.execute(f"ALTER TABLE {table_name} SWITCH PARTITION {number} "
+                       f"TO {table_name}{TRASH_SUFFIX} PARTITION {number}")
+        cursor.execute(f"ALTER TABLE {table_name}{STAGING_SUFFIX} SWITCH PARTITION {number} "
+                       f"TO {table_name} PARTITION {number}")
+
+
+def switch_sqlite(cursor, adapter, month):
+    """Replace the month's rows with the staged ones"""
+    for table_name in PARTITIONED_TABLES:
+        column_list = ', '.join(adapter.columns(table_name))
+        cursor.execute(f"DELETE FROM {table_name} WHERE {PARTITION_COLUMN} = ?", (month,))
+        cursor.execute(f"INSERT INTO {table_name} ({column_list}) "
+                       f"SELECT {column_list} FROM temp.{table_name}{STAGING_SUFFIX}")
+
+
+def reload_month(month, adapter=None):
+    """Rebuild one publish month of the fact tables from the raw document store; return the documents mapped"""
+    from datasets import get_adapter
+
+    check_month(month)
+    adapter = adapter or get_adapter('privatizationPlans')
+    sqlserver = get_db_type() == 'SQLSERVER'
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+    if sqlserver and not all(is_partitioned(cursor, table_name) for table_name in PARTITIONED_TABLES):
+        conn.close()
+        raise RuntimeError("The fact tables are not partitioned yet, run partitions.py --partition first")
+
+    staged, other, documents = map_month(conn, adapter, month)
+
+    # The staging tables are built outside the switch transaction, readers are not blocked meanwhile
+    if sqlserver:
+        ensure_boundaries(cursor, month)
+    for table_name in PARTITIONED_TABLES:
+        staging_name = f'{table_name}{STAGING_SUFFIX}'
+        if sqlserver:
+            clone_table(cursor, table_name, staging_name)
+            clone_table(cursor, table_name, f'{table_name}{TRASH_SUFFIX}')
+        else:
+            cursor.execute(f"DROP TABLE IF EXISTS temp.{staging_name}")
+            cursor.execute(f"CREATE TEMP TABLE {staging_name} AS SELECT * FROM main.{table_name} WHERE 0")
+        insert_rows(conn, staging_name, adapter.columns(table_name), staged[table_name])
+    conn.commit()
+
+    try:
+        if not sqlserver:
+            cursor.execute("BEGIN IMMEDIATE")
+        keys = document_keys(adapter, staged)
+        removed = month_rows(conn, adapter, month, keys)
+        for extension in adapter.get_extensions():
+            if hasattr(extension, 'retract_batch'):
+                extension.retract_batch(conn, adapter, removed)
+        delete_unpartitioned(cursor, keys)
+        if sqlserver:
+            switch_sqlserver(cursor, month)
+        else:
+            switch_sqlite(cursor, adapter, month)
+        for table_name, table_rows in other.items():
+            upsert_rows(conn, table_name, adapter.columns(table_name), table_rows)
+        for extension in adapter.get_extensions():
+            extension.apply_batch(conn, adapter, dict(staged, **other))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        for table_name in PARTITIONED_TABLES:
+            if sqlserver:
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name}{STAGING_SUFFIX}")
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name}{TRASH_SUFFIX}")
+            else:
+                cursor.execute(f"DROP TABLE IF EXISTS temp.{table_name}{STAGING_SUFFIX}")
+        conn.commit()
+
+    replaced = ', '.join(f"{table_name} {len(removed[table_name])} -> {len(staged[table_name])}"
+                         for table_name in PARTITIONED_TABLES)
+    print(f"Reloaded {month} from {documents} documents: {replaced}")
+    optimize_database(conn)
+    conn.close()
+    return documents
+
+
+def month_counts(table_name='privatisationplanlist'):
+    """Return {month: rows} of a partitioned table"""
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {PARTITION_COLUMN}, COUNT(*) FROM {table_name} "
+                   f"GROUP BY {PARTITION_COLUMN} ORDER BY {PARTITION_COLUMN}")
+    counts = dict(cursor.fetchall())
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monthly partitions of the plan, object and decision tables')
+    parser.add_argument('--partition', action='store_true',
+                        help='Fill publish_month of earlier rows and partition the tables by month (SQL Server)')
+    parser.add_argument('--reload', nargs='+', metavar='YYYY-MM',
+                        help='Rebuild these months from the raw document store and switch them in')
+    parser.add_argument('--months', action='store_true', help='List plan rows per month')
+
+    args = parser.parse_args()
+
+    if args.partition:
+        partition_tables()
+    if args.reload:
+        for month in args.reload:
+            reload_month(month)
+    if args.months:
+        for month, rows in month_counts().items():
+            print(f"{month or '-'}\t{rows}")
+    if not (args.partition or args.reload or args.months):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
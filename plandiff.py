@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Module to log which privatization objects were added, removed or changed between
+consecutive versions of a plan.
+
+Runs after the history extension has stored a version: the objects of the new version
+are compared with those of the previous version by their content hash
+(plan_object_history.object_hash), both read by primary key, so the work is proportional
+to the size of the plan. Field-level differences are only computed for objects whose
+hash changed. The result goes to the plan_object_changes table.
+"""
+
+import argparse
+import json
+from datetime import datetime
+from db_utils import get_db_connection, create_table_sqlite_to_sqlserver, optimize_database, upsert_rows
+from history import OBJECT_COPY_FIELDS, OBJECT_HISTORY_TABLE, PLAN_HISTORY_TABLE
+
+CHANGES_TABLE = 'plan_object_changes'
+
+CHANGES_COLUMNS = [
+    'regnum NVARCHAR(36) NOT NULL',
+    'version INTEGER NOT NULL',
+    'object_number NVARCHAR(40) NOT NULL',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'previous_version INTEGER',
+    'change_type NVARCHAR(10)',
+    'changed_fields TEXT',
+    'old_values TEXT',
+    'new_values TEXT'
+]
+CHANGES_KEYS = ['regnum', 'version', 'object_number']
+CHANGES_FIELDS = [definition.split()[0] for definition in CHANGES_COLUMNS]
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+
+def create_tables(cursor):
+    """Create the object change log table"""
+    create_sql = (f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} ({', '.join(CHANGES_COLUMNS)}, "
+                  f"PRIMARY KEY ({', '.join(CHANGES_KEYS)}))")
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+
+
+def version_objects(cursor, reg_num, version):
+    """Return {object_number: (hash, {field: value})} of one stored plan version"""
+    cursor.execute(f"""
+        SELECT object_number, object_hash, {', '.join(OBJECT_COPY_FIELDS)} FROM {OBJECT_HISTORY_TABLE}
+        WHERE regnum = ? AND version = ?
+    """, (reg_num, version))
+    return {row[0]: (row[1], dict(zip(OBJECT_COPY_FIELDS, row[2:]))) for row in cursor.fetchall()}
+
+
+def compare_objects(previous, current):
+    """
+    Compare two object sets as returned by version_objects.
+    Returns (object_number, change_type, changed_fields, old_values, new_values) tuples.
+    """
+    changes = []
+    for object_number, (current_hash, values) in current.items():
+        if object_number not in previous:
+            changes.append((object_number, ADDED, None, None, values))
+            continue
+        previous_hash, previous_values = previous[object_number]
+        if previous_hash == current_hash:
+            continue
+        fields = [field for field in OBJECT_COPY_FIELDS if previous_values[field] != values[field]]
+        changes.append((object_number, CHANGED, fields,
+                        {field: previous_values[field] for field in fields},
+                        {field: values[field] for field in fields}))
+    for object_number, (_, previous_values) in previous.items():
+        if object_number not in current:
+            changes.append((object_number, REMOVED, None, previous_values, None))
+    return changes
+
+
+def adjacent_version(cursor, reg_num, version, newer):
+    """Return the stored version right before (or after, if newer) the given one, or None"""
+    comparison, aggregate = ('>', 'MIN') if newer else ('<', 'MAX')
+    cursor.execute(f"""
+        SELECT {aggregate}(version) FROM {PLAN_HISTORY_TABLE}
+        WHERE regnum = ? AND version {comparison} ?
+    """, (reg_num, version))
+    return cursor.fetchone()[0]
+
+
+def diff_version(conn, reg_num, version, now):
+    """Recompute the change log of one plan version against its previous version"""
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {CHANGES_TABLE} WHERE regnum = ? AND version = ?", (reg_num, version))
+
+    previous_version = adjacent_version(cursor, reg_num, version, newer=False)
+    # The first known version has nothing to be compared with
+    if previous_version is None:
+        return 0
+
+    changes = compare_objects(version_objects(cursor, reg_num, previous_version),
+                              version_objects(cursor, reg_num, version))
+    rows = [
+        (reg_num, version, object_number, now, now, previous_version, change_type,
+         ','.join(fields) if fields else None,
+         json.dumps(old, ensure_ascii=False) if old else None,
+         json.dumps(new, ensure_ascii=False) if new else None)
+        for object_number, change_type, fields, old, new in changes
+    ]
+    return upsert_rows(conn, CHANGES_TABLE, CHANGES_FIELDS, rows, CHANGES_KEYS)
+
+
+def apply_batch(conn, adapter, rows):
+    """Log object changes of the plan versions in an ingest batch, the caller commits"""
+    plan_columns = adapter.columns('privatisationplanlist')
+    regnum_index = plan_columns.index('regnum')
+    version_index = plan_columns.index('version')
+    versions = sorted({(row[regnum_index], int(row[version_index] or 0))
+                       for row in rows.get('privatisationplanlist', [])}, key=lambda key: key[1])
+    if not versions:
+        return
+
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    cursor = conn.cursor()
+    for reg_num, version in versions:
+        diff_version(conn, reg_num, version, now)
+        # A version that arrived late also changes the baseline of the version after it
+        next_version = adjacent_version(cursor, reg_num, version, newer=True)
+        if next_version is not None:
+            diff_version(conn, reg_num, next_version, now)
+
+
+def rebuild_changes():
+    """Recompute the change log of every stored plan version from the history tables"""
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+    create_tables(cursor)
+    cursor.execute(f"DELETE FROM {CHANGES_TABLE}")
+    cursor.execute(f"SELECT regnum, version FROM {PLAN_HISTORY_TABLE}")
+    versions = cursor.fetchall()
+
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    logged = 0
+    for reg_num, version in versions:
+        logged += diff_version(conn, reg_num, version, now)
+    conn.commit()
+    optimize_database(conn)
+    conn.close()
+    print(f"Plan changes rebuilt: {logged} object changes in {len(versions)} versions")
+    return logged
+
+
+def plan_changes(reg_num, version=None):
+    """Return logged object changes of a plan (all versions, or one) as dicts"""
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    query = f"SELECT {', '.join(CHANGES_FIELDS)} FROM {CHANGES_TABLE} WHERE regnum = ?"
+    params = [reg_num]
+    if version is not None:
+        query += " AND version = ?"
+        params.append(version)
+    cursor.execute(query + " ORDER BY version, object_number", params)
+    changes = [dict(zip(CHANGES_FIELDS, row)) for row in cursor.fetchall()]
+    conn.close()
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Object changes between versions of privatization plans')
+    parser.add_argument('regnum', nargs='?', help='Plan registry number')
+    parser.add_argument('--version', type=int, help='Only changes introduced by this version')
+    parser.add_argument('--createdb', action='store_true', help='Create the change log table')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the change log from the plan history')
+
+    args = parser.parse_args()
+
+    if args.createdb:
+        conn = get_db_connection()
+        create_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        print("Plan change log table created successfully.")
+
+    if args.rebuild:
+        rebuild_changes()
+
+    if args.regnum:
+        for change in plan_changes(args.regnum, args.version):
+            details = change['changed_fields'] or ''
+            if change['change_type'] == CHANGED:
+                details = f"{details}: {change['old_values']} -> {change['new_values']}"
+            print(f"v{change['previous_version']}->v{change['version']}\t{change['object_number']}\t"
+                  f"{change['change_type']}\t{details}")
+
+    if not any([args.createdb, args.rebuild, args.regnum]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
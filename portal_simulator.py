@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Module with a local simulator of the torgi.gov.ru open data portal, to test the downloaders
+(main.py, metadownload.py, download_missing_nsi.py, datasets.py) without the real portal.
+
+The simulator serves the sample files of privatisationplans/ and masterdata/ by file name,
+so a portal href works with only its origin replaced (local_url). Every response is delayed
+by a configurable latency distribution and can be replaced by one of the portal's faults:
+429 (with Retry-After), a 5xx status, a body cut off mid-transfer, or the error payload
+("... не существует или недоступен") the portal returns with status 200 for a file it
+cannot serve. Files missing from the seed get that payload as well. Faults are drawn from a
+seeded generator and every outcome is counted, for the assertions of test_portal_simulator.py.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED_DIRECTORIES = [os.path.join(BASE_DIR, 'privatisationplans'), os.path.join(BASE_DIR, 'masterdata')]
+UNAVAILABLE_PAYLOAD = {'error': 'Запрашиваемый файл не существует или недоступен'}
+TRUNCATED = 'truncated'
+UNAVAILABLE = 'unavailable'
+OK = 'ok'
+
+
+def parse_latency(spec):
+    """
+    Return a function drawing a response delay in seconds from a random generator, for a
+    distribution given as 'fixed:S', 'uniform:MIN:MAX', 'exponential:MEAN' or 'lognormal:MEDIAN:SIGMA'
+    """
+    name, _, params = spec.partition(':')
+    try:
+        values = [float(value) for value in params.split(':')] if params else []
+    except ValueError:
+        values = None
+    distributions = {
+        ('fixed', 1): lambda rng: values[0],
+        ('uniform', 2): lambda rng: rng.uniform(values[0], values[1]),
+        ('exponential', 1): lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0,
+        ('lognormal', 2): lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    }
+    if values is None or (name, len(values)) not in distributions:
+        raise ValueError(f"Unknown latency distribution: {spec}. "
+                         f"Use fixed:S, uniform:MIN:MAX, exponential:MEAN or lognormal:MEDIAN:SIGMA")
+    return distributions[(name, len(values))]
+
+
+def seed_files(directories):
+    """Return {file name: path} of the JSON files under the seed directories (first one wins)"""
+    files = {}
+    for directory in directories:
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                if name.endswith('.json'):
+                    files.setdefault(name, os.path.join(root, name))
+    return files
+
+
+class PortalSimulator:
+    """
+    Serves the seed files over HTTP on a local port with latency and injected faults.
+
+    error_rates maps a status (429, 500, 503, ...) to the share of requests answered with it,
+    truncate_rate is the share of bodies cut off halfway, unavailable_rate the share of files
+    (by name, stable for a seed) and unavailable the names always answered with the error
+    payload. The first fail_first requests of every file get the fail_with fault (a status or
+    'truncated'), for exact retry counts.
+    """
+
+    def __init__(self, directories=SEED_DIRECTORIES, latency='fixed:0', error_rates=None, truncate_rate=0.0,
+                 unavailable_rate=0.0, unavailable=(), retry_after=None, fail_first=0, fail_with=503, seed=0):
+        self.files = seed_files(directories)
+        self.latency = parse_latency(latency)
+        self.error_rates = dict(error_rates or {})
+        self.truncate_rate = truncate_rate
+        self.unavailable_rate = unavailable_rate
+        self.unavailable = set(unavailable)
+        self.retry_after = retry_after
+        self.fail_first = fail_first
+        self.fail_with = fail_with
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Outcomes of all responses, requests per file name and the total injected latency
+        self.outcomes = Counter()
+        self.requests = Counter()
+        self.delay = 0.0
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def local_url(self, href):
+        """Return the simulator URL of a portal href (same path and query)"""
+        parsed = urlparse(href)
+        return self.base_url + parsed.path + (f'?{parsed.query}' if parsed.query else '')
+
+    def is_unavailable(self, name):
+        if name not in self.files or name in self.unavailable:
+            return True
+        return zlib.crc32(f'{self.seed}:{name}'.encode('utf-8')) / 2 ** 32 < self.unavailable_rate
+
+    def draw(self, name):
+        """Count a request of a file and return (delay, fault or None)"""
+        with self.lock:
+            self.requests[name] += 1
+            delay = max(0.0, self.latency(self.random))
+            self.delay += delay
+            if self.requests[name] <= self.fail_first:
+                return delay, self.fail_with
+
+            draw = self.random.random()
+            for status, rate in self.error_rates.items():
+                if draw < rate:
+                    return delay, status
+                draw -= rate
+            return delay, TRUNCATED if draw < self.truncate_rate else None
+
+    def respond(self, request):
+        name = os.path.basename(urlparse(request.path).path)
+        delay, fault = self.draw(name)
+        time.sleep(delay)
+
+        if isinstance(fault, int):
+            headers = {'Retry-After': str(self.retry_after)} if fault == 429 and self.retry_after is not None else {}
+            self.send(request, fault, json.dumps({'status': fault}).encode('utf-8'), headers)
+            outcome = str(fault)
+        elif self.is_unavailable(name):
+            self.send(request, 200, json.dumps(UNAVAILABLE_PAYLOAD, ensure_ascii=False).encode('utf-8'))
+            outcome = UNAVAILABLE
+        else:
+            with open(self.files[name], 'rb') as f:
+                content = f.read()
+            if fault == TRUNCATED:
+                # Announce the whole body, send half of it and drop the connection
+                self.send(request, 200, content, length=len(content) // 2)
+                request.close_connection = True
+                outcome = TRUNCATED
+            else:
+                self.send(request, 200, content)
+                outcome = OK
+
+        with self.lock:
+            self.outcomes[outcome] += 1
+
+    def send(self, request, status, body, headers=None, length=None):
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            request.send_header(header, value)
+        request.end_headers()
+        request.wfile.write(body[:length])
+        request.wfile.flush()
+
+    def start(self, port=0):
+        simulator = self
+
+        class PortalHandler(BaseHTTPRequestHandler):
+            # Keep-alive connections, as the downloaders pool them
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                simulator.respond(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), PortalHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def parse_error_rate(value):
+    """Parse STATUS=RATE of the --error-rate option"""
+    status, _, rate = value.partition('=')
+    try:
+        return int(status), float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected STATUS=RATE, e.g. 429=0.05: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the sample files as a local portal with injected faults')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+    parser.add_argument('--latency', default='fixed:0',
+                        help='Response delay: fixed:S, uniform:MIN:MAX, exponential:MEAN or lognormal:MEDIAN:SIGMA')
+    parser.add_argument('--error-rate', type=parse_error_rate, action='append', default=[], metavar='STATUS=RATE',
+                        help='Share of requests answered with a status, repeatable (e.g. 429=0.05)')
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help='Share of bodies cut off halfway')
+    parser.add_argument('--unavailable-rate', type=float, default=0.0,
+                        help='Share of files answered with the "не существует или недоступен" payload')
+    parser.add_argument('--retry-after', type=int, help='Retry-After seconds sent with 429')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the fault generator')
+
+    args = parser.parse_args()
+    try:
+        parse_latency(args.latency)
+    except ValueError as e:
+        print(str(e))
+        return
+
+    simulator = PortalSimulator(latency=args.latency, error_rates=dict(args.error_rate),
+                                truncate_rate=args.truncate_rate, unavailable_rate=args.unavailable_rate,
+                                retry_after=args.retry_after, seed=args.seed).start(args.port)
+    print(f"Serving {len(simulator.files)} files at {simulator.base_url}, press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    simulator.stop()
+    print(f"{sum(simulator.requests.values())} requests: "
+          f"{', '.join(f'{outcome} {count}' for outcome, count in sorted(simulator.outcomes.items()))}")
+
+
+if __name__ == '__main__':
+    main()
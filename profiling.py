@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Module to profile ingest commands and write reproducible performance artifacts.
+
+cProfile is built on sys.monitoring (Python 3.12+), which reports the calls of every
+thread to the one active profiler; a second profiler per thread cannot be enabled. A stage
+profile therefore includes the download and writer threads the stage starts: their call
+counts are complete, but the times of functions running concurrently in several threads
+overlap in one call tree and do not add up to the stage's wall time. The report gives the
+number of threads of each stage and marks such profiles; per-document times are in slowest.txt.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+MULTITHREADED_NOTE = ('Calls of all {threads} threads of the stage are in one profile: call counts are complete, '
+                      'times of functions running concurrently in several threads overlap')
+
+
+class Profiler:
+    """Collects per-stage CPU profiles, wall times and the slowest processed items"""
+
+    def __init__(self, output_dir, top_n=20):
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.stages = []
+        self.items = []
+        self.started = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        os.makedirs(output_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name):
+        """Profile a named stage with cProfile and record its wall time and the threads it ran"""
+        profile = cProfile.Profile()
+        # The calling thread and the threads started during the stage; idle threads do not count
+        threads = {threading.get_ident()}
+
+        def count_thread(frame, event, arg):
+            # Called once in each thread started during the stage, then removed from it
+            threads.add(threading.get_ident())
+            sys.setprofile(None)
+
+        start = time.perf_counter()
+        threading.setprofile(count_thread)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            threading.setprofile(None)
+            elapsed = time.perf_counter() - start
+
+            # Keep the raw profile for snakeviz/pstats and a readable text summary next to it
+            profile.dump_stats(os.path.join(self.output_dir, f'{name}.prof'))
+            stream = io.StringIO()
+            note = MULTITHREADED_NOTE.format(threads=len(threads)) if len(threads) > 1 else None
+            if note:
+                stream.write(f"{note}\n\n")
+            pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(40)
+            with open(os.path.join(self.output_dir, f'{name}.txt'), 'w', encoding='utf-8') as f:
+                f.write(stream.getvalue())
+
+            stage = {'stage': name, 'wall_seconds': round(elapsed, 6), 'threads': len(threads)}
+            if note:
+                stage['note'] = note
+            self.stages.append(stage)
+
+    def record_item(self, kind, name, size, seconds):
+        """Record a processed document or table with its size in bytes and processing time"""
+        self.items.append({
+            'kind': kind,
+            'name': name,
+            'size': size,
+            'seconds': round(seconds, 6)
+        })
+
+    def write_report(self):
+        """Write the wall-time breakdown and the top N slowest items to the output directory"""
+        total = sum(stage['wall_seconds'] for stage in self.stages)
+        for stage in self.stages:
+            stage['share'] = round(stage['wall_seconds'] / total, 4) if total else 0.0
+
+        slowest = sorted(self.items, key=lambda item: item['seconds'], reverse=True)[:self.top_n]
+
+        report = {
+            'started': self.started,
+            'finished': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'total_wall_seconds': round(total, 6),
+            'stages': self.stages,
+            'items_processed': len(self.items),
+            'slowest': slowest
+        }
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        with open(os.path.join(self.output_dir, 'slowest.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"{'seconds':>10}  {'bytes':>10}  kind  name\n")
+            for item in slowest:
+                size = item['size'] if item['size'] is not None else '-'
+                f.write(f"{item['seconds']:>10.3f}  {size:>10}  {item['kind']}  {item['name']}\n")
+
+        print(f"Profile written to {self.output_dir}")
+
+
+def add_profile_arguments(parser):
+    """Add the --profile and --profile-top options to a command line parser"""
+    parser.add_argument('--profile', metavar='DIR', help='Write per-stage CPU profiles and timings to DIR')
+    parser.add_argument('--profile-top', type=int, default=20, metavar='N',
+                        help='Number of slowest documents/tables to list in the profile (default: 20)')
+
+
+def create_profiler(args):
+    """Create a Profiler from parsed command line arguments, or None if profiling is off"""
+    if not getattr(args, 'profile', None):
+        return None
+    output_dir = os.path.join(args.profile, datetime.now().strftime('%Y%m%dT%H%M%S'))
+    return Profiler(output_dir, top_n=args.profile_top)
+
+
+def profile_stage(profiler, name):
+    """Return a stage context for the profiler, or a no-op context when profiling is off"""
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Module to keep every fetched document in a compressed raw-document table keyed by
+regnum/version, with selected JSON paths promoted to indexed columns.
+
+Promoting a new path is a schema-only change: the column is added, indexed and
+backfilled from the stored documents, no refetch needed. The backfill reads the path with
+the same compiled extractor and text conversion as ingest (on SQLite as a SQL function in
+one UPDATE), so a value is stored the same way whichever path wrote it.
+"""
+
+import argparse
+import gzip
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+from db_utils import get_db_connection, get_db_type, connection_type, create_index_sql, create_table_sqlite_to_sqlserver
+from mappings import compile_function, path_expression
+
+RAW_TABLE = 'rawdocuments'
+PATHS_TABLE = 'rawdocument_paths'
+
+RAW_COLUMNS = [
+    'regnum NVARCHAR(36) NOT NULL',
+    'version INTEGER NOT NULL',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'documenttype NVARCHAR(50)',
+    'scheme_version NVARCHAR(10)',
+    'href TEXT',
+    'content BLOB'
+]
+RAW_KEY_COLUMNS = ['regnum', 'version']
+
+PATHS_COLUMNS = [
+    'name NVARCHAR(64) PRIMARY KEY',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'path TEXT'
+]
+
+# Paths inside the structured document promoted when the table is created
+DEFAULT_PATHS = [
+    ('publish_date', 'commonInfo.publishDate'),
+    ('time_zone_code', 'commonInfo.timeZone.code'),
+    ('hosting_org_code', 'hostingOrg.code')
+]
+
+BACKFILL_CHUNK = 1000
+
+# Promoted column names go into DDL, so only plain lower-case identifiers are accepted
+COLUMN_NAME = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+def create_raw_tables(cursor):
+    """Create the raw-document table, its promoted-path registry and default promoted columns"""
+    column_defs = RAW_COLUMNS + [f'{name} NVARCHAR(255)' for name, _ in DEFAULT_PATHS]
+    create_sql = (f"CREATE TABLE IF NOT EXISTS {RAW_TABLE} ({', '.join(column_defs)}, "
+                  f"PRIMARY KEY ({', '.join(RAW_KEY_COLUMNS)}))")
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+
+    create_sql = f"CREATE TABLE IF NOT EXISTS {PATHS_TABLE} ({', '.join(PATHS_COLUMNS)})"
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+
+    cursor.execute(f"SELECT COUNT(*) FROM {PATHS_TABLE}")
+    if cursor.fetchone()[0] == 0:
+        now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        cursor.executemany(f"INSERT INTO {PATHS_TABLE} (name, createdate, updatedate, path) VALUES (?, ?, ?, ?)",
+                           [(name, now, now, path) for name, path in DEFAULT_PATHS])
+
+    for name, _ in DEFAULT_PATHS:
+        cursor.execute(create_index_sql(f'ix_{RAW_TABLE}_{name}', RAW_TABLE, [name]))
+
+    # Paths read before the raw store existed are empty; read them again from the new tables
+    promoted_paths.cache_clear()
+    promoted_extractor.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def promoted_paths():
+    """
+    Return the promoted (column, path) pairs in table column order, read once per process.
+    Before the raw store is created there are none; create_raw_tables clears the cache.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if connection_type(conn) == 'SQLSERVER':
+            cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME IN (?, ?)",
+                           (RAW_TABLE, PATHS_TABLE))
+        else:
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+                           (RAW_TABLE, PATHS_TABLE))
+        if cursor.fetchone()[0] < 2:
+            return ()
+        cursor.execute(f"SELECT name, path FROM {PATHS_TABLE}")
+        paths = dict(cursor.fetchall())
+        cursor.execute(f"SELECT * FROM {RAW_TABLE} WHERE 1 = 0")
+        return tuple((column[0], paths[column[0]]) for column in cursor.description if column[0] in paths)
+    finally:
+        conn.close()
+
+
+def columns():
+    """Return the raw-document table columns, including promoted ones"""
+    return [definition.split()[0] for definition in RAW_COLUMNS] + [name for name, _ in promoted_paths()]
+
+
+def compile_promoted_extractor(paths):
+    """Compile a function returning the promoted values of a structured document as a tuple"""
+    values = ''.join(f"text({path_expression('doc', path)}), " for _, path in paths)
+    function = compile_function('extract', f"def extract(doc):\n    return ({values})\n")
+    function.__globals__['text'] = str_or_none
+    return function
+
+
+@lru_cache(maxsize=None)
+def promoted_extractor():
+    """Return the compiled extractor for the currently promoted paths"""
+    return compile_promoted_extractor(promoted_paths())
+
+
+def str_or_none(value):
+    """Convert a promoted JSON value to text, keeping objects and arrays as JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def raw_row(reg_num, href, document, content, now):
+    """Build a raw-document row from a fetched document and its gzip-compressed bytes"""
+    structured_obj = document.get('exportObject', {}).get('structuredObject', {})
+    document_type, structured = next(iter(structured_obj.items()), (None, {}))
+
+    return (
+        reg_num,
+        structured.get('version') or 0,
+        now, now,
+        document_type,
+        structured.get('schemeVersion'),
+        href,
+        content
+    ) + promoted_extractor()(structured)
+
+
+def compress(content):
+    """Compress raw document bytes; gzip is also readable by SQL Server DECOMPRESS()"""
+    return gzip.compress(content, compresslevel=6)
+
+
+def gunzip(content):
+    """Decompress a stored document to JSON text"""
+    return gzip.decompress(content).decode('utf-8') if content is not None else None
+
+
+def get_document(reg_num, version=None):
+    """Return the stored document for a regnum (latest version unless given) as parsed JSON"""
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    if version is None:
+        cursor.execute(f"SELECT content FROM {RAW_TABLE} WHERE regnum = ? ORDER BY version DESC", (reg_num,))
+    else:
+        cursor.execute(f"SELECT content FROM {RAW_TABLE} WHERE regnum = ? AND version = ?", (reg_num, version))
+    row = cursor.fetchone()
+    conn.close()
+    return json.loads(gunzip(row[0])) if row else None
+
+
+def promote_path(name, path):
+    """Add an indexed column for a JSON path and backfill it from the stored documents"""
+    path = path[2:] if path.startswith('$.') else path
+    if not COLUMN_NAME.match(name):
+        raise ValueError(f"Invalid column name: {name}. Use lower-case letters, digits and underscores")
+    if name in columns():
+        raise ValueError(f"{RAW_TABLE}.{name} already exists")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    add_keyword = 'ADD' if get_db_type() == 'SQLSERVER' else 'ADD COLUMN'
+    cursor.execute(f"ALTER TABLE {RAW_TABLE} {add_keyword} {name} NVARCHAR(255)")
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    cursor.execute(f"INSERT INTO {PATHS_TABLE} (name, createdate, updatedate, path) VALUES (?, ?, ?, ?)",
+                   (name, now, now, path))
+    conn.commit()
+
+    extract = compile_promoted_extractor([(name, path)])
+    if get_db_type() == 'SQLSERVER':
+        updated = backfill_in_chunks(conn, name, extract)
+    else:
+        # SQLite backfills in one statement, with the extractor as a function over the stored document
+        conn.create_function('promoted_value', 2, lambda content, document_type:
+                             promoted_value(extract, content, document_type), deterministic=True)
+        cursor.execute(f"UPDATE {RAW_TABLE} SET {name} = promoted_value(content, documenttype), updatedate = ?",
+                       (datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),))
+        updated = cursor.rowcount
+        conn.commit()
+
+    cursor.execute(create_index_sql(f'ix_{RAW_TABLE}_{name}', RAW_TABLE, [name]))
+    conn.commit()
+    conn.close()
+
+    promoted_paths.cache_clear()
+    promoted_extractor.cache_clear()
+    print(f"Promoted {path} to {RAW_TABLE}.{name}, backfilled {updated} documents")
+    return updated
+
+
+def promoted_value(extract, content, document_type):
+    """Return the value of one promoted path of a stored document, as ingest stores it"""
+    document = json.loads(gunzip(content))
+    structured = document.get('exportObject', {}).get('structuredObject', {}).get(document_type, {})
+    return extract(structured)[0]
+
+
+def backfill_in_chunks(conn, name, extract):
+    """Backfill a promoted column chunk by chunk in Python, ordered by the primary key"""
+    read_cursor = conn.cursor()
+    write_cursor = conn.cursor()
+    write_cursor.fast_executemany = True
+    last_key = ('', -1)
+    updated = 0
+
+    while True:
+        read_cursor.execute(f"""
+            SELECT TOP {BACKFILL_CHUNK} regnum, version, documenttype, content FROM {RAW_TABLE}
+            WHERE regnum > ? OR (regnum = ? AND version > ?)
+            ORDER BY regnum, version
+        """, (last_key[0], last_key[0], last_key[1]))
+        rows = read_cursor.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        for reg_num, version, document_type, content in rows:
+            updates.append((promoted_value(extract, content, document_type), now, reg_num, version))
+        write_cursor.executemany(f"UPDATE {RAW_TABLE} SET {name} = ?, updatedate = ? WHERE regnum = ? AND version = ?",
+                                 updates)
+        conn.commit()
+
+        updated += len(updates)
+        last_key = (rows[-1][0], rows[-1][1])
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the compressed raw-document store')
+    parser.add_argument('--createdb', action='store_true', help='Create the raw-document tables')
+    parser.add_argument('--promote', nargs=2, metavar=('NAME', 'PATH'),
+                        help="Promote a JSON path (e.g. '$.commonInfo.timeZone.name') to an indexed column")
+    parser.add_argument('--show', metavar='REGNUM', help='Print the stored document for a regnum')
+    parser.add_argument('--version', type=int, help='Document version for --show (default: latest)')
+
+    args = parser.parse_args()
+
+    if args.createdb:
+        conn = get_db_connection()
+        create_raw_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        print("Raw-document tables created successfully.")
+
+    if args.promote:
+        try:
+            promote_path(*args.promote)
+        except ValueError as e:
+            print(str(e))
+
+    if args.show:
+        document = get_document(args.show, args.version)
+        print(json.dumps(document, ensure_ascii=False, indent=2) if document else f"No document for {args.show}")
+
+    if not any([args.createdb, args.promote, args.show]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
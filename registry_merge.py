@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Module to merge registry entries (listObjects) of overlapping period files before their
+documents are fetched.
+
+Feeds publish cumulative snapshots (data-20220101T0000-20251222T0000-...) next to daily
+deltas covering the same days, and every new version of a plan is another entry with the
+same regNum. RegistryIndex keeps only the newest entry per (regNum, documentType): the one
+with the latest publishDate, and of equal dates the one from the later file. Entries are
+slot-based records holding the extracted column values, with the strings repeated across
+entries (regNum, documentType, organization codes) interned, so a million-entry index
+stays a fraction of the size of the parsed JSON files.
+"""
+
+import argparse
+import json
+import os
+import sys
+from mappings import REGISTRY_FIELDS, registry_extractor, structure_version
+
+# Registry values as extracted by mappings.registry_extractor, in REGISTRY_FIELDS order
+REGISTRY_VALUE_COLUMNS = [column for column, _ in REGISTRY_FIELDS]
+KEY_COLUMNS = ['regnum', 'documenttype']
+DATE_COLUMN = 'publishdate'
+HREF_COLUMN = 'href'
+# Values shared by many entries; hrefs are unique and are not interned
+INTERNED_COLUMNS = ['regnum', 'hostingorg', 'bidderorgcode', 'documenttype']
+
+
+class RegistryEntry:
+    """The newest registry entry seen for one key: its column values, publish date and input rank"""
+
+    __slots__ = ('values', 'publish_date', 'rank')
+
+    def __init__(self, values, publish_date, rank):
+        self.values = values
+        self.publish_date = publish_date
+        self.rank = rank
+
+
+class RegistryIndex:
+    """
+    In-memory index of the newest entry per key over any number of inputs. Values are tuples
+    of the given columns; inputs are added in order with increasing rank (file order).
+    """
+
+    def __init__(self, columns=REGISTRY_VALUE_COLUMNS):
+        self.columns = list(columns)
+        self.key_positions = [self.columns.index(column) for column in KEY_COLUMNS]
+        self.date_position = self.columns.index(DATE_COLUMN)
+        self.href_position = self.columns.index(HREF_COLUMN)
+        self.interned = {self.columns.index(column) for column in INTERNED_COLUMNS if column in self.columns}
+        self.entries = {}
+        self.seen = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def intern(self, values):
+        return tuple(sys.intern(value) if position in self.interned and isinstance(value, str) else value
+                     for position, value in enumerate(values))
+
+    def add(self, values, rank=0):
+        """Add one entry; it replaces the indexed entry of its key unless that one is newer"""
+        self.seen += 1
+        values = self.intern(values)
+        key = tuple(values[position] for position in self.key_positions)
+        publish_date = values[self.date_position] or ''
+        current = self.entries.get(key)
+        if current is None or (publish_date, rank) >= (current.publish_date, current.rank):
+            self.entries[key] = RegistryEntry(values, publish_date, rank)
+
+    def add_all(self, rows, rank=0):
+        for values in rows:
+            self.add(values, rank)
+
+    def rows(self):
+        """Yield the values of the newest entry of every key"""
+        for entry in self.entries.values():
+            yield entry.values
+
+    def records(self):
+        """Return (regnum, documenttype, href) of the newest entries that reference a document"""
+        regnum, document_type = self.key_positions
+        return [(entry.values[regnum], entry.values[document_type], entry.values[self.href_position])
+                for entry in self.entries.values() if entry.values[self.href_position]]
+
+    @property
+    def duplicates(self):
+        return self.seen - len(self.entries)
+
+
+def merge_files(files):
+    """Merge the listObjects of registry files (in the given order) into a RegistryIndex"""
+    index = RegistryIndex()
+    for rank, filepath in enumerate(files):
+        extract = registry_extractor(structure_version(filepath))
+        with open(filepath, 'r', encoding='utf-8') as f:
+            objects = json.load(f).get('listObjects', [])
+        index.add_all((extract(obj) for obj in objects), rank)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge overlapping registry files and count the unique documents')
+    parser.add_argument('files', nargs='+', help='Registry data-*.json files, oldest period first')
+
+    args = parser.parse_args()
+    missing = [filepath for filepath in args.files if not os.path.exists(filepath)]
+    if missing:
+        print(f"Files not found: {', '.join(missing)}")
+        return
+    index = merge_files(args.files)
+    print(f"{index.seen} entries, {len(index)} unique, {index.duplicates} superseded; "
+          f"{len(index.records())} documents to fetch")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Module to replicate the tables of one database backend into the other: SQLite edge nodes
+publish to SQL Server, or a SQL Server snapshot is pulled into SQLite for offline analysis.
+
+Every table present in both databases is streamed in chunks ordered by its key (keyset
+paging, no OFFSET). A chunk is written in one transaction: into SQL Server by a
+fast_executemany insert into a temporary staging table and one MERGE from it, into SQLite
+by one executemany INSERT OR REPLACE. Before the commit the chunk is read back from the
+target and its checksum compared with the source rows, so a truncated or converted value
+fails the run instead of being published.
+
+Replication is incremental by the source's ingest watermark: a table is skipped while the
+watermark did not move since its last replication, otherwise only rows with an updatedate
+from the end of the previously replicated load on are copied. Every in-place UPDATE of a
+replicated table (a closed history interval, the backfills) stamps updatedate for this, and
+tables without updatedate (the aggregates) are copied in full. Deleted rows (reload of a
+month) are not propagated; --full empties the target tables and copies everything.
+The target schema is created beforehand, e.g. TORGIDB=SQLSERVER python cli.py ingest --createdb.
+"""
+
+import argparse
+import hashlib
+import os
+import platform
+from datetime import date, datetime
+from decimal import Decimal
+from db_utils import (SQLITE_DATABASE, WATERMARK_TABLE, connection_type, create_table_sqlite_to_sqlserver,
+                      get_db_connection, get_db_type, optimize_database)
+from partitions import STAGING_SUFFIX, TRASH_SUFFIX
+from search import SEARCH_TABLE
+from workqueue import QUEUE_TABLE
+
+DEFAULT_CHUNK_SIZE = 10000
+# Rows read back per verification query: at most 4 key columns stay within the 2100 parameters of SQL Server
+VERIFY_CHUNK = 500
+STATE_TABLE = 'replication_state'
+STATE_COLUMNS = [
+    'source NVARCHAR(255) NOT NULL',
+    'table_name NVARCHAR(128) NOT NULL',
+    'watermark INTEGER',
+    'since NVARCHAR(20)',
+    'updatedate NVARCHAR(20)',
+    'PRIMARY KEY (source, table_name)'
+]
+CHANGE_COLUMN = 'updatedate'
+# Not replicated: the watermarks and the work queue of each database, and the full-text index
+# whose structure differs between the backends (rebuild it on the target with search.py --rebuild)
+SKIPPED_TABLES = {WATERMARK_TABLE, STATE_TABLE, QUEUE_TABLE}
+SKIPPED_PREFIXES = (SEARCH_TABLE, 'sqlite_')
+SKIPPED_SUFFIXES = (STAGING_SUFFIX, TRASH_SUFFIX)
+
+
+def list_tables(conn):
+    """Return the names of the user tables of a database"""
+    if connection_type(conn) == 'SQLSERVER':
+        sql = "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE'"
+    else:
+        sql = "SELECT name FROM sqlite_master WHERE type = 'table'"
+    return [row[0] for row in conn.cursor().execute(sql).fetchall()]
+
+
+def replicated_tables(source, target, tables=None):
+    """Return the tables present in both databases that are replicated, in source order"""
+    target_tables = {name.lower() for name in list_tables(target)}
+    names = [name for name in list_tables(source) if name.lower() in target_tables
+             and name.lower() not in SKIPPED_TABLES
+             and not name.lower().startswith(SKIPPED_PREFIXES) and not name.lower().endswith(SKIPPED_SUFFIXES)]
+    if tables:
+        wanted = {name.lower() for name in tables}
+        names = [name for name in names if name.lower() in wanted]
+    return sorted(names)
+
+
+def table_columns(conn, table_name):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM {table_name} WHERE 1 = 0")
+    return [column[0] for column in cursor.description]
+
+
+def key_columns(conn, table_name):
+    """
+    Return the primary key columns of a table; on SQL Server the columns of the primary key
+    or else of the first unique index (a partitioned table has a unique clustered index instead).
+    """
+    cursor = conn.cursor()
+    if connection_type(conn) == 'SQLITE':
+        info = cursor.execute(f"PRAGMA table_info({table_name})").fetchall()
+        return [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+
+    rows = cursor.execute("""
+        SELECT i.index_id, c.name FROM sys.indexes i
+        JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE i.object_id = OBJECT_ID(?) AND i.is_unique = 1 AND ic.is_included_column = 0
+        ORDER BY i.is_primary_key DESC, i.index_id, ic.key_ordinal
+    """, (table_name,)).fetchall()
+    return [name for index_id, name in rows if index_id == rows[0][0]] if rows else []
+
+
+def after_key(keys):
+    """Return a condition selecting the rows after a key in key order, for after_key_params(key)"""
+    terms = [' AND '.join([f'[{column}] = ?' for column in keys[:n]] + [f'[{keys[n]}] > ?'])
+             for n in range(len(keys))]
+    return '(' + ' OR '.join(f'({term})' for term in terms) + ')'
+
+
+def after_key_params(key):
+    return [value for n in range(len(key)) for value in key[:n + 1]]
+
+
+def canonical(value):
+    """
+    Return a value in a form that is equal on both backends: SQL Server returns DATETIME2,
+    DATE and DECIMAL as datetime, date and Decimal where SQLite returns text and numbers.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='milliseconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return format(Decimal(str(value)).normalize(), 'f')
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return value
+
+
+def checksum(rows):
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(repr(tuple(canonical(value) for value in row)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def sqlite_value(value):
+    """Convert a value read from SQL Server to the text the loaders store in SQLite"""
+    if isinstance(value, (datetime, date, Decimal)):
+        return canonical(value)
+    return value
+
+
+class ChunkWriter:
+    """Writes chunks of one table into the target, upserting by the key columns"""
+
+    def __init__(self, conn, table_name, columns, keys):
+        self.conn = conn
+        self.table_name = table_name
+        self.columns = columns
+        self.keys = keys
+        self.column_list = ', '.join(f'[{column}]' for column in columns)
+        self.placeholders = ', '.join('?' for _ in columns)
+        self.sqlserver = connection_type(conn) == 'SQLSERVER'
+        self.staging = f'#replica_{table_name}'
+        if self.sqlserver:
+            cursor = conn.cursor()
+            cursor.execute(f"IF OBJECT_ID('tempdb..{self.staging}') IS NOT NULL DROP TABLE {self.staging}")
+            cursor.execute(f"SELECT TOP 0 {self.column_list} INTO {self.staging} FROM {table_name}")
+
+    def write(self, rows):
+        cursor = self.conn.cursor()
+        if not self.sqlserver:
+            cursor.executemany(f"INSERT OR REPLACE INTO {self.table_name} ({self.column_list}) "
+                               f"VALUES ({self.placeholders})",
+                               [tuple(sqlite_value(value) for value in row) for row in rows])
+            return
+
+        # Bulk insert into the staging table in one round-trip, then one set-based MERGE
+        cursor.execute(f"TRUNCATE TABLE {self.staging}")
+        cursor.fast_executemany = True
+        cursor.executemany(f"INSERT INTO {self.staging} ({self.column_list}) VALUES ({self.placeholders})", rows)
+        match_clause = ' AND '.join(f'target.[{column}] = source.[{column}]' for column in self.keys)
+        update_clause = ', '.join(f'target.[{column}] = source.[{column}]'
+                                  for column in self.columns if column not in self.keys)
+        # A table of key columns only has nothing to update
+        matched_clause = f"WHEN MATCHED THEN\n    UPDATE SET {update_clause}\n" if update_clause else ''
+        cursor.execute(f"""
+MERGE [{self.table_name}] WITH (HOLDLOCK) AS target
+USING {self.staging} AS source
+ON {match_clause}
+{matched_clause}WHEN NOT MATCHED THEN
+    INSERT ({self.column_list})
+    VALUES ({', '.join(f'source.[{column}]' for column in self.columns)});
+""")
+
+    def close(self):
+        if self.sqlserver:
+            self.conn.cursor().execute(f"DROP TABLE {self.staging}")
+
+
+def select_sql(conn, table_name, columns, keys, conditions, limit):
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    order = ', '.join(f'[{column}]' for column in keys)
+    column_list = ', '.join(f'[{column}]' for column in columns)
+    if connection_type(conn) == 'SQLSERVER':
+        return f"SELECT TOP {limit} {column_list} FROM {table_name} {where} ORDER BY {order}"
+    return f"SELECT {column_list} FROM {table_name} {where} ORDER BY {order} LIMIT {limit}"
+
+
+def read_chunk(conn, table_name, columns, keys, since, last_key, chunk_size):
+    """Read the next chunk of rows after last_key (changed since the given updatedate)"""
+    conditions, params = [], []
+    if since is not None:
+        conditions.append(f"[{CHANGE_COLUMN}] >= ?")
+        params.append(since)
+    if last_key is not None:
+        conditions.append(after_key(keys))
+        params.extend(after_key_params(last_key))
+    sql = select_sql(conn, table_name, columns, keys, conditions, chunk_size)
+    return conn.cursor().execute(sql, params).fetchall()
+
+
+def read_back(conn, table_name, columns, key_positions, key_values):
+    """Read the target rows with the given keys and return them by their canonical key"""
+    keys = [columns[position] for position in key_positions]
+    column_list = ', '.join(f'[{column}]' for column in columns)
+    stored = {}
+    for start in range(0, len(key_values), VERIFY_CHUNK):
+        part = key_values[start:start + VERIFY_CHUNK]
+        if len(keys) == 1:
+            where = f"[{keys[0]}] IN ({', '.join('?' for _ in part)})"
+        else:
+            where = ' OR '.join('(' + ' AND '.join(f'[{column}] = ?' for column in keys) + ')' for _ in part)
+        rows = conn.cursor().execute(f"SELECT {column_list} FROM {table_name} WHERE {where}",
+                                     [value for key in part for value in key]).fetchall()
+        stored.update({tuple(canonical(row[position]) for position in key_positions): row for row in rows})
+    return stored
+
+
+def source_name(conn, database=None):
+    """Name the source database in the replication state of the target"""
+    if connection_type(conn) == 'SQLSERVER':
+        return f"SQLSERVER:{os.getenv('SQL_SERVER', 'localhost')}/{database or os.getenv('SQL_DATABASE', 'torgi')}"
+    return f"SQLITE:{platform.node()}:{os.path.abspath(database or SQLITE_DATABASE)}"
+
+
+def source_watermark(conn):
+    """Return (watermark, time of the last completed load) of the source, (0, None) before the first load"""
+    try:
+        row = conn.cursor().execute(
+            f"SELECT value, updatedate FROM {WATERMARK_TABLE} WHERE name = 'ingest'").fetchone()
+    except Exception:
+        return 0, None
+    return (row[0], row[1]) if row else (0, None)
+
+
+def create_state_table(conn):
+    create_sql = f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ({', '.join(STATE_COLUMNS)})"
+    conn.cursor().execute(create_table_sqlite_to_sqlserver(create_sql, connection_type(conn)))
+    conn.commit()
+
+
+def read_state(conn, source, table_name):
+    """Return (watermark, since) of the last replication of a table, or None"""
+    return conn.cursor().execute(f"SELECT watermark, since FROM {STATE_TABLE} WHERE source = ? AND table_name = ?",
+                                 (source, table_name)).fetchone()
+
+
+def write_state(conn, source, table_name, watermark, since):
+    cursor = conn.cursor()
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    cursor.execute(f"UPDATE {STATE_TABLE} SET watermark = ?, since = ?, updatedate = ? "
+                   f"WHERE source = ? AND table_name = ?", (watermark, since, now, source, table_name))
+    if cursor.rowcount == 0:
+        cursor.execute(f"INSERT INTO {STATE_TABLE} (source, table_name, watermark, since, updatedate) "
+                       f"VALUES (?, ?, ?, ?, ?)", (source, table_name, watermark, since, now))
+    conn.commit()
+
+
+def replicate_table(source, target, table_name, since=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy the rows of a table (changed since the given updatedate) chunk by chunk; return the number copied"""
+    target_columns = {column.lower() for column in table_columns(target, table_name)}
+    columns = [column for column in table_columns(source, table_name) if column.lower() in target_columns]
+    keys = key_columns(source, table_name)
+    if not keys or any(key not in columns for key in keys):
+        print(f"Skipping {table_name}: no key columns")
+        return 0
+    if CHANGE_COLUMN not in columns:
+        since = None
+    key_positions = [columns.index(key) for key in keys]
+
+    writer = ChunkWriter(target, table_name, columns, keys)
+    copied = 0
+    last_key = None
+    while True:
+        rows = read_chunk(source, table_name, columns, keys, since, last_key, chunk_size)
+        if not rows:
+            break
+
+        writer.write(rows)
+        # Verify the chunk inside its transaction: a mismatch leaves the target as it was
+        row_keys = [tuple(row[position] for position in key_positions) for row in rows]
+        stored = read_back(target, table_name, columns, key_positions, row_keys)
+        matched = [stored.get(tuple(canonical(row[position]) for position in key_positions)) for row in rows]
+        if None in matched or checksum(matched) != checksum(rows):
+            target.rollback()
+            writer.close()
+            raise RuntimeError(f"Checksum mismatch in {table_name} for the chunk of {len(rows)} rows "
+                               f"after key {last_key}, the chunk was rolled back")
+        target.commit()
+
+        copied += len(rows)
+        last_key = row_keys[-1]
+    writer.close()
+    target.commit()
+    return copied
+
+
+def replicate(source_type, target_type, source_database=None, target_database=None, tables=None, full=False,
+              chunk_size=DEFAULT_CHUNK_SIZE):
+    """Replicate the tables from the source into the target database; return {table: rows copied}"""
+    source = get_db_connection('read', db_type=source_type, database=source_database)
+    target = get_db_connection('ingest', db_type=target_type, database=target_database)
+    create_state_table(target)
+    name = source_name(source, source_database)
+    # Rows of loads that end after this point are newer than since and are copied next time
+    watermark, loaded_at = source_watermark(source)
+
+    copied = {}
+    for table_name in replicated_tables(source, target, tables):
+        state = None if full else read_state(target, name, table_name)
+        if state is not None and state[0] == watermark:
+            print(f"{table_name}: unchanged since watermark {watermark}")
+            continue
+        if full:
+            clear = 'TRUNCATE TABLE' if connection_type(target) == 'SQLSERVER' else 'DELETE FROM'
+            target.cursor().execute(f"{clear} {table_name}")
+
+        copied[table_name] = replicate_table(source, target, table_name, since=state[1] if state else None,
+                                             chunk_size=chunk_size)
+        write_state(target, name, table_name, watermark, loaded_at)
+        print(f"{table_name}: {copied[table_name]} rows replicated")
+
+    if copied:
+        # Refresh statistics and advance the target's own watermark for its readers (api.py)
+        optimize_database(target)
+    source.close()
+    target.close()
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replicate tables between the SQLite and SQL Server databases')
+    parser.add_argument('--target', choices=['SQLITE', 'SQLSERVER'], help='Database to replicate into')
+    parser.add_argument('--source', choices=['SQLITE', 'SQLSERVER'],
+                        help='Database to replicate from (default: TORGIDB)')
+    parser.add_argument('--source-database', help='SQLite file or SQL Server database of the source')
+    parser.add_argument('--target-database', help='SQLite file or SQL Server database of the target')
+    parser.add_argument('--tables', help='Comma-separated tables to replicate (default: all present in both)')
+    parser.add_argument('--full', action='store_true', help='Empty the target tables and copy all rows')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Rows per chunk and transaction (default: {DEFAULT_CHUNK_SIZE})')
+
+    args = parser.parse_args()
+    if not args.target:
+        parser.print_help()
+        return
+
+    source_type = args.source or get_db_type()
+    if source_type == args.target and (args.source_database or None) == (args.target_database or None):
+        print("Source and target are the same database")
+        return
+    tables = args.tables.split(',') if args.tables else None
+    copied = replicate(source_type, args.target, args.source_database, args.target_database, tables=tables,
+                       full=args.full, chunk_size=args.chunk_size)
+    print(f"Replicated {sum(copied.values())} rows of {len(copied)} tables from {source_type} to {args.target}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Module to keep a full-text search index over privatization object names and locations
+and plan names, updated with every ingest batch.
+
+SQLite uses an FTS5 table holding Russian-stemmed text (Snowball stemmer below) ranked
+with bm25. FTS5 can only look rows up by rowid, so search_index_keys maps the globalid of a
+fact row to the rowid of its index row, and rows are removed by rowid instead of a scan of
+the whole index. SQL Server uses a full-text index with the Russian word breaker (LANGUAGE
+1049) and FORMSOF(INFLECTIONAL) queries, keyed by globalid itself.
+"""
+
+import argparse
+import re
+from db_utils import get_db_connection, get_db_type, optimize_database
+
+SEARCH_TABLE = 'search_index'
+KEYS_TABLE = 'search_index_keys'
+SQLSERVER_CATALOG = 'torgi_search'
+
+DELETE_CHUNK = 500
+
+SEARCH_FIELDS = ['globalid', 'kind', 'regnum', 'title_text', 'location_text', 'title', 'location']
+
+# Columns weights for bm25: matches in names rank above matches in locations
+TITLE_WEIGHT = 2.0
+LOCATION_WEIGHT = 1.0
+
+DEFAULT_LIMIT = 20
+READ_CHUNK = 10000
+
+TOKEN_RE = re.compile(r'[0-9a-zа-яё]+', re.IGNORECASE)
+
+# Prepositions and conjunctions that carry no meaning in names and addresses
+STOP_WORDS = frozenset(['в', 'во', 'на', 'по', 'и', 'или', 'с', 'со', 'к', 'ко', 'о', 'об', 'от', 'до', 'из',
+                        'за', 'для', 'у', 'при', 'под', 'над'])
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (('вшись', 'вши', 'в'), ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв'))
+REFLEXIVE = ('ся', 'сь')
+ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем',
+             'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+VERB = (('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н'),
+        ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены', 'ить',
+         'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю'))
+NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой', 'ий',
+        'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+
+def strip_ending(word, start, endings, after_a=False):
+    """Remove the longest ending found in word[start:]; after_a endings must follow а or я"""
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            if after_a and not word[:-len(ending)].endswith(('а', 'я')):
+                continue
+            return word[:-len(ending)], True
+    return word, False
+
+
+def strip_grouped(word, start, groups):
+    """Strip an ending of a two-group class: the first group must follow а or я"""
+    first, found = strip_ending(word, start, groups[0], after_a=True)
+    second, found_second = strip_ending(word, start, groups[1])
+    # Prefer the longer of the two matches, as Snowball does
+    if found and (not found_second or len(first) <= len(second)):
+        return first, True
+    return second, found_second
+
+
+def regions(word):
+    """Return the start of the RV and R2 regions of a word"""
+    rv = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS),
+              len(word))
+    return rv, r2
+
+
+def stem(word):
+    """Return the Snowball (Porter) Russian stem of a lowercase word; other words are returned as is"""
+    word = word.lower().replace('ё', 'е')
+    if not re.search('[а-я]', word):
+        return word
+    rv, r2 = regions(word)
+
+    word, found = strip_grouped(word, rv, PERFECTIVE_GERUND)
+    if not found:
+        word, _ = strip_ending(word, rv, REFLEXIVE)
+        word, found = strip_ending(word, rv, ADJECTIVE)
+        if found:
+            word, _ = strip_grouped(word, rv, PARTICIPLE)
+        else:
+            word, found = strip_grouped(word, rv, VERB)
+            if not found:
+                word, _ = strip_ending(word, rv, NOUN)
+
+    word, _ = strip_ending(word, rv, ('и',))
+    word, _ = strip_ending(word, r2, DERIVATIONAL)
+
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    else:
+        word, found = strip_ending(word, rv, SUPERLATIVE)
+        if found and word.endswith('нн'):
+            word = word[:-1]
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+def tokens(text):
+    """Split text into lowercase words, skipping stop words"""
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS] if text else []
+
+
+def index_text(text):
+    """Return the stemmed form of a text as stored in the SQLite index"""
+    return ' '.join(stem(token) for token in tokens(text))
+
+
+def create_tables(cursor):
+    """Create the search index: an FTS5 table on SQLite, a full-text indexed table on SQL Server"""
+    if get_db_type() == 'SQLSERVER':
+        create_sqlserver_index(cursor)
+        return
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+            globalid UNINDEXED, kind UNINDEXED, regnum UNINDEXED, title_text UNINDEXED, location_text UNINDEXED,
+            title, location, tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute(f"SELECT COUNT(*) FROM sqlite_master WHERE name = '{KEYS_TABLE}'")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE TABLE {KEYS_TABLE} (docid INTEGER PRIMARY KEY, globalid TEXT NOT NULL UNIQUE)")
+        # An index built before the key table existed gets its keys once
+        cursor.execute(f"INSERT INTO {KEYS_TABLE} (docid, globalid) SELECT rowid, globalid FROM {SEARCH_TABLE}")
+
+
+def create_sqlserver_index(cursor):
+    """Create the search table and its Russian full-text index on SQL Server"""
+    cursor.execute(f"""
+IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{SEARCH_TABLE}' AND xtype='U')
+BEGIN
+    CREATE TABLE {SEARCH_TABLE} (
+        globalid NVARCHAR(255) NOT NULL CONSTRAINT pk_{SEARCH_TABLE} PRIMARY KEY,
+        kind NVARCHAR(10), regnum NVARCHAR(36), title_text NVARCHAR(MAX), location_text NVARCHAR(MAX),
+        title NVARCHAR(MAX), location NVARCHAR(MAX)
+    )
+END
+""")
+    # Full-text catalogs and indexes cannot be created inside a user transaction
+    conn = cursor.connection
+    conn.commit()
+    conn.autocommit = True
+    try:
+        cursor.execute(f"""
+IF NOT EXISTS (SELECT * FROM sys.fulltext_catalogs WHERE name = '{SQLSERVER_CATALOG}')
+    CREATE FULLTEXT CATALOG {SQLSERVER_CATALOG}
+""")
+        cursor.execute(f"""
+IF NOT EXISTS (SELECT * FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('{SEARCH_TABLE}'))
+    CREATE FULLTEXT INDEX ON {SEARCH_TABLE} (title LANGUAGE 1049, location LANGUAGE 1049)
+    KEY INDEX pk_{SEARCH_TABLE} ON {SQLSERVER_CATALOG} WITH CHANGE_TRACKING AUTO
+""")
+    except Exception as e:
+        print(f"Warning: Could not create full-text index (is Full-Text Search installed?): {str(e)}")
+    finally:
+        conn.autocommit = False
+
+
+def search_row(global_id, kind, reg_num, title, location):
+    """Build a search index row; SQLite gets stemmed text, SQL Server stems itself"""
+    if get_db_type() == 'SQLSERVER':
+        return (global_id, kind, reg_num, title, location, title, location)
+    return (global_id, kind, reg_num, title, location, index_text(title), index_text(location))
+
+
+def write_rows(conn, rows):
+    """Insert search rows; fact rows get a new globalid on every ingest, so rows are only appended"""
+    if not rows:
+        return
+    cursor = conn.cursor()
+    placeholders = ', '.join(['?' for _ in SEARCH_FIELDS])
+    if get_db_type() == 'SQLSERVER':
+        cursor.fast_executemany = True
+        cursor.executemany(f"INSERT INTO {SEARCH_TABLE} ({', '.join(SEARCH_FIELDS)}) VALUES ({placeholders})", rows)
+        return
+    # The key table hands out the rowids, so an index row can be found by its globalid
+    cursor.executemany(f"INSERT INTO {KEYS_TABLE} (globalid) VALUES (?)", [row[:1] for row in rows])
+    cursor.executemany(f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_FIELDS)})
+        VALUES ((SELECT docid FROM {KEYS_TABLE} WHERE globalid = ?), {placeholders})
+    """, [row[:1] + tuple(row) for row in rows])
+
+
+def delete_rows(conn, global_ids):
+    """Remove the search rows of fact rows, in chunks; SQLite deletes them by rowid through the key table"""
+    cursor = conn.cursor()
+    for start in range(0, len(global_ids), DELETE_CHUNK):
+        chunk = global_ids[start:start + DELETE_CHUNK]
+        placeholders = ', '.join(['?' for _ in chunk])
+        if get_db_type() == 'SQLSERVER':
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE globalid IN ({placeholders})", chunk)
+            continue
+        cursor.execute(f"SELECT docid FROM {KEYS_TABLE} WHERE globalid IN ({placeholders})", chunk)
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = ?", cursor.fetchall())
+        cursor.execute(f"DELETE FROM {KEYS_TABLE} WHERE globalid IN ({placeholders})", chunk)
+
+
+def retract_batch(conn, adapter, rows):
+    """Unindex the plans and objects about to be removed (a partition reload), the caller commits"""
+    global_ids = []
+    for table_name in ('privatisationplanlist', 'privatizationobjects'):
+        position = adapter.columns(table_name).index('globalid')
+        global_ids.extend(row[position] for row in rows.get(table_name, []))
+    delete_rows(conn, global_ids)
+
+
+def apply_batch(conn, adapter, rows):
+    """Index the plans and objects of an ingest batch, the caller commits"""
+    search_rows = []
+
+    plan_columns = adapter.columns('privatisationplanlist')
+    for row in rows.get('privatisationplanlist', []):
+        plan = dict(zip(plan_columns, row))
+        search_rows.append(search_row(plan['globalid'], 'plan', plan['regnum'], plan['plan_name'], None))
+
+    object_columns = adapter.columns('privatizationobjects')
+    for row in rows.get('privatizationobjects', []):
+        item = dict(zip(object_columns, row))
+        search_rows.append(search_row(item['globalid'], 'object', item['id'], item['name'], item['location']))
+
+    write_rows(conn, search_rows)
+
+
+def rebuild_index():
+    """Recreate the search index from privatisationplanlist and privatizationobjects"""
+    conn = get_db_connection('ingest')
+    cursor = conn.cursor()
+    create_tables(cursor)
+    cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    if get_db_type() != 'SQLSERVER':
+        cursor.execute(f"DELETE FROM {KEYS_TABLE}")
+
+    indexed = 0
+    for kind, query in (('plan', "SELECT globalid, regnum, plan_name, NULL FROM privatisationplanlist"),
+                        ('object', "SELECT globalid, id, name, location FROM privatizationobjects")):
+        read_cursor = conn.cursor()
+        read_cursor.execute(query)
+        while True:
+            chunk = read_cursor.fetchmany(READ_CHUNK)
+            if not chunk:
+                break
+            write_rows(conn, [search_row(global_id, kind, reg_num, title, location)
+                              for global_id, reg_num, title, location in chunk])
+            indexed += len(chunk)
+        conn.commit()
+
+    if get_db_type() != 'SQLSERVER':
+        # Merge the FTS5 b-tree segments written by many small inserts
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        conn.commit()
+    optimize_database(conn)
+    conn.close()
+    print(f"Search index rebuilt: {indexed} rows")
+    return indexed
+
+
+def search(query, kind=None, limit=DEFAULT_LIMIT):
+    """
+    Search plans and objects by words of their names and locations. Every word must match,
+    in any grammatical form. Returns dicts with kind, regnum, title, location and rank.
+    """
+    words = tokens(query)
+    if not words:
+        return []
+
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    kind_filter = 'AND d.kind = ?' if kind else ''
+    if get_db_type() == 'SQLSERVER':
+        condition = ' AND '.join(f'FORMSOF(INFLECTIONAL, "{word}")' for word in words)
+        cursor.execute(f"""
+            SELECT TOP ({int(limit)}) d.kind, d.regnum, d.title_text, d.location_text, ft.RANK
+            FROM CONTAINSTABLE({SEARCH_TABLE}, (title, location), ?, LANGUAGE 1049) AS ft
+            JOIN {SEARCH_TABLE} d ON d.globalid = ft.[KEY]
+            WHERE 1 = 1 {kind_filter}
+            ORDER BY ft.RANK DESC
+        """, [condition] + ([kind] if kind else []))
+    else:
+        # Prefix match on stems also finds words typed partially, e.g. addresses
+        condition = ' '.join(f'"{stem(word)}"*' for word in words)
+        cursor.execute(f"""
+            SELECT d.kind, d.regnum, d.title_text, d.location_text,
+                   bm25({SEARCH_TABLE}, 0, 0, 0, 0, 0, {TITLE_WEIGHT}, {LOCATION_WEIGHT}) AS rank
+            FROM {SEARCH_TABLE} d
+            WHERE {SEARCH_TABLE} MATCH ? {kind_filter}
+            ORDER BY rank
+            LIMIT ?
+        """, [condition] + ([kind] if kind else []) + [limit])
+
+    results = [dict(zip(('kind', 'regnum', 'title', 'location', 'rank'), row)) for row in cursor.fetchall()]
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text search over privatization objects and plans')
+    parser.add_argument('query', nargs='?', help='Words to search for, e.g. an address')
+    parser.add_argument('--kind', choices=['object', 'plan'], help='Search only objects or only plans')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help='Maximum number of results')
+    parser.add_argument('--createdb', action='store_true', help='Create the search index')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from the fact tables')
+
+    args = parser.parse_args()
+
+    if args.createdb:
+        conn = get_db_connection()
+        create_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+        print("Search index created successfully.")
+
+    if args.rebuild:
+        rebuild_index()
+
+    if args.query:
+        for result in search(args.query, args.kind, args.limit):
+            print(f"{result['kind']}\t{result['regnum']}\t{result['title']}\t{result['location'] or ''}")
+
+    if not any([args.createdb, args.rebuild, args.query]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test script for the aggregate tables: exact sums and plan versions counted once
+"""
+
+from decimal import Decimal
+
+import aggregates
+from datasets import get_adapter
+from main import create_database
+from test_partitions import ingest, plan_document, query
+
+
+def plan_with_sums(first, second, third):
+    document = plan_document('2025-01-15T10:00:00+03:00', 2)
+    plan = document['exportObject']['structuredObject']['privatizationPlan']
+    plan['budgetRevenueForecast'] = {'sumFirstYear': first, 'sumSecondYear': second, 'sumThirdYear': third}
+    return document
+
+
+def revenue_rows():
+    rows = query("SELECT plans, sum_first_year, sum_second_year, sum_third_year FROM agg_plan_revenue")
+    return [tuple(value if value is None else round(value, 2) for value in row) for row in rows]
+
+
+def test_reprocessed_version_is_counted_once(tmp_path, monkeypatch):
+    """Sums are exact, a malformed sum is NULL and the same version ingested twice is counted once"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    create_database()
+    adapter = get_adapter('privatizationPlans')
+
+    ingest(adapter, 'R1', plan_with_sums('0,10', 'не указано', '1 000,05'))
+    ingest(adapter, 'R2', plan_with_sums('0.20', None, '2000.10'))
+    # --reprocess, a watch rerun or a retried batch write the same version again
+    ingest(adapter, 'R1', plan_with_sums('0,10', 'не указано', '1 000,05'))
+    assert query("SELECT COUNT(*) FROM privatisationplanlist") == [(3,)]
+
+    # SQLite adds the DECIMAL values of different batches as floating point, SQL Server exactly
+    assert revenue_rows() == [(2, 0.3, None, 3000.15)]
+    assert query("SELECT SUM(objects) FROM agg_plan_objects") == [(4,)]
+
+    # A rebuild from the fact tables, duplicated version included, gives the same totals
+    objects = sorted(query("SELECT * FROM agg_plan_objects"))
+    aggregates.rebuild_aggregates()
+    assert revenue_rows() == [(2, 0.3, None, 3000.15)]
+    assert sorted(query("SELECT * FROM agg_plan_objects")) == objects
+
+    # Within a batch the sums are exact
+    assert aggregates.plan_deltas([{'regnum': 'R1', 'version': 1, 'sum_first_year': '0.1'},
+                                   {'regnum': 'R2', 'version': 1, 'sum_first_year': '0.2'}])[0] == \
+        [('', 0, 2, Decimal('0.30'), None, None)]
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test script for the read-only query API: pagination, filters, field selection and the response cache
+"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import api
+import main
+from db_utils import get_db_connection, optimize_database, upsert_rows
+
+PLAN_COLUMNS = ['globalid', 'regnum', 'plan_name', 'org_code', 'publish_date_utc', 'publish_month']
+
+
+def start_api():
+    server = api.create_server('127.0.0.1', 0, watermark_interval=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def get(url, etag=None):
+    """Return (status, ETag, parsed body) of a GET request"""
+    request = urllib.request.Request(url, headers={'If-None-Match': etag} if etag else {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers['ETag'], json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        return e.code, e.headers['ETag'], json.loads(body) if body else None
+
+
+def load_plans(rows):
+    conn = get_db_connection('ingest')
+    upsert_rows(conn, 'privatisationplanlist', PLAN_COLUMNS, rows)
+    conn.commit()
+    optimize_database(conn)
+    conn.close()
+
+
+def test_keyset_pages_filters_and_fields(tmp_path, monkeypatch):
+    """Pages follow the next key; filters use the typed columns; only requested fields are returned"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    main.create_database()
+    load_plans([(f'g{i:02}', f'plan-{i}', f'Plan {i}', 'A' if i % 2 else 'B', f'2025-0{1 + i % 3}-10T00:00:00.000',
+                 f'2025-0{1 + i % 3}') for i in range(7)])
+    server, base_url = start_api()
+    try:
+        pages = []
+        url = f'{base_url}/plans?limit=3&fields=regnum,plan_name'
+        while url:
+            status, _, body = get(url)
+            assert status == 200
+            pages.append([item['regnum'] for item in body['items']])
+            url = f"{base_url}/plans?limit=3&fields=regnum,plan_name&after={body['next']}" if body['next'] else None
+        assert pages == [['plan-0', 'plan-1', 'plan-2'], ['plan-3', 'plan-4', 'plan-5'], ['plan-6']]
+        assert set(body['items'][0]) == {'regnum', 'plan_name'}
+
+        _, _, body = get(f'{base_url}/plans?org_code=A&published_from=2025-02-01&fields=regnum')
+        assert body == {'items': [{'regnum': 'plan-1'}, {'regnum': 'plan-5'}], 'next': None}
+        _, _, body = get(f'{base_url}/plans?publish_month=2025-03&fields=regnum')
+        assert [item['regnum'] for item in body['items']] == ['plan-2', 'plan-5']
+
+        assert get(f'{base_url}/plans?fields=nope')[0] == 400
+        assert get(f'{base_url}/plans?plan_name=x')[0] == 400
+        assert get(f'{base_url}/plans?published_from=soon')[0] == 400
+        assert get(f'{base_url}/unknown')[0] == 404
+        assert get(f'{base_url}/nsi/missing')[0] == 404
+
+        conn = get_db_connection()
+        conn.execute("CREATE TABLE nsi_region (globalid TEXT PRIMARY KEY, code TEXT, name TEXT)")
+        conn.execute("INSERT INTO nsi_region VALUES ('r1', '77', 'Москва')")
+        conn.commit()
+        conn.close()
+        assert get(f'{base_url}/nsi/region?fields=code,name')[2] == {'items': [{'code': '77', 'name': 'Москва'}],
+                                                                      'next': None}
+    finally:
+        server.shutdown()
+
+
+def test_cache_serves_repeats_until_the_watermark_moves(tmp_path, monkeypatch):
+    """Repeated queries come from the cache (also as 304) until a load advances the watermark"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    main.create_database()
+    load_plans([('g01', 'plan-1', 'Plan 1', 'A', '2025-01-10T00:00:00.000', '2025-01')])
+    server, base_url = start_api()
+    try:
+        status, etag, body = get(f'{base_url}/plans?fields=regnum')
+        assert (status, body['items']) == (200, [{'regnum': 'plan-1'}])
+
+        # A write that is not a load leaves the watermark, so the cached page is still served
+        conn = get_db_connection()
+        conn.execute("DELETE FROM privatisationplanlist")
+        conn.commit()
+        assert get(f'{base_url}/plans?fields=regnum') == (200, etag, body)
+        assert get(f'{base_url}/plans?fields=regnum', etag)[0] == 304
+        assert server.cache.hits == 2
+
+        # The next load advances the watermark: the cache is dropped and the ETag changes
+        optimize_database(conn)
+        conn.close()
+        status, new_etag, body = get(f'{base_url}/plans?fields=regnum', etag)
+        assert (status, body['items']) == (200, [])
+        assert new_etag != etag
+    finally:
+        server.shutdown()
+
+
+def test_unexpected_errors_answer_json_500(tmp_path, monkeypatch, capsys):
+    """A failing query is logged and answered with a JSON 500; the server keeps serving"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    main.create_database()
+    server, base_url = start_api()
+    try:
+        def broken(conn, path, params):
+            raise RuntimeError('database went away')
+
+        with monkeypatch.context() as patch:
+            patch.setattr(api, 'route', broken)
+            assert get(f'{base_url}/plans') == (500, None, {'error': 'Internal server error'})
+        assert get(f'{base_url}/plans?fields=regnum')[0] == 200
+        assert 'database went away' in capsys.readouterr().err
+    finally:
+        server.shutdown()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Test script for the indexed registry archive
+"""
+
+import json
+
+import archive
+import datasets
+from db_utils import get_db_connection
+
+
+def write_registry(directory, name, entries):
+    with open(directory / name, 'w', encoding='utf-8') as f:
+        json.dump({'listObjects': entries}, f)
+
+
+def entry(reg_num, document_type, publish_date):
+    return {'hostingOrg': '2500002862', 'bidderOrgCode': '2500002862', 'documentType': document_type,
+            'regNum': reg_num, 'publishDate': publish_date, 'href': f'https://example.org/{reg_num}.json'}
+
+
+def test_compact_lookup_and_reload(tmp_path, monkeypatch):
+    """Registry files are archived once, looked up by index and reloaded without the JSON files"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    loaded = tmp_path / 'privatisationplans' / 'loaded'
+    loaded.mkdir(parents=True)
+    write_registry(loaded, 'data-20250101T0000-20250201T0000-structure-20230401.json', [
+        entry('P1', 'privatizationPlan', '2025-01-10T00:00:00Z'),
+        entry('D1', 'privatizationDecision', '2025-01-20T00:00:00Z')
+    ])
+    write_registry(loaded, 'data-20250201T0000-20250301T0000-structure-20230401.json', [
+        entry('P1', 'privatizationPlan', '2025-02-05T00:00:00Z'),
+        entry('P2', 'privatizationPlan', '2025-02-15T00:00:00Z')
+    ])
+    directory = 'privatisationplans'
+
+    assert archive.compact(directory) == 4
+    # Already archived files are skipped
+    assert archive.compact(directory) == 0
+
+    assert [e['publishDate'] for _, e in archive.find_entries(directory, reg_num='P1')] == \
+        ['2025-01-10T00:00:00Z', '2025-02-05T00:00:00Z']
+    assert [e['regNum'] for _, e in archive.find_entries(directory, document_type='privatizationPlan',
+                                                          date_from='2025-02-01', date_to='2025-03-01')] == ['P1', 'P2']
+
+    adapter = datasets.get_adapter('privatizationPlans')
+    datasets.create_tables(adapter)
+    # P1 of January is superseded by its February entry
+    assert datasets.load_registry(adapter, from_archive=True) == 3
+    conn = get_db_connection()
+    assert conn.execute("SELECT COUNT(DISTINCT regnum) FROM privatisationplans").fetchone()[0] == 3
+    assert conn.execute("SELECT publishdate FROM privatisationplans WHERE regnum = 'P1'").fetchall() == \
+        [('2025-02-05T00:00:00Z',)]
+    conn.close()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Test script for cadastral number normalization
+"""
+
+from cadastral import find_kad_numbers
+
+
+def test_find_kad_numbers_normalizes_formatting():
+    """Spacing, short quarters and leading zeros do not create different numbers"""
+    assert find_kad_numbers('27:16:0020202:861') == ['27:16:0020202:861']
+    assert find_kad_numbers('кадастровый номер 27 : 16 : 020202 : 0861.') == ['27:16:0020202:861']
+    assert find_kad_numbers('2:5:1234567:1') == ['02:05:1234567:1']
+
+
+def test_find_kad_numbers_in_descriptions():
+    """All numbers mentioned in a free-text description are found once each"""
+    text = ('кадастровые номера:42:24:0301013:3314,42:24:0301013:3313, этажность 2 (42:24:0301013:3314), '
+            'площадью 1 659,7кв.м, тел. 8:800:2000:600')
+    assert find_kad_numbers(text) == ['42:24:0301013:3314', '42:24:0301013:3313']
+    assert find_kad_numbers(None) == []
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Test script for the command line entry point and the import-time check of its commands
+"""
+
+import os
+import subprocess
+import sys
+
+import cli
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Dependencies only the commands that download, transform or export may import
+HEAVY_MODULES = {'requests', 'urllib3', 'pandas', 'numpy', 'openpyxl', 'dotenv', 'pyodbc'}
+
+
+def imported_modules(code, cwd=BASE_DIR):
+    """Run code in a fresh interpreter and return the top-level packages it imported, with -X importtime"""
+    env = dict(os.environ, PYTHONPATH=BASE_DIR, TORGIDB='SQLITE')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr[-2000:]
+    lines = [line.split('|') for line in result.stderr.splitlines() if line.startswith('import time:')]
+    return {fields[2].strip().split('.')[0] for fields in lines if len(fields) == 3}
+
+
+def test_modules_import_without_heavy_dependencies():
+    """Importing the command modules loads none of requests, pandas, dotenv or pyodbc"""
+    modules = ['cli'] + sorted({target.split(':')[0] for target, _ in cli.COMMANDS.values()})
+    assert imported_modules(f"import {', '.join(modules)}") & HEAVY_MODULES == set()
+
+
+def test_short_commands_stay_light(tmp_path):
+    """ingest --createdb and diagnose only load python-dotenv, for the database settings"""
+    imported = imported_modules("import cli; cli.main(['ingest', '--createdb']); cli.main(['diagnose'])",
+                                cwd=tmp_path)
+    assert imported & HEAVY_MODULES == {'dotenv'}
+    assert (tmp_path / 'torgi.db').exists()
+
+
+def test_commands_get_their_own_options(monkeypatch):
+    """The command's own parser sees the remaining options and names the command in its usage"""
+    monkeypatch.setitem(cli.COMMANDS, 'echo', ('test_cli:echo_command', 'Print the options'))
+    monkeypatch.setattr(sys, 'argv', ['cli.py'])
+    assert cli.main(['echo', '--flag', 'value']) == ['--flag', 'value']
+    assert sys.argv[0].endswith(' echo')
+
+
+def echo_command():
+    return sys.argv[1:]
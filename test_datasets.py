@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script for the dataset adapter engine using a local HTTP server instead of the portal
+"""
+
+import functools
+import json
+import os
+import shutil
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import aggregates
+import cadastral
+import datasets
+import main
+import rawstore
+import search
+from db_utils import get_db_connection
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'privatisationplans')
+SAMPLE_PLAN = 'privatizationPlan_20250114250000286202_77abf88a-e2f2-4924-b565-b0fbf7788d1d.json'
+SAMPLE_DECISION = 'privatizationDecision_041422000005130003020003_3fabcaea-cfcf-4f48-b3e8-a3d7cbe2a27c.json'
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(directory):
+    """Serve a directory over HTTP on a free local port"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def prepare_workspace(tmp_path, base_url):
+    """Create a privatisationplans directory with one registry file pointing at the local server"""
+    priv_dir = tmp_path / 'privatisationplans'
+    priv_dir.mkdir()
+    registry = {'listObjects': [
+        {'hostingOrg': '2500002862', 'bidderOrgCode': '2500002862', 'documentType': 'privatizationPlan',
+         'regNum': '20250114250000286202', 'publishDate': '2025-12-19T00:19:59.318Z',
+         'href': f'{base_url}/{SAMPLE_PLAN}'},
+        {'hostingOrg': '2200000513', 'bidderOrgCode': '2200000513', 'documentType': 'privatizationDecision',
+         'regNum': '041422000005130003020003', 'publishDate': '2025-12-01T02:23:54.836Z',
+         'href': f'{base_url}/{SAMPLE_DECISION}'},
+        {'hostingOrg': '2200000513', 'bidderOrgCode': '2200000513', 'documentType': 'privatizationPlan',
+         'regNum': 'missing', 'publishDate': '2025-12-01T02:23:54.836Z',
+         'href': f'{base_url}/missing.json'}
+    ]}
+    with open(priv_dir / 'data-20251201T0000-20251202T0000-structure-20230401.json', 'w', encoding='utf-8') as f:
+        json.dump(registry, f)
+
+
+def test_privatisation_plans_pipeline(tmp_path, monkeypatch):
+    """Registry entries are loaded and documents fetched, mapped and written in batches"""
+    server = start_server(SAMPLE_DIR)
+    try:
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('TORGIDB', 'SQLITE')
+        rawstore.promoted_paths.cache_clear()
+        rawstore.promoted_extractor.cache_clear()
+        prepare_workspace(tmp_path, f'http://127.0.0.1:{server.server_address[1]}')
+
+        main.create_database()
+        assert main.load_privatisation_data(batch_size=2) == 3
+
+        processed, failed = main.process_all_documents(workers=2, batch_size=1)
+        assert (processed, failed) == (2, 1)
+
+        with open(os.path.join(SAMPLE_DIR, SAMPLE_PLAN), encoding='utf-8') as f:
+            plan = json.load(f)['exportObject']['structuredObject']['privatizationPlan']
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT l.plan_number, l.org_inn, o.inn FROM privatisationplanlist l "
+                       "JOIN organizations o ON o.code = l.org_code")
+        assert cursor.fetchall() == [(plan['commonInfo']['planNumber'], None, plan['hostingOrg']['INN'])]
+        cursor.execute("SELECT COUNT(*) FROM privatizationobjects")
+        assert cursor.fetchone()[0] == len(plan['privatizationObjects'])
+        # Every fetched document is kept in the raw store, mapped or not
+        cursor.execute("SELECT regnum, documenttype FROM rawdocuments ORDER BY regnum")
+        assert cursor.fetchall() == [('041422000005130003020003', 'privatizationDecision'),
+                                     ('20250114250000286202', 'privatizationPlan')]
+        # Aggregates are maintained per batch and agree with a rebuild from the fact tables
+        cursor.execute("SELECT * FROM agg_plan_revenue")
+        revenue = cursor.fetchall()
+        assert revenue == [(plan['hostingOrg']['code'], 2026, 1, 500000.0, 0.0, 0.0)]
+        cursor.execute("SELECT * FROM agg_plan_objects ORDER BY subject_rf_code, purpose_code")
+        objects = cursor.fetchall()
+        assert sum(row[-1] for row in objects) == len(plan['privatizationObjects'])
+        conn.close()
+
+        # Objects are searchable by any grammatical form of the words of their name and address
+        results = search.search('нежилых помещений на Центральной', kind='object')
+        assert [(r['regnum'], r['title']) for r in results] == [('20250114250000286202', 'Нежилое помещение')]
+        assert search.search('Булава') and not search.search('Хабаровск Москва')
+
+        # Decisions are mapped and their cadastral numbers linked with those of plan objects
+        cursor = get_db_connection().cursor()
+        cursor.execute("SELECT decision_number, plan_number FROM privatizationdecisions")
+        assert cursor.fetchall() == [('041422000005130003020003', '20240314220000051304')]
+        cursor.connection.close()
+        kad_number = plan['privatizationObjects'][0]['kadNumber']
+        assert [row[1:3] for row in cadastral.parcel_history(kad_number.replace(':', ' : '))] == \
+            [('privatizationPlan', '20250114250000286202')]
+        assert [row[1] for row in cadastral.parcel_history('42:24:301013:3313')] == ['privatizationDecision']
+        assert cadastral.rebuild_index() == 3
+
+        aggregates.rebuild_aggregates()
+        assert aggregates.query_revenue() == revenue
+        assert sorted(aggregates.query_objects(['region', 'org', 'year', 'purpose'])) == \
+            sorted(row for row in objects)
+    finally:
+        server.shutdown()
+
+
+def test_generic_adapter_maps_any_document():
+    """Datasets without dedicated mappers keep the whole document in their document table"""
+    with open(os.path.join(SAMPLE_DIR, SAMPLE_DECISION), encoding='utf-8') as f:
+        document = json.load(f)
+
+    rows = datasets.map_document(datasets.get_adapter('7710568760-notice'), '041422000005130003020003', document)
+
+    assert list(rows) == ['notice_documents']
+    row = dict(zip(datasets.get_adapter('notice').columns('notice_documents'), rows['notice_documents'][0]))
+    assert row['documenttype'] == 'privatizationDecision'
+    assert row['hosting_org_code'] == '2200000513'
+    assert json.loads(row['content'])['startPrice'] == '34667592.00'
+
+    # Organisations published as null map to empty codes instead of failing the document
+    document.update({'hostingOrg': None, 'bidderOrg': None, 'commonInfo': None})
+    row = dict(zip(datasets.get_adapter('notice').columns('notice_documents'),
+                   datasets.map_generic_document('041422000005130003020003', 'privatizationDecision', document)[0]))
+    assert (row['hosting_org_code'], row['bidder_org_code'], row['publish_date']) == (None, None, None)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Test script for the database helpers: connection modes and schema upgrades
+"""
+
+import sqlite3
+
+import pytest
+
+from db_utils import add_missing_columns, get_db_connection, optimize_database, read_watermark, upsert_rows
+
+
+def test_sqlite_ingest_and_read_modes(tmp_path, monkeypatch):
+    """Ingest connections use WAL, read connections cannot write, loads refresh statistics"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+
+    conn = get_db_connection('ingest')
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    conn.execute("CREATE TABLE items (code TEXT PRIMARY KEY, name TEXT)")
+    conn.execute("CREATE INDEX ix_items_name ON items (name)")
+    upsert_rows(conn, 'items', ['code', 'name'], [(str(i), f'item {i % 10}') for i in range(100)])
+    conn.commit()
+    optimize_database(conn)
+    conn.close()
+
+    conn = get_db_connection('read')
+    assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 100
+    assert read_watermark(conn) == 1
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'items'").fetchone()[0] > 0
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM items")
+    conn.close()
+
+
+def test_add_missing_columns_upgrades_old_tables(tmp_path, monkeypatch):
+    """Columns declared later are added to tables created by older scripts"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE plans (globalid TEXT PRIMARY KEY, regnum TEXT)")
+    definitions = ['globalid TEXT PRIMARY KEY', 'regnum TEXT', 'version INTEGER']
+    assert add_missing_columns(cursor, 'plans', definitions) == ['version']
+    assert add_missing_columns(cursor, 'plans', definitions) == []
+    conn.close()
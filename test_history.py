@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script for the versioned plan history, as-of lookups and version diffs
+"""
+
+import copy
+import json
+import os
+
+import history
+import plandiff
+from datasets import get_adapter
+from db_utils import get_db_connection
+from main import map_privatization_plan
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'privatisationplans',
+                           'privatizationPlan_20250114250000286202_77abf88a-e2f2-4924-b565-b0fbf7788d1d.json')
+
+
+def plan_version(plan, version, publish_date, statuses):
+    """Return a copy of the sample plan as another version with its own publish date and objects"""
+    document = copy.deepcopy(plan)
+    document['version'] = version
+    document['commonInfo']['publishDate'] = publish_date
+    template = document['privatizationObjects'][0]
+    document['privatizationObjects'] = [dict(template, objectNumber=str(number), statusObject=status)
+                                        for number, status in enumerate(statuses)]
+    return document
+
+
+def ingest(adapter, document):
+    conn = get_db_connection()
+    history.apply_batch(conn, adapter, map_privatization_plan('R1', 'privatizationPlan', document))
+    conn.commit()
+    conn.close()
+
+
+def test_versions_get_validity_intervals_in_any_order(tmp_path, monkeypatch):
+    """Each version is valid until the next one is published, even if versions arrive out of order"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    with open(SAMPLE_PLAN, encoding='utf-8') as f:
+        plan = json.load(f)['exportObject']['structuredObject']['privatizationPlan']
+    adapter = get_adapter('privatizationPlans')
+
+    conn = get_db_connection()
+    history.create_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+    ingest(adapter, plan_version(plan, 1, '2025-01-10T00:00:00Z', ['INCLUDED_TO_PLAN']))
+    ingest(adapter, plan_version(plan, 3, '2025-06-01T00:00:00Z', ['SOLD', 'INCLUDED_TO_PLAN', 'INCLUDED_TO_PLAN']))
+    # Published in Moscow time: the interval starts at the same UTC moment as '2025-03-01T00:00:00Z'
+    ingest(adapter, plan_version(plan, 2, '2025-03-01T03:00:00+03:00', ['INCLUDED_TO_PLAN', 'INCLUDED_TO_PLAN']))
+    # Reprocessing a version does not duplicate it
+    ingest(adapter, plan_version(plan, 2, '2025-03-01T03:00:00+03:00', ['INCLUDED_TO_PLAN', 'INCLUDED_TO_PLAN']))
+
+    assert history.plan_versions('R1') == [
+        (1, '2025-01-10T00:00:00.000', '2025-03-01T00:00:00.000'),
+        (2, '2025-03-01T00:00:00.000', '2025-06-01T00:00:00.000'),
+        (3, '2025-06-01T00:00:00.000', None)
+    ]
+    assert history.plan_as_of('R1', '2025-01-01') is None
+    assert history.plan_as_of('R1', '2025-02-15')['version'] == 1
+    assert history.plan_as_of('R1', '2025-03-01T00:00:00Z')['version'] == 2
+    assert history.plan_as_of('R1', '2025-03-01T02:59:00+03:00')['version'] == 1
+    assert history.plan_as_of('R1', '2026-01-01')['version'] == 3
+    assert [item['status_object'] for item in history.objects_of_version('R1', 3)] == \
+        ['SOLD', 'INCLUDED_TO_PLAN', 'INCLUDED_TO_PLAN']
+    assert len(history.objects_of_version('R1', 2)) == 2
+
+
+def test_plan_diff_logs_object_changes(tmp_path, monkeypatch):
+    """Each version logs objects added, removed or changed since the previous version"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    with open(SAMPLE_PLAN, encoding='utf-8') as f:
+        plan = json.load(f)['exportObject']['structuredObject']['privatizationPlan']
+    adapter = get_adapter('privatizationPlans')
+
+    conn = get_db_connection()
+    history.create_tables(conn.cursor())
+    plandiff.create_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+    def ingest_with_diff(document):
+        conn = get_db_connection()
+        rows = map_privatization_plan('R1', 'privatizationPlan', document)
+        history.apply_batch(conn, adapter, rows)
+        plandiff.apply_batch(conn, adapter, rows)
+        conn.commit()
+        conn.close()
+
+    ingest_with_diff(plan_version(plan, 1, '2025-01-10T00:00:00Z', ['INCLUDED_TO_PLAN', 'INCLUDED_TO_PLAN']))
+    ingest_with_diff(plan_version(plan, 3, '2025-06-01T00:00:00Z', ['SOLD']))
+    # Version 2 arrives late: version 3 is then compared with version 2 instead of version 1
+    ingest_with_diff(plan_version(plan, 2, '2025-03-01T00:00:00Z', ['INCLUDED_TO_PLAN', 'INCLUDED_TO_PLAN', 'SOLD']))
+
+    changes = [(c['previous_version'], c['version'], c['object_number'], c['change_type'], c['changed_fields'])
+               for c in plandiff.plan_changes('R1')]
+    assert changes == [
+        (1, 2, '2', 'added', None),
+        (2, 3, '0', 'changed', 'status_object'),
+        (2, 3, '1', 'removed', None),
+        (2, 3, '2', 'removed', None)
+    ]
+    assert json.loads(plandiff.plan_changes('R1', 3)[0]['new_values']) == {'status_object': 'SOLD'}
+    assert plandiff.rebuild_changes() == 4
+
+
+def test_objects_keep_their_key_across_versions(tmp_path, monkeypatch):
+    """Objects without a number are matched between versions by content; repeated numbers keep every object"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    with open(SAMPLE_PLAN, encoding='utf-8') as f:
+        plan = json.load(f)['exportObject']['structuredObject']['privatizationPlan']
+    adapter = get_adapter('privatizationPlans')
+
+    conn = get_db_connection()
+    history.create_tables(conn.cursor())
+    plandiff.create_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+    def unnumbered(version, names):
+        document = plan_version(plan, version, f'2025-0{version}-01T00:00:00Z', ['INCLUDED_TO_PLAN'] * len(names))
+        for item, name in zip(document['privatizationObjects'], names):
+            del item['objectNumber']
+            item['name'] = name
+        return document
+
+    for document in (unnumbered(1, ['A', 'B']), unnumbered(2, ['C', 'A', 'B'])):
+        conn = get_db_connection()
+        rows = map_privatization_plan('R1', 'privatizationPlan', document)
+        history.apply_batch(conn, adapter, rows)
+        plandiff.apply_batch(conn, adapter, rows)
+        conn.commit()
+        conn.close()
+    # Only the new object is added; the unchanged ones are not reported as removed and added again
+    changes = plandiff.plan_changes('R1')
+    assert [(c['version'], c['change_type']) for c in changes] == [(2, 'added')]
+    assert json.loads(changes[0]['new_values'])['name'] == 'C'
+
+    # Two different objects published under one number are both kept
+    document = plan_version(plan, 3, '2025-03-01T00:00:00Z', ['INCLUDED_TO_PLAN', 'SOLD', 'INCLUDED_TO_PLAN'])
+    for item in document['privatizationObjects']:
+        item['objectNumber'] = '7'
+    ingest(adapter, document)
+    objects = history.objects_of_version('R1', 3)
+    assert sorted(item['status_object'] for item in objects) == ['INCLUDED_TO_PLAN', 'INCLUDED_TO_PLAN', 'SOLD']
+    assert objects[0]['object_number'] == '7' and all(item['object_number'].startswith('7#') for item in objects[1:])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test script for the structure-version aware compiled mappings
+"""
+
+import copy
+import json
+import os
+
+import mappings
+from normalize import to_month
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_PLAN = os.path.join(BASE_DIR, 'privatisationplans',
+                           'privatizationPlan_20250114250000286202_77abf88a-e2f2-4924-b565-b0fbf7788d1d.json')
+
+
+def load_plan():
+    with open(SAMPLE_PLAN, encoding='utf-8') as f:
+        return json.load(f)['exportObject']['structuredObject']['privatizationPlan']
+
+
+def test_registry_extractor_follows_structure_version(monkeypatch):
+    """Registry entries are read with the properties declared by their structure file"""
+    monkeypatch.chdir(BASE_DIR)
+    mappings.load_structure.cache_clear()
+    mappings.registry_extractor.cache_clear()
+    entry = {'regNum': '1', 'hostingOrg': '2300005436', 'bidderOrgCode': '2300005436',
+             'documentType': 'planReport', 'publishDate': '2026-01-01T09:33:59.204Z', 'href': 'http://x'}
+
+    assert mappings.structure_version('data-20260101T0000-20260102T0000-structure-20230401.json') == '20230401'
+    assert mappings.registry_extractor('20230401')(entry) == (
+        '1', '2300005436', '2300005436', 'planReport', '2026-01-01T09:33:59.204Z', 'http://x')
+    # Files without a known structure fall back to reading every known property
+    assert mappings.registry_extractor(None)({'code': '2', 'href': 'http://y'}) == (
+        '2', None, None, None, None, 'http://y')
+
+
+def test_document_extractor_dispatches_on_scheme_version():
+    """Budget fields are read from the plan since 4.3 and from the forecast in older schemes"""
+    plan = load_plan()
+    ids = iter(range(1000))
+
+    def new_id():
+        return str(next(ids))
+
+    rows = mappings.document_extractor('privatizationPlan', plan['schemeVersion'])(plan, 'R1', 'NOW', new_id)
+    plan_row = rows['privatisationplanlist'][0]
+    assert plan_row[:5] == ('0', 'NOW', 'NOW', 'R1', plan['commonInfo']['planNumber'])
+    assert plan_row[15:18] == (plan['budget']['code'], plan['budget']['name'], plan['authority'])
+    assert len(rows['privatizationobjects']) == len(plan['privatizationObjects'])
+    publish_month = to_month(plan['commonInfo']['publishDate'], plan['commonInfo']['timeZone']['name'])
+    assert rows['privatizationobjects'][0][14:] == (plan['privatizationObjects'][0]['kadNumber'], plan['version'],
+                                                    publish_month)
+    assert plan_row[-1] == publish_month
+
+    legacy = copy.deepcopy(plan)
+    legacy['schemeVersion'] = '4.2'
+    legacy['budgetRevenueForecast']['budget'] = {'code': 'OLD', 'name': 'Old budget'}
+    legacy_rows = mappings.document_extractor('privatizationPlan', '4.2')(legacy, 'R1', 'NOW', new_id)
+    assert legacy_rows['privatisationplanlist'][0][15:17] == ('OLD', 'Old budget')
+
+    assert mappings.document_extractor('privatizationPlan', '4.3') is \
+        mappings.document_extractor('privatizationPlan', '4.3')
+    assert mappings.document_extractor('unknownDocument', '4.3') is None
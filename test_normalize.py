@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test script for the typed date and money shadow columns
+"""
+
+import json
+import os
+
+import datasets
+import normalize
+from db_utils import get_db_connection
+from main import map_privatization_plan
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'privatisationplans',
+                           'privatizationPlan_20250114250000286202_77abf88a-e2f2-4924-b565-b0fbf7788d1d.json')
+
+
+def test_converters():
+    assert normalize.to_utc('2025-12-19T00:19:59.318Z') == '2025-12-19T00:19:59.318'
+    assert normalize.to_utc('2025-12-19T10:00:00+03:00') == '2025-12-19T07:00:00.000'
+    # Without an offset the time is local to the document's time zone
+    assert normalize.to_utc('2025-12-19T10:00:00', 'MSK+07:00 (UTC+10:00)') == '2025-12-19T00:00:00.000'
+    assert normalize.to_utc('not a date') is None
+    assert normalize.to_day('2025-12-19') == '2025-12-19'
+    assert normalize.to_day('19.12.2025') is None
+    assert normalize.to_amount('1 234,5') == '1234.50'
+    assert normalize.to_amount('34667592.00') == '34667592.00'
+    assert normalize.to_amount('n/a') is None
+    assert normalize.to_amount('1e20') is None
+
+
+def test_ingest_fills_typed_columns_and_backfill_repairs_old_rows(tmp_path, monkeypatch):
+    """Mapped plans carry typed values, older rows get them from the backfill, range queries use the index"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    with open(SAMPLE_PLAN, encoding='utf-8') as f:
+        plan = json.load(f)['exportObject']['structuredObject']['privatizationPlan']
+    adapter = datasets.get_adapter('privatizationPlans')
+    columns = adapter.columns('privatisationplanlist')
+    datasets.create_tables(adapter)
+
+    row = dict(zip(columns, map_privatization_plan('R1', 'privatizationPlan', plan)['privatisationplanlist'][0]))
+    assert row['time_zone'] == 'MSK+07:00 (UTC+10:00)'
+    assert row['publish_date_utc'] == '2025-12-19T00:19:59.318'
+    assert row['signing_day'] == '2025-12-19'
+    assert row['sum_first_year_amount'] == '500000.00'
+
+    conn = get_db_connection()
+    datasets.write_batch(conn, adapter, {'privatisationplanlist': [tuple(row.values())]})
+    # A row loaded before the typed columns existed
+    conn.execute("INSERT INTO privatisationplanlist (globalid, createdate, regnum, publish_date, sum_first_year) "
+                 "VALUES ('old', '2024-01-01T12:00:00', 'R0', '2025-12-20T10:00:00Z', '250000')")
+    conn.commit()
+    conn.close()
+
+    assert normalize.backfill(['privatisationplanlist']) == 2
+    assert normalize.published_plans('2025-12-01', '2026-01-01') == (2, 750000)
+    assert normalize.published_plans('2025-12-20', '2026-01-01') == (1, 250000)
+
+    conn = get_db_connection()
+    plan_steps = conn.execute("EXPLAIN QUERY PLAN SELECT COUNT(*) FROM privatisationplanlist "
+                              "WHERE publish_date_utc >= ? AND publish_date_utc < ?", ('a', 'b')).fetchall()
+    conn.close()
+    assert 'ix_privatisationplanlist_publish_date_utc' in ' '.join(str(step) for step in plan_steps)
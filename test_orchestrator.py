@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test script for the stage DAG orchestrator
+"""
+
+import threading
+import time
+from argparse import Namespace
+from datetime import datetime
+
+import orchestrator
+from orchestrator import DATABASE, DONE, FAILED, SKIPPED, Stage, run_pipeline
+
+
+def test_independent_stages_overlap_and_shared_resources_do_not(tmp_path):
+    """Stages without a dependency run at the same time, stages using the database one by one"""
+    both_started = threading.Barrier(2, timeout=5)
+    active = []
+    overlaps = []
+
+    def meeting(inputs, options):
+        both_started.wait()
+        return 'met'
+
+    def writer(inputs, options):
+        active.append(1)
+        overlaps.append(len(active))
+        time.sleep(0.05)
+        active.pop()
+        return inputs
+
+    stages = [
+        Stage('plans', meeting),
+        Stage('nsi', meeting),
+        Stage('load_plans', writer, depends=['plans'], resources=[DATABASE]),
+        Stage('load_nsi', writer, depends=['nsi'], resources=[DATABASE])
+    ]
+    status = run_pipeline(stages, Namespace(), state_path=str(tmp_path / 'state.json'))
+    assert set(status.values()) == {DONE}
+    assert max(overlaps) == 1
+
+
+def test_failure_skips_dependents_and_resume_reuses_outputs(tmp_path):
+    """Dependents of a failed stage are skipped; a resumed run starts from the failed stage"""
+    state_path = str(tmp_path / 'state.json')
+    calls = []
+    broken = {'value': True}
+
+    def select(inputs, options):
+        calls.append('select')
+        return ['data-1.json', 'data-2.json']
+
+    def upload(inputs, options):
+        calls.append('upload')
+        if broken['value']:
+            raise RuntimeError('database is locked')
+        return len(inputs['select'])
+
+    def export(inputs, options):
+        calls.append('export')
+        return inputs['upload']
+
+    stages = [Stage('select', select), Stage('upload', upload, depends=['select']),
+              Stage('export', export, depends=['upload'])]
+    assert run_pipeline(stages, Namespace(), state_path=state_path) == \
+        {'select': DONE, 'upload': FAILED, 'export': SKIPPED}
+
+    broken['value'] = False
+    calls.clear()
+    assert run_pipeline(stages, Namespace(), state_path=state_path, resume=True) == \
+        {'select': DONE, 'upload': DONE, 'export': DONE}
+    assert calls == ['upload', 'export']
+    assert orchestrator.load_state(state_path)['stages']['export']['output'] == 2
+
+
+def test_select_registry_files_by_period():
+    files = ['loaded/data-20250101T0000-20250201T0000-structure-20230401.json',
+             'loaded/data-20250201T0000-20250301T0000-structure-20230401.json',
+             'loaded/structure-20230401.json']
+    assert orchestrator.select_registry_files(files) == files[1:2]
+    assert orchestrator.select_registry_files(files, 40, today=datetime(2025, 3, 5)) == files[:2]
+    assert orchestrator.select_registry_files(files, 10, today=datetime(2025, 3, 5)) == files[1:2]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Test script for the monthly partitions: publish_month at ingest and the reload of one month
+"""
+
+import copy
+import json
+import os
+
+import pytest
+
+import partitions
+from datasets import get_adapter, map_document, write_batch
+from db_utils import get_db_connection
+from main import create_database
+from rawstore import compress
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'privatisationplans',
+                           'privatizationPlan_20250114250000286202_77abf88a-e2f2-4924-b565-b0fbf7788d1d.json')
+
+
+def plan_document(publish_date, objects):
+    """Return the sample plan document published at another date with a number of objects"""
+    with open(SAMPLE_PLAN, encoding='utf-8') as f:
+        document = json.load(f)
+    plan = document['exportObject']['structuredObject']['privatizationPlan']
+    plan['commonInfo']['publishDate'] = publish_date
+    plan['privatizationObjects'] = [dict(copy.deepcopy(plan['privatizationObjects'][0]), objectNumber=str(number))
+                                    for number in range(objects)]
+    return document
+
+
+def ingest(adapter, reg_num, document):
+    conn = get_db_connection()
+    raw = compress(json.dumps(document).encode('utf-8'))
+    write_batch(conn, adapter, map_document(adapter, reg_num, document, source=f'http://portal/{reg_num}', raw=raw))
+    conn.close()
+
+
+def query(sql, params=()):
+    conn = get_db_connection()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return rows
+
+
+def test_reload_replaces_one_month_and_its_derived_rows(tmp_path, monkeypatch):
+    """A reloaded month holds each stored document once, other months and the derived tables stay consistent"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    create_database()
+    adapter = get_adapter('privatizationPlans')
+
+    ingest(adapter, 'R1', plan_document('2025-01-15T10:00:00+03:00', 2))
+    # Published on February 1st Moscow time, which is still January in UTC
+    ingest(adapter, 'R2', plan_document('2025-02-01T01:00:00+03:00', 1))
+    ingest(adapter, 'R3', plan_document('2025-02-10T10:00:00+03:00', 3))
+    # Processing R1 again duplicates its rows, as an interrupted load can
+    ingest(adapter, 'R1', plan_document('2025-01-15T10:00:00+03:00', 2))
+
+    assert partitions.month_counts() == {'2025-01': 3, '2025-02': 1}
+    assert partitions.month_counts('privatizationobjects') == {'2025-01': 5, '2025-02': 3}
+    february = query("SELECT globalid FROM privatisationplanlist WHERE publish_month = '2025-02'")
+    # The counters count the duplicated version once
+    assert query("SELECT SUM(plans) FROM agg_plan_revenue") == [(3,)]
+    assert query("SELECT SUM(objects) FROM agg_plan_objects") == [(6,)]
+
+    assert partitions.reload_month('2025-01') == 2
+
+    assert partitions.month_counts() == {'2025-01': 2, '2025-02': 1}
+    assert partitions.month_counts('privatizationobjects') == {'2025-01': 3, '2025-02': 3}
+    assert query("SELECT regnum FROM privatisationplanlist WHERE publish_month = '2025-01' ORDER BY regnum") == \
+        [('R1',), ('R2',)]
+    assert query("SELECT globalid FROM privatisationplanlist WHERE publish_month = '2025-02'") == february
+    # The removed rows were taken back from the counters once and the new ones added
+    assert query("SELECT SUM(plans) FROM agg_plan_revenue") == [(3,)]
+    assert query("SELECT SUM(objects) FROM agg_plan_objects") == [(6,)]
+    assert query("SELECT COUNT(*) FROM search_index") == [(9,)]
+    assert query("SELECT COUNT(*) FROM search_index WHERE globalid NOT IN "
+                 "(SELECT globalid FROM privatisationplanlist UNION SELECT globalid FROM privatizationobjects)") == [(0,)]
+
+    # Reloading is repeatable and a month without documents is emptied
+    assert partitions.reload_month('2025-01') == 2
+    assert partitions.month_counts() == {'2025-01': 2, '2025-02': 1}
+    assert partitions.reload_month('2024-12') == 0
+
+    plan_steps = query("EXPLAIN QUERY PLAN SELECT COUNT(*) FROM privatizationobjects WHERE publish_month = ?",
+                       ('2025-01',))
+    assert 'ix_privatizationobjects_publish_month' in ' '.join(str(step) for step in plan_steps)
+
+
+def test_reload_removes_rows_loaded_before_publish_month(tmp_path, monkeypatch):
+    """Rows of a reloaded document without publish_month are replaced, not left next to the reloaded ones"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    create_database()
+    adapter = get_adapter('privatizationPlans')
+    ingest(adapter, 'R1', plan_document('2025-01-15T10:00:00+03:00', 2))
+    conn = get_db_connection()
+    for table_name in partitions.PARTITIONED_TABLES:
+        conn.execute(f"UPDATE {table_name} SET publish_month = NULL")
+    conn.commit()
+    conn.close()
+
+    assert partitions.reload_month('2025-01') == 1
+    assert query("SELECT regnum, publish_month FROM privatisationplanlist") == [('R1', '2025-01')]
+    assert query("SELECT COUNT(*), MIN(publish_month) FROM privatizationobjects") == [(2, '2025-01')]
+    assert query("SELECT SUM(plans) FROM agg_plan_revenue") == [(1,)]
+    assert query("SELECT SUM(objects) FROM agg_plan_objects") == [(2,)]
+
+
+def test_statements_follow_the_connection(tmp_path, monkeypatch):
+    """A SQLite connection gets SQLite statements even when SQL Server is the configured database"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    create_database()
+    adapter = get_adapter('privatizationPlans')
+    nothing = {table_name: [] for table_name in partitions.PARTITIONED_TABLES}
+
+    monkeypatch.setenv('TORGIDB', 'SQLSERVER')
+    conn = get_db_connection(db_type='SQLITE')
+    partitions.insert_rows(conn, 'privatisationplanlist', ['globalid', 'regnum'], [('G1', 'R1')])
+    assert partitions.month_rows(conn, adapter, '2025-01', nothing) == nothing
+    conn.close()
+
+
+class RecordingCursor:
+    """Records the statements of the SQL Server partition switch; every query returns partition 5"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((' '.join(sql.split()), tuple(params)))
+
+    def fetchone(self):
+        return (5,)
+
+
+def test_sqlserver_switch_statements():
+    cursor = RecordingCursor()
+    partitions.switch_sqlserver(cursor, '2025-01')
+    assert cursor.statements == [('SELECT $PARTITION.pf_publish_month(?)', ('2025-01',))] + [
+        statement
+        for table_name in partitions.PARTITIONED_TABLES
+        for statement in ((f'ALTER TABLE {table_name} SWITCH PARTITION 5 TO {table_name}_trash PARTITION 5', ()),
+                          (f'ALTER TABLE {table_name}_staging SWITCH PARTITION 5 TO {table_name} PARTITION 5', ()))
+    ]
+    # Indexes of the staging and trash clones are aligned on the partition scheme, as SWITCH requires
+    assert partitions.index_sql(('cx_privatizationobjects', True, True, ['globalid', 'publish_month']),
+                                'privatizationobjects_staging') == \
+        ('CREATE UNIQUE CLUSTERED INDEX cx_privatizationobjects ON privatizationobjects_staging '
+         '(globalid, publish_month) ON ps_publish_month(publish_month)')
+
+
+def test_months():
+    assert partitions.next_month('2025-12') == '2026-01'
+    assert partitions.raw_date_range('2025-03') == ('2025-02-28', '2025-04-02')
+    for month in ('2025-13', '2025-1', "2025-01'; DROP TABLE x"):
+        with pytest.raises(ValueError):
+            partitions.check_month(month)
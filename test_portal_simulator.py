@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for the downloaders against the local portal simulator: throughput, retries and no data loss under faults
+"""
+
+import json
+import os
+import random
+import time
+
+import pytest
+
+import datasets
+import download_missing_nsi
+import main
+import metadownload
+import rawstore
+from db_utils import get_db_connection
+from portal_simulator import PortalSimulator, parse_latency
+from test_datasets import SAMPLE_DECISION, SAMPLE_PLAN
+
+OPENDATA = 'https://torgi.gov.ru/new/opendata/7710568760-privatizationPlans'
+NSI_REGISTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'masterdata',
+                            'data-20220101T0000-20251222T0000-structure-20250101.json')
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    rawstore.promoted_paths.cache_clear()
+    rawstore.promoted_extractor.cache_clear()
+    main.create_database()
+    return tmp_path
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Retry at once, so exact retry counts do not take the production backoff"""
+    monkeypatch.setattr(datasets, 'RETRY_BACKOFF', 0)
+    monkeypatch.setattr(datasets, 'FETCH_RETRY_DELAY', 0)
+
+
+def document_records(simulator, copies):
+    """Registry records of copies of the sample plan and decision, each under its own number and URL"""
+    records = []
+    for number in range(copies):
+        for name, document_type in ((SAMPLE_PLAN, 'privatizationPlan'), (SAMPLE_DECISION, 'privatizationDecision')):
+            records.append((f'R{number:03d}-{document_type}', document_type,
+                            simulator.local_url(f'{OPENDATA}/docs/{name}?copy={number}')))
+    return records
+
+
+def loaded_regnums():
+    conn = get_db_connection()
+    rows = conn.execute("SELECT regnum FROM privatisationplanlist UNION ALL "
+                        "SELECT regnum FROM privatizationdecisions").fetchall()
+    conn.close()
+    return sorted(regnum for regnum, in rows)
+
+
+def test_documents_are_loaded_under_faults(workspace, no_backoff):
+    """Slow responses, 429/5xx and cut-off bodies are retried concurrently; only unavailable documents fail"""
+    adapter = datasets.get_adapter('privatizationPlans')
+    with PortalSimulator(latency='lognormal:0.1:0.5', error_rates={429: 0.08, 500: 0.04, 503: 0.04},
+                         truncate_rate=0.08, seed=7) as simulator:
+        records = document_records(simulator, 20)
+        missing = [(f'M{number}', 'privatizationPlan', simulator.local_url(f'{OPENDATA}/docs/missing{number}.json'))
+                   for number in range(2)]
+        failures = []
+        started = time.perf_counter()
+        processed, failed = datasets.process_documents(adapter, records=records + missing, workers=8, batch_size=5,
+                                                       failures=failures)
+        elapsed = time.perf_counter() - started
+
+    # Every fault kind was injected, and still no document was lost or stored damaged
+    assert all(simulator.outcomes[outcome] > 0 for outcome in ('429', '500', '503', 'truncated'))
+    assert (processed, failed) == (len(records), len(missing))
+    assert sorted(href for href, _ in failures) == sorted(href for _, _, href in missing)
+    assert all('не существует или недоступен' in error for _, error in failures)
+    assert loaded_regnums() == sorted(reg_num for reg_num, _, _ in records)
+    # Downloads overlap: with 8 workers the run takes a fraction of the latency served one by one
+    assert elapsed < simulator.delay / 2
+
+
+@pytest.mark.parametrize('fault', [429, 503, 'truncated'])
+def test_failed_attempts_are_retried(workspace, no_backoff, fault):
+    """Each document failing its first two requests is fetched exactly three times and loaded once"""
+    adapter = datasets.get_adapter('privatizationPlans')
+    with PortalSimulator(fail_first=2, fail_with=fault) as simulator:
+        processed, failed = datasets.process_documents(adapter, records=document_records(simulator, 1), workers=2)
+    assert (processed, failed) == (2, 0)
+    assert simulator.requests == {SAMPLE_PLAN: 3, SAMPLE_DECISION: 3}
+
+    with PortalSimulator(fail_first=2, fail_with=fault) as simulator:
+        assert main.download_and_process_document(simulator.local_url(f'{OPENDATA}/{SAMPLE_PLAN}'), 'S1') > 0
+    assert simulator.requests == {SAMPLE_PLAN: 3}
+    assert loaded_regnums() == ['R000-privatizationDecision', 'R000-privatizationPlan', 'S1']
+
+
+def test_retries_are_bounded(workspace, no_backoff):
+    """A portal that keeps failing gets a bounded number of requests and the document is reported failed"""
+    adapter = datasets.get_adapter('privatizationPlans')
+    failures = []
+    with PortalSimulator(error_rates={503: 1.0}) as simulator:
+        records = document_records(simulator, 1)[:1]
+        assert datasets.process_documents(adapter, records=records, failures=failures) == (0, 1)
+
+    assert simulator.requests[SAMPLE_PLAN] == datasets.RETRY_TOTAL + 1
+    assert [href for href, _ in failures] == [records[0][2]]
+    assert loaded_regnums() == []
+
+
+def test_files_are_saved_whole_or_not_at_all(workspace, no_backoff):
+    """Registry, structure and NSI files are saved byte for byte; error payloads and failures leave no file"""
+    with PortalSimulator(fail_first=1, fail_with='truncated', unavailable={'structure-20220601.json'}) as simulator:
+        meta = {'data': [{'source': simulator.local_url(f'{OPENDATA}/data-20220101T0000-20220201T0000-structure-20230401.json')}],
+                'structure': [{'source': simulator.local_url(f'{OPENDATA}/structure-20230401.json')},
+                              {'source': simulator.local_url(f'{OPENDATA}/structure-20220601.json')}]}
+        (workspace / 'meta.json').write_text(json.dumps(meta), encoding='utf-8')
+        metadownload.download_meta_files(str(workspace / 'meta.json'), str(workspace / 'loaded'))
+
+        with open(NSI_REGISTRY, encoding='utf-8') as f:
+            registry = json.load(f)
+        for entry in registry['listObjects']:
+            entry['href'] = simulator.local_url(entry['href'])
+        (workspace / 'nsi-registry.json').write_text(json.dumps(registry), encoding='utf-8')
+        download_missing_nsi.download_missing_nsi_files(str(workspace / 'nsi-registry.json'), delay=0)
+
+    assert sorted(os.listdir(workspace / 'loaded')) == \
+        ['data-20220101T0000-20220201T0000-structure-20230401.json', 'structure-20230401.json']
+    nsi_files = sorted(os.listdir(workspace / 'masterdata'))
+    assert nsi_files == sorted(name for name in simulator.files if os.path.basename(os.path.dirname(
+        simulator.files[name])) == 'masterdata' and any(entry['href'].endswith(name) for entry in registry['listObjects']))
+    for directory, names in (('loaded', os.listdir(workspace / 'loaded')), ('masterdata', nsi_files)):
+        for name in names:
+            with open(simulator.files[name], 'rb') as seed, open(workspace / directory / name, 'rb') as saved:
+                assert saved.read() == seed.read()
+
+
+def test_latency_distributions():
+    with pytest.raises(ValueError):
+        parse_latency('gamma:1')
+    draw = parse_latency('lognormal:0.1:0.5')
+    generator = random.Random(1)
+    delays = sorted(draw(generator) for _ in range(1001))
+    assert 0.08 < delays[500] < 0.12
+    assert parse_latency('fixed:0.25')(None) == 0.25
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Test script for the stage profiler: worker thread calls and the report of multithreaded stages
+"""
+
+import json
+import os
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import Profiler
+
+
+def parse_in_worker(n):
+    return sum(range(n))
+
+
+def test_worker_threads_are_profiled_and_reported(tmp_path):
+    """Calls made in worker threads are in the stage profile, which is marked as multithreaded"""
+    profiler = Profiler(str(tmp_path))
+    with profiler.stage('single'):
+        parse_in_worker(10)
+    with profiler.stage('processdocs'):
+        with ThreadPoolExecutor(3) as executor:
+            list(executor.map(parse_in_worker, [10000] * 6))
+    profiler.write_report()
+
+    stats = pstats.Stats(os.path.join(tmp_path, 'processdocs.prof')).stats
+    assert [calls for (_, _, function), (_, calls, *_) in stats.items() if function == 'parse_in_worker'] == [6]
+
+    with open(os.path.join(tmp_path, 'summary.json'), encoding='utf-8') as f:
+        single, processdocs = json.load(f)['stages']
+    assert 'note' not in single
+    assert processdocs['threads'] > 1 and 'overlap' in processdocs['note']
+    with open(os.path.join(tmp_path, 'processdocs.txt'), encoding='utf-8') as f:
+        assert f.readline().strip() == processdocs['note']
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test script for the compressed raw-document store and promoted JSON-path columns
+"""
+
+import json
+import os
+
+import pytest
+
+import rawstore
+from db_utils import get_db_connection, upsert_rows
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'privatisationplans',
+                           'privatizationPlan_20250114250000286202_77abf88a-e2f2-4924-b565-b0fbf7788d1d.json')
+
+
+def test_promoted_path_is_backfilled_from_stored_documents(tmp_path, monkeypatch):
+    """A path promoted after ingest is filled from the compressed documents without refetching"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    rawstore.promoted_paths.cache_clear()
+    rawstore.promoted_extractor.cache_clear()
+
+    with open(SAMPLE_PLAN, 'rb') as f:
+        content = f.read()
+    document = json.loads(content)
+    plan = document['exportObject']['structuredObject']['privatizationPlan']
+
+    conn = get_db_connection()
+    rawstore.create_raw_tables(conn.cursor())
+    conn.commit()
+    row = rawstore.raw_row('R1', 'http://x', document, rawstore.compress(content), 'NOW')
+    # The same version fetched twice is stored once
+    upsert_rows(conn, rawstore.RAW_TABLE, rawstore.columns(), [row, row], rawstore.RAW_KEY_COLUMNS)
+    conn.commit()
+    conn.close()
+
+    stored = dict(zip(rawstore.columns(), row))
+    assert stored['documenttype'] == 'privatizationPlan'
+    assert stored['hosting_org_code'] == plan['hostingOrg']['code']
+    assert stored['publish_date'] == plan['commonInfo']['publishDate']
+    assert len(stored['content']) < len(content)
+
+    assert rawstore.promote_path('plan_number', '$.commonInfo.planNumber') == 1
+    assert rawstore.columns()[-1] == 'plan_number'
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT regnum, plan_number FROM rawdocuments")
+    assert cursor.fetchall() == [('R1', plan['commonInfo']['planNumber'])]
+    conn.close()
+
+    assert rawstore.get_document('R1') == document
+
+
+def test_backfill_and_ingest_store_the_same_text(tmp_path, monkeypatch):
+    """Booleans and objects get the same text either way; a path through a list or string is NULL"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    rawstore.promoted_paths.cache_clear()
+    rawstore.promoted_extractor.cache_clear()
+
+    with open(SAMPLE_PLAN, 'rb') as f:
+        document = json.load(f)
+    plan = document['exportObject']['structuredObject']['privatizationPlan']
+    plan['commonInfo']['isTest'] = True
+    plan['commonInfo']['period'] = {'from': 2025, 'to': 2027}
+
+    conn = get_db_connection()
+    rawstore.create_raw_tables(conn.cursor())
+    conn.commit()
+
+    def store(reg_num):
+        content = json.dumps(document).encode('utf-8')
+        upsert_rows(conn, rawstore.RAW_TABLE, rawstore.columns(),
+                    [rawstore.raw_row(reg_num, 'http://x', document, rawstore.compress(content), 'NOW')],
+                    rawstore.RAW_KEY_COLUMNS)
+        conn.commit()
+
+    store('R1')
+    promoted = [('is_test', 'commonInfo.isTest'), ('period', 'commonInfo.period'),
+                ('object_name', 'privatizationObjects.name'), ('plan_number_part', 'commonInfo.planNumber.part')]
+    for name, path in promoted:
+        rawstore.promote_path(name, path)
+    store('R2')
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT regnum, {', '.join(name for name, _ in promoted)} FROM rawdocuments ORDER BY regnum")
+    backfilled, ingested = cursor.fetchall()
+    conn.close()
+    assert backfilled[1:] == ingested[1:] == ('True', json.dumps({'from': 2025, 'to': 2027}), None, None)
+
+
+def test_paths_are_read_again_once_the_store_exists(tmp_path, monkeypatch):
+    """Paths read before the tables are created do not stick; bad or taken column names change nothing"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    rawstore.promoted_paths.cache_clear()
+    rawstore.promoted_extractor.cache_clear()
+
+    assert rawstore.promoted_paths() == ()
+    conn = get_db_connection()
+    rawstore.create_raw_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+    assert rawstore.promoted_paths() == tuple(rawstore.DEFAULT_PATHS)
+
+    for name in ('publish_date', 'regnum', 'x; DROP TABLE rawdocuments', 'Plan'):
+        with pytest.raises(ValueError):
+            rawstore.promote_path(name, 'commonInfo.planNumber')
+    rawstore.promoted_paths.cache_clear()
+    assert rawstore.promoted_paths() == tuple(rawstore.DEFAULT_PATHS)
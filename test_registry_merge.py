@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the registry merge: overlapping snapshots and deltas give one newest entry per document
+"""
+
+import json
+
+import datasets
+import registry_merge
+from db_utils import get_db_connection
+
+
+def entry(reg_num, document_type, publish_date, href):
+    return {'hostingOrg': '2200003233', 'bidderOrgCode': '2200003233', 'documentType': document_type,
+            'regNum': reg_num, 'publishDate': publish_date, 'href': href}
+
+
+def write_registry(directory, filename, objects):
+    path = directory / filename
+    path.write_text(json.dumps({'listObjects': objects}), encoding='utf-8')
+    return str(path)
+
+
+def registry_files(directory):
+    """A cumulative snapshot followed by two daily deltas overlapping it"""
+    return [
+        write_registry(directory, 'data-20220101T0000-20250103T0000-structure-20230401.json', [
+            entry('P1', 'privatizationPlan', '2025-01-01T10:00:00Z', 'http://portal/P1-v1'),
+            entry('P1', 'privatizationPlan', '2025-01-02T10:00:00Z', 'http://portal/P1-v2'),
+            entry('P1', 'privatizationDecision', '2025-01-02T11:00:00Z', 'http://portal/P1-decision'),
+            entry('P2', 'privatizationPlan', '2025-01-02T12:00:00Z', 'http://portal/P2-v1')
+        ]),
+        write_registry(directory, 'data-20250102T0000-20250103T0000-structure-20230401.json', [
+            # The same entry as in the snapshot
+            entry('P2', 'privatizationPlan', '2025-01-02T12:00:00Z', 'http://portal/P2-v1'),
+            entry('P1', 'privatizationPlan', '2025-01-02T10:00:00Z', 'http://portal/P1-v2')
+        ]),
+        write_registry(directory, 'data-20250103T0000-20250104T0000-structure-20230401.json', [
+            entry('P1', 'privatizationPlan', '2025-01-03T09:00:00Z', 'http://portal/P1-v3'),
+            entry('P3', 'privatizationPlan', '2025-01-03T10:00:00Z', 'http://portal/P3-v1')
+        ])
+    ]
+
+
+def test_newest_entry_per_document_wins(tmp_path):
+    """Later versions replace earlier ones and repeated entries are kept once"""
+    index = registry_merge.merge_files(registry_files(tmp_path))
+    assert (index.seen, len(index), index.duplicates) == (8, 4, 4)
+    assert sorted(index.records()) == [
+        ('P1', 'privatizationDecision', 'http://portal/P1-decision'),
+        ('P1', 'privatizationPlan', 'http://portal/P1-v3'),
+        ('P2', 'privatizationPlan', 'http://portal/P2-v1'),
+        ('P3', 'privatizationPlan', 'http://portal/P3-v1')
+    ]
+
+    # Of equal publish dates the entry of the later input wins; an older date never does
+    index = registry_merge.RegistryIndex(['regnum', 'documenttype', 'publishdate', 'href'])
+    index.add(('P1', 'privatizationPlan', '2025-01-02', 'http://portal/a'), rank=0)
+    index.add(('P1', 'privatizationPlan', '2025-01-02', 'http://portal/b'), rank=1)
+    index.add(('P1', 'privatizationPlan', '2025-01-01', 'http://portal/c'), rank=2)
+    assert index.records() == [('P1', 'privatizationPlan', 'http://portal/b')]
+
+
+def test_records_are_compact():
+    """Entries are slot records and repeated strings are stored once"""
+    index = registry_merge.RegistryIndex()
+    for n in range(3):
+        # Strings built at run time are distinct objects until interned
+        index.add((f'P{n}', '22000032' + '33', None, ''.join(['privatization', 'Plan']), '2025-01-01', f'h{n}'))
+    records = list(index.entries.values())
+    assert not hasattr(records[0], '__dict__')
+    assert records[0].values[1] is records[2].values[1]
+    assert records[0].values[3] is records[1].values[3]
+
+
+def test_registry_load_and_document_selection_are_merged(tmp_path, monkeypatch):
+    """The registry table gets one row per document and a later load does not queue superseded hrefs"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    adapter = datasets.get_adapter('privatizationPlans')
+    datasets.create_tables(adapter)
+    files = registry_files(tmp_path)
+
+    assert datasets.load_registry(adapter, files=files[:2]) == 3
+    assert datasets.load_registry(adapter, files=files[2:]) == 2
+    conn = get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM privatisationplans").fetchone()[0] == 5
+    conn.close()
+
+    assert sorted(href for _, _, href in datasets.select_documents(adapter)) == \
+        ['http://portal/P1-decision', 'http://portal/P1-v3', 'http://portal/P2-v1', 'http://portal/P3-v1']
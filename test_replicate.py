@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test script for the replication between databases: chunked copy, watermark increments and chunk checksums
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import db_utils
+import rawstore
+import replicate
+from datasets import get_adapter, map_document, write_batch
+from db_utils import get_db_connection, optimize_database
+from main import create_database
+from rawstore import compress
+from test_partitions import plan_document
+
+TABLES = ['privatisationplanlist', 'privatizationobjects', 'rawdocuments', 'agg_plan_revenue']
+
+
+def ingest(reg_num, version=None, publish_date='2025-01-15T10:00:00+03:00'):
+    """Load the sample plan with five objects as another plan and finish the load as the loaders do"""
+    adapter = get_adapter('privatizationPlans')
+    document = plan_document(publish_date, 5)
+    if version is not None:
+        document['exportObject']['structuredObject']['privatizationPlan']['version'] = version
+    conn = get_db_connection()
+    raw = compress(json.dumps(document).encode('utf-8'))
+    write_batch(conn, adapter, map_document(adapter, reg_num, document, source=f'http://portal/{reg_num}', raw=raw))
+    optimize_database(conn)
+    conn.close()
+
+
+def table_rows(database, table_name):
+    conn = get_db_connection(database=database)
+    columns = ', '.join(replicate.table_columns(conn, table_name))
+    rows = sorted(conn.execute(f"SELECT {columns} FROM {table_name}").fetchall(), key=repr)
+    conn.close()
+    return rows
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    """A source database with one loaded plan and an empty replica with the same schema"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    rawstore.promoted_paths.cache_clear()
+    rawstore.promoted_extractor.cache_clear()
+    create_database()
+    ingest('R1')
+    monkeypatch.setattr(db_utils, 'SQLITE_DATABASE', 'replica.db')
+    create_database()
+    monkeypatch.setattr(db_utils, 'SQLITE_DATABASE', 'torgi.db')
+
+
+def test_incremental_replication(databases):
+    """The replica equals the source, an unchanged source copies nothing and a new load copies its rows"""
+    copied = replicate.replicate('SQLITE', 'SQLITE', target_database='replica.db', chunk_size=2)
+    assert copied['privatizationobjects'] == len(table_rows('torgi.db', 'privatizationobjects')) > 2
+    for table_name in TABLES:
+        assert table_rows('replica.db', table_name) == table_rows('torgi.db', table_name)
+
+    assert replicate.replicate('SQLITE', 'SQLITE', target_database='replica.db') == {}
+
+    # Rows of earlier loads predate the last replicated load; only the new plan is copied
+    conn = get_db_connection()
+    objects = conn.execute("SELECT COUNT(*) FROM privatizationobjects").fetchone()[0]
+    for table_name in TABLES[:3]:
+        conn.execute(f"UPDATE {table_name} SET updatedate = '2000-01-01T00:00:00'")
+    conn.commit()
+    conn.close()
+    ingest('R2')
+    copied = replicate.replicate('SQLITE', 'SQLITE', target_database='replica.db', chunk_size=2)
+    assert copied['privatizationobjects'] == objects
+    # rawdocuments has a composite key (regnum, version)
+    assert copied['privatisationplanlist'] == copied['rawdocuments'] == 1
+    assert len(table_rows('replica.db', 'privatizationobjects')) == 2 * objects
+
+
+def test_closed_history_interval_is_replicated(databases):
+    """A new version closes the interval of the previous one in place; the replica gets the closed interval"""
+    replicate.replicate('SQLITE', 'SQLITE', target_database='replica.db')
+    assert [row[:4] for row in table_rows('replica.db', 'plan_history')] == \
+        [row[:4] for row in table_rows('torgi.db', 'plan_history')]
+
+    # The first version was loaded long before the second one
+    conn = get_db_connection()
+    conn.execute("UPDATE plan_history SET updatedate = '2000-01-01T00:00:00'")
+    conn.commit()
+    conn.close()
+    ingest('R1', version=99, publish_date='2025-03-01T10:00:00+03:00')
+    copied = replicate.replicate('SQLITE', 'SQLITE', target_database='replica.db', tables=['plan_history'])
+    assert copied['plan_history'] == 2
+    assert table_rows('replica.db', 'plan_history') == table_rows('torgi.db', 'plan_history')
+    conn = get_db_connection(database='replica.db')
+    intervals = conn.execute("SELECT version, valid_to FROM plan_history ORDER BY version").fetchall()
+    conn.close()
+    assert [valid_to for _, valid_to in intervals] == ['2025-03-01T07:00:00.000', None]
+
+
+def test_checksum_mismatch_rolls_back_the_chunk(databases):
+    """A value the target changes on write fails the run and leaves the chunk uncommitted"""
+    conn = get_db_connection(database='replica.db')
+    conn.execute("CREATE TRIGGER truncate_name AFTER INSERT ON privatisationplanlist "
+                 "BEGIN UPDATE privatisationplanlist SET plan_name = substr(plan_name, 1, 10) "
+                 "WHERE globalid = NEW.globalid; END")
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(RuntimeError, match='Checksum mismatch in privatisationplanlist'):
+        replicate.replicate('SQLITE', 'SQLITE', target_database='replica.db', tables=['privatisationplanlist'])
+    assert table_rows('replica.db', 'privatisationplanlist') == []
+
+
+def test_keys_and_values():
+    assert replicate.after_key(['regnum', 'version']) == '(([regnum] > ?) OR ([regnum] = ? AND [version] > ?))'
+    assert replicate.after_key_params(('R1', 2)) == ['R1', 'R1', 2]
+    # SQL Server types read back equal the text and numbers SQLite stores
+    assert replicate.checksum([(datetime(2025, 1, 15, 7), date(2025, 1, 15), Decimal('500000.00'))]) == \
+        replicate.checksum([('2025-01-15T07:00:00.000', '2025-01-15', 500000)])
+    assert replicate.checksum([(Decimal('1234.57'),)]) != replicate.checksum([(1234.567,)])
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Test script for the Russian stemmer and the key table of the SQLite search index
+"""
+
+import search
+from db_utils import get_db_connection
+from search import index_text, stem
+
+
+def test_stem_merges_word_forms():
+    """Inflected forms of nouns and adjectives share one stem"""
+    assert {stem(word) for word in ('помещение', 'помещения', 'помещений', 'помещениями')} == {'помещен'}
+    assert {stem(word) for word in ('нежилое', 'нежилого', 'нежилых')} == {'нежил'}
+    assert {stem(word) for word in ('земельный', 'земельного', 'земельным')} == {'земельн'}
+    assert stem('Ёлочная') == stem('елочной')
+
+
+def test_index_text_keeps_numbers_and_latin_words():
+    """House numbers and cadastral parts are indexed unchanged"""
+    assert index_text('ул. Центральная д. 18, кад. 27:15:0000000:123') == 'ул центральн д 18 кад 27 15 0000000 123'
+
+
+def test_rows_are_deleted_by_key(tmp_path, monkeypatch):
+    """Rows are found by globalid through the key table; an index without one gets its keys on creation"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    conn = get_db_connection()
+    search.create_tables(conn.cursor())
+    search.write_rows(conn, [search.search_row(f'g{n}', 'object', 'R1', f'Нежилое помещение {n}', 'г. Москва')
+                             for n in range(5)])
+    search.delete_rows(conn, ['g1', 'g3', 'unknown'])
+    assert conn.execute(f"SELECT globalid FROM {search.SEARCH_TABLE} ORDER BY globalid").fetchall() == \
+        [('g0',), ('g2',), ('g4',)]
+    assert conn.execute(f"SELECT k.globalid FROM {search.KEYS_TABLE} k JOIN {search.SEARCH_TABLE} s "
+                        f"ON s.rowid = k.docid AND s.globalid = k.globalid ORDER BY 1").fetchall() == \
+        [('g0',), ('g2',), ('g4',)]
+
+    conn.execute(f"DROP TABLE {search.KEYS_TABLE}")
+    search.create_tables(conn.cursor())
+    search.delete_rows(conn, ['g2'])
+    search.write_rows(conn, [search.search_row('g5', 'plan', 'R2', 'План приватизации', None)])
+    conn.commit()
+    conn.close()
+    assert [result['regnum'] for result in search.search('помещения')] == ['R1', 'R1']
+    assert [result['regnum'] for result in search.search('план')] == ['R2']
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Test script for the columnar transform stage
+"""
+
+import uuid
+
+from normalize import to_amount, to_utc
+from transform import batch_ids, record_rows, template_columns
+
+
+def test_record_rows_flatten_like_the_template():
+    """Nested dicts become <key>_<nested> columns, lists JSON text and missing values ''"""
+    template = {'code': 'A', 'name': {'ru': 'Первый', 'en': 'First'}, 'tags': [1], 'published': True}
+    records = [
+        template,
+        {'code': 'B', 'name': {'ru': 'Второй', 'extra': {'x': 1}}, 'tags': [{'k': 'v'}], 'ignored': 5},
+        {'code': 'C', 'name': None, 'tags': None, 'published': False}
+    ]
+    assert template_columns(template) == ['code', 'name_ru', 'name_en', 'tags', 'published']
+
+    rows = record_rows(records, template, now='2025-01-01T00:00:00')
+    assert [row[3:] for row in rows] == [
+        ('A', 'Первый', 'First', '[1]', True),
+        ('B', 'Второй', '', '[{"k": "v"}]', ''),
+        ('C', '', '', '', False)
+    ]
+    assert {row[1] for row in rows} == {'2025-01-01T00:00:00'}
+    assert len({row[0] for row in rows}) == 3
+    assert record_rows([], template) == []
+
+
+def test_batch_ids_are_uuid4():
+    ids = batch_ids(1000)
+    assert len(set(ids)) == 1000
+    assert all(uuid.UUID(value).version == 4 and str(uuid.UUID(value)) == value for value in ids)
+
+
+def test_record_rows_normalize_dates_and_amounts_like_the_typed_columns():
+    """Date and amount columns match normalize.to_utc / to_amount, malformed values become None"""
+    dates = ['2025-01-10T12:00:00+03:00', '2025-01-10', '2025-01-10T12:00:00.123456Z', 'not a date', '', None]
+    amounts = ['500000', '1 234,50', '1\xa0234.567', '1e5', '-.5', 'abc', '1e20', None]
+    records = [{'code': str(i), 'published': {'date': date}, 'price': amount}
+               for i, (date, amount) in enumerate(zip(dates + [None] * 2, amounts))]
+    template = {'code': '', 'published': {'date': ''}, 'price': ''}
+
+    rows = record_rows(records, template, now='2025-01-01T00:00:00', dates=['published_date'], amounts=['price'])
+    assert [row[4] for row in rows] == [to_utc(date) for date in dates + [None] * 2]
+    assert [row[5] for row in rows] == [to_amount(amount) for amount in amounts]
+    assert [row[5] for row in rows][:2] == ['500000.00', '1234.50']
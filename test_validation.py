@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for compiled validation of registry entries and documents
+"""
+
+import json
+import os
+import shutil
+
+import datasets
+import main
+import mappings
+import validation
+from db_utils import get_db_connection
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VALID_ENTRY = {
+    'hostingOrg': '2300005436', 'bidderOrgCode': '2300005436', 'documentType': 'privatizationPlan',
+    'regNum': '20220314230000543602', 'publishDate': '2026-01-01T09:21:17.904Z',
+    'href': 'https://torgi.gov.ru/new/opendata/7710568760-privatizationPlans/docs/plan.json'
+}
+
+
+def clear_caches():
+    mappings.load_structure.cache_clear()
+    validation.registry_validator.cache_clear()
+
+
+def test_registry_validator_uses_structure_version(monkeypatch):
+    """Entries are checked against the structure file their data file refers to"""
+    monkeypatch.chdir(BASE_DIR)
+    clear_caches()
+
+    assert validation.registry_validator('20230401')(VALID_ENTRY) == []
+
+    report = dict(VALID_ENTRY, documentType='planReport')
+    # planReport was added to the enum in structure 20230401
+    assert validation.registry_validator('20230401')(report) == []
+    assert validation.registry_validator('20220601')(report) != []
+
+    broken = dict(VALID_ENTRY, hostingOrg='123', publishDate='yesterday')
+    del broken['href']
+    errors = validation.registry_validator('20230401')(broken)
+    assert len(errors) == 3
+    assert validation.registry_validator('19990101') is None
+
+
+def test_document_validator_and_sampler():
+    """Documents missing required values are rejected and sampling validates every Nth entry"""
+    validate = validation.document_validator('privatizationPlan')
+    assert validate({'id': '1', 'commonInfo': {'planNumber': '1', 'publishDate': 'x'},
+                     'hostingOrg': {'code': '1'}, 'privatizationObjects': []}) == ([], [])
+    # Only the publish date and the object list are required, the plan number and organization are warnings
+    errors, warnings = validate({'id': '1', 'commonInfo': {}, 'privatizationObjects': {}})
+    assert (len(errors), len(warnings)) == (2, 2)
+    # Decisions are mapped from bidderOrg, a missing hostingOrg is not even a warning
+    assert validation.document_validator('privatizationDecision')(
+        {'id': '1', 'commonInfo': {'decisionNumber': '1', 'publishDate': 'x'}, 'bidderOrg': {'code': '1'}}) == ([], [])
+
+    sample = validation.Sampler(0.25)
+    assert [sample() for _ in range(8)] == [False, False, False, True] * 2
+    assert not any(validation.Sampler(0)() for _ in range(4))
+
+
+def test_invalid_registry_entries_are_quarantined(tmp_path, monkeypatch):
+    """Entries without a key or href are quarantined; other violations are warnings and the entry is loaded"""
+    priv_dir = tmp_path / 'privatisationplans'
+    priv_dir.mkdir()
+    shutil.copy(os.path.join(BASE_DIR, 'privatisationplans', 'structure-20230401.json'), priv_dir)
+    no_href = dict(VALID_ENTRY, regNum='20220314230000543603')
+    del no_href['href']
+    decision = dict(VALID_ENTRY, regNum='20220314230000543604', documentType='privatizationDecision',
+                    href=VALID_ENTRY['href'].replace('plan.json', 'decision.json'))
+    del decision['hostingOrg']
+    with open(priv_dir / 'data-20260101T0000-20260102T0000-structure-20230401.json', 'w', encoding='utf-8') as f:
+        json.dump({'listObjects': [VALID_ENTRY, dict(VALID_ENTRY, documentType='unknown'), no_href, decision]}, f)
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    clear_caches()
+    try:
+        main.create_database()
+        assert main.load_privatisation_data() == 3
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT regnum, documenttype, severity, errors FROM quarantine ORDER BY regnum, documenttype")
+        rows = cursor.fetchall()
+        conn.close()
+        assert [row[:3] for row in rows] == [
+            (VALID_ENTRY['regNum'], 'unknown', validation.WARNING),
+            (no_href['regNum'], 'privatizationPlan', validation.ERROR),
+            (decision['regNum'], 'privatizationDecision', validation.WARNING)
+        ]
+        assert 'documentType' in json.loads(rows[0][3])[0]
+        assert 'href' in json.loads(rows[1][3])[0]
+        assert 'hostingOrg' in json.loads(rows[2][3])[0]
+
+        # The decision without hostingOrg is fetched like any other document
+        assert (decision['regNum'], 'privatizationDecision', decision['href']) in \
+            datasets.select_documents(datasets.get_adapter('privatizationPlans'))
+    finally:
+        clear_caches()
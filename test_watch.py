@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Test script for the watch mode: conditional meta.json polls and ingestion of new registry files
+"""
+
+import json
+import os
+import shutil
+from argparse import Namespace
+
+import archive
+import main
+import rawstore
+import watch
+import workqueue
+from datasets import create_session
+from db_utils import get_db_connection
+from test_datasets import SAMPLE_DIR, SAMPLE_PLAN, start_server
+
+
+def write_portal(portal, base_url, periods):
+    """Write meta.json and one registry file per period, each listing the sample plan"""
+    data = []
+    for period in periods:
+        filename = f'data-{period}-structure-20230401.json'
+        registry = {'listObjects': [
+            {'hostingOrg': '2500002862', 'bidderOrgCode': '2500002862', 'documentType': 'privatizationPlan',
+             'regNum': f'plan-{period}', 'publishDate': '2025-12-19T00:19:59.318Z',
+             'href': f'{base_url}/{SAMPLE_PLAN}'}
+        ]}
+        with open(portal / filename, 'w', encoding='utf-8') as f:
+            json.dump(registry, f)
+        data.append({'source': f'{base_url}/{filename}'})
+    with open(portal / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump({'identifier': '7710568760-privatizationPlans', 'data': data}, f)
+
+
+def registry_regnums():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT regnum FROM privatisationplans ORDER BY regnum")
+    regnums = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return regnums
+
+
+def plan_regnums():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT regnum FROM privatisationplanlist ORDER BY regnum")
+    regnums = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return regnums
+
+
+def test_watch_ingests_new_files_and_backs_off_while_unchanged(tmp_path, monkeypatch):
+    """A changed meta.json brings its new files in; an unchanged one is a 304 and a longer interval"""
+    portal = tmp_path / 'portal'
+    portal.mkdir()
+    shutil.copy(os.path.join(SAMPLE_DIR, SAMPLE_PLAN), portal / SAMPLE_PLAN)
+    server = start_server(str(portal))
+    try:
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('TORGIDB', 'SQLITE')
+        rawstore.promoted_paths.cache_clear()
+        rawstore.promoted_extractor.cache_clear()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        write_portal(portal, base_url, ['20251101T0000-20251201T0000'])
+        main.create_database()
+
+        options = Namespace(workers=2, batch_size=10)
+        session = create_session(2)
+        feed = watch.Feed('privatizationPlans', f'{base_url}/meta.json', './privatisationplans/',
+                          watch.ingest_plans, min_interval=10, max_interval=40)
+
+        watch.watch([feed], session, options, once=True)
+        assert registry_regnums() == ['plan-20251101T0000-20251201T0000']
+        assert os.path.exists('privatisationplans/registry-archive.db')
+        assert feed.last_modified is not None
+        assert json.load(open(watch.STATE_FILE))['privatizationPlans']['last_modified'] == feed.last_modified
+
+        # Unchanged meta.json: the conditional request is answered 304 and the interval grows
+        assert watch.check_feed(session, feed, options) is False
+        feed.schedule(False, now=0)
+        assert feed.interval == 15
+        for _ in range(5):
+            feed.schedule(False, now=0)
+        assert feed.interval == 40
+
+        # A new period appears: only its file is downloaded and loaded
+        write_portal(portal, base_url, ['20251101T0000-20251201T0000', '20251201T0000-20260101T0000'])
+        modified = os.path.getmtime(portal / 'meta.json') + 10
+        os.utime(portal / 'meta.json', (modified, modified))
+        assert watch.check_feed(session, feed, options) is True
+        feed.schedule(True, now=0)
+        assert feed.interval == 10
+        assert registry_regnums() == ['plan-20251101T0000-20251201T0000', 'plan-20251201T0000-20260101T0000']
+        assert sorted(os.listdir('privatisationplans/loaded')) == [
+            'data-20251101T0000-20251201T0000-structure-20230401.json',
+            'data-20251201T0000-20260101T0000-structure-20230401.json'
+        ]
+
+        assert [entry['regNum'] for _, entry in archive.find_entries('./privatisationplans/')] == registry_regnums()
+    finally:
+        server.shutdown()
+
+
+def test_failed_ingest_is_retried_by_the_next_poll(tmp_path, monkeypatch):
+    """A file whose ingest failed stays in staging/ and is ingested by the next poll without a new download"""
+    portal = tmp_path / 'portal'
+    portal.mkdir()
+    shutil.copy(os.path.join(SAMPLE_DIR, SAMPLE_PLAN), portal / SAMPLE_PLAN)
+    server = start_server(str(portal))
+    try:
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('TORGIDB', 'SQLITE')
+        rawstore.promoted_paths.cache_clear()
+        rawstore.promoted_extractor.cache_clear()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        period = '20251101T0000-20251201T0000'
+        filename = f'data-{period}-structure-20230401.json'
+        write_portal(portal, base_url, [period])
+        main.create_database()
+
+        calls = []
+
+        def flaky_ingest(files, session, options):
+            calls.append([os.path.relpath(path) for path in files])
+            if len(calls) == 1:
+                raise RuntimeError('database is locked')
+            watch.ingest_plans(files, session, options)
+
+        options = Namespace(workers=2, batch_size=10)
+        session = create_session(2)
+        feed = watch.Feed('privatizationPlans', f'{base_url}/meta.json', './privatisationplans/',
+                          flaky_ingest, min_interval=10, max_interval=40)
+
+        watch.watch([feed], session, options, once=True)
+        assert registry_regnums() == []
+        assert not os.path.exists(f'privatisationplans/loaded/{filename}')
+        assert os.listdir('privatisationplans/staging') == [filename]
+        assert feed.digest is None
+
+        # The portal no longer serves the file: the staged copy is ingested
+        os.remove(portal / filename)
+        feed.next_poll = 0
+        watch.watch([feed], session, options, once=True)
+        assert calls == [[os.path.join('privatisationplans', 'staging', filename)]] * 2
+        assert registry_regnums() == [f'plan-{period}']
+        assert os.listdir('privatisationplans/loaded') == [filename]
+        assert os.listdir('privatisationplans/staging') == []
+    finally:
+        server.shutdown()
+
+
+def test_failed_documents_are_queued_and_retried(tmp_path, monkeypatch):
+    """A document that failed while its file was ingested is queued and loaded by a later poll"""
+    portal = tmp_path / 'portal'
+    portal.mkdir()
+    server = start_server(str(portal))
+    try:
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('TORGIDB', 'SQLITE')
+        rawstore.promoted_paths.cache_clear()
+        rawstore.promoted_extractor.cache_clear()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        period = '20251101T0000-20251201T0000'
+        filename = f'data-{period}-structure-20230401.json'
+        write_portal(portal, base_url, [period])
+        main.create_database()
+
+        options = Namespace(workers=2, batch_size=10)
+        session = create_session(2)
+        feed = watch.Feed('privatizationPlans', f'{base_url}/meta.json', './privatisationplans/',
+                          watch.ingest_plans, min_interval=10, max_interval=40, retry=watch.retry_plans)
+
+        # The portal does not serve the document yet: the file is ingested, the document queued
+        watch.watch([feed], session, options, once=True)
+        assert os.listdir('privatisationplans/loaded') == [filename]
+        assert workqueue.queue_status('7710568760-privatizationPlans') == {workqueue.PENDING: 1}
+        assert plan_regnums() == []
+
+        # meta.json is unchanged, the queued document is retried all the same
+        shutil.copy(os.path.join(SAMPLE_DIR, SAMPLE_PLAN), portal / SAMPLE_PLAN)
+        assert watch.check_feed(session, feed, options) is False
+        assert workqueue.queue_status('7710568760-privatizationPlans') == {workqueue.DONE: 1}
+        assert plan_regnums() == [f'plan-{period}']
+    finally:
+        server.shutdown()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Test script for the document work queue: several worker processes sharing one SQLite file
+"""
+
+import multiprocessing
+import os
+import shutil
+import time
+
+import main
+import workqueue
+from datasets import get_adapter
+from db_utils import get_db_connection, read_watermark
+from test_datasets import SAMPLE_DIR, SAMPLE_PLAN, start_server
+
+DATASET = '7710568760-privatizationPlans'
+
+
+def watermark():
+    conn = get_db_connection()
+    value = read_watermark(conn)
+    conn.close()
+    return value
+
+
+def queue_rows():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT href, status, attempts FROM document_queue ORDER BY href")
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def worker_process(directory, worker_id):
+    """Entry point of a worker process (a separate interpreter, like a worker on another machine)"""
+    os.chdir(directory)
+    os.environ['TORGIDB'] = 'SQLITE'
+    workqueue.run_worker(get_adapter('privatizationPlans'), worker_id=worker_id, claim_size=2, lease_seconds=5,
+                         workers=2, batch_size=2)
+
+
+def test_worker_processes_split_the_queue(tmp_path, monkeypatch):
+    """Every document is processed by exactly one of the workers; a broken one fails after its attempts"""
+    portal = tmp_path / 'portal'
+    portal.mkdir()
+    shutil.copy(os.path.join(SAMPLE_DIR, SAMPLE_PLAN), portal / SAMPLE_PLAN)
+    server = start_server(str(portal))
+    try:
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('TORGIDB', 'SQLITE')
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        main.create_database()
+
+        # The server ignores the query string, so each href is a distinct queue entry for the same document
+        records = [(f'plan-{i:02}', 'privatizationPlan', f'{base_url}/{SAMPLE_PLAN}?n={i:02}') for i in range(12)]
+        records.append(('missing', 'privatizationPlan', f'{base_url}/missing.json'))
+        conn = get_db_connection()
+        workqueue.create_tables(conn.cursor())
+        assert workqueue.enqueue(conn, DATASET, records) == 13
+        assert workqueue.enqueue(conn, DATASET, records) == 0
+        conn.close()
+        started = watermark()
+
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=worker_process, args=(str(tmp_path), f'worker-{n}')) for n in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(120)
+            assert process.exitcode == 0
+
+        rows = queue_rows()
+        assert [(status, attempts) for href, status, attempts in rows if 'missing' not in href] == [('done', 1)] * 12
+        assert [(status, attempts) for href, status, attempts in rows if 'missing' in href] == \
+            [('failed', workqueue.MAX_ATTEMPTS)]
+        assert workqueue.queue_status(DATASET) == {'done': 12, 'failed': 1}
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM privatisationplanlist")
+        assert cursor.fetchone()[0] == 12
+        conn.close()
+        # The database is optimized once per worker after the queue drained, not after each of the batches
+        assert 1 <= watermark() - started <= len(processes)
+    finally:
+        server.shutdown()
+
+
+def test_expired_leases_are_claimed_again_and_heartbeats_keep_them(tmp_path, monkeypatch):
+    """A worker that stops heartbeating loses its documents; a live one keeps them"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    conn = get_db_connection()
+    workqueue.create_tables(conn.cursor())
+    workqueue.enqueue(conn, DATASET, [(f'plan-{i}', 'privatizationPlan', f'http://portal/{i}') for i in range(3)])
+
+    dead_lease, records = workqueue.claim_batch(conn, DATASET, 'dead', lease_seconds=0.2)
+    assert len(records) == 3
+    assert workqueue.claim_batch(conn, DATASET, 'live')[1] == []
+    time.sleep(0.3)
+
+    live_lease, records = workqueue.claim_batch(conn, DATASET, 'live', lease_seconds=0.3)
+    assert len(records) == 3
+    # The dead worker coming back must not complete documents it no longer holds
+    workqueue.complete_batch(conn, dead_lease)
+    assert {status for _, status, _ in queue_rows()} == {'leased'}
+
+    with workqueue.heartbeat(live_lease, lease_seconds=0.3):
+        time.sleep(0.7)
+        assert workqueue.claim_batch(conn, DATASET, 'other')[1] == []
+    workqueue.complete_batch(conn, live_lease, [('http://portal/1', 'HTTP 500')])
+    assert queue_rows() == [('http://portal/0', 'done', 2), ('http://portal/1', 'pending', 2),
+                            ('http://portal/2', 'done', 2)]
+    conn.close()
+
+
+def test_queue_is_keyed_by_href_hash(tmp_path, monkeypatch):
+    """Hrefs longer than an index key fit the queue; a queue keyed by href is rekeyed with its rows"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE document_queue (dataset NVARCHAR(100) NOT NULL, href NVARCHAR(450) NOT NULL, "
+                   "regnum NVARCHAR(36), documenttype NVARCHAR(50), status NVARCHAR(10) NOT NULL, "
+                   "attempts INTEGER NOT NULL, lease_id NVARCHAR(36), lease_owner NVARCHAR(100), "
+                   "lease_expires DATETIME2, createdate TEXT, updatedate TEXT, error TEXT, "
+                   "PRIMARY KEY (dataset, href))")
+    cursor.execute("INSERT INTO document_queue (dataset, href, regnum, status, attempts) "
+                   "VALUES (?, 'http://portal/0', 'plan-0', 'done', 1)", (DATASET,))
+    workqueue.create_tables(cursor)
+    conn.commit()
+
+    long_href = 'http://portal/' + 'x' * 1000
+    assert workqueue.enqueue(conn, DATASET, [('plan-0', 'privatizationPlan', 'http://portal/0'),
+                                             ('plan-1', 'privatizationPlan', long_href)]) == 1
+    lease_id, records = workqueue.claim_batch(conn, DATASET, 'worker')
+    assert records == [('plan-1', 'privatizationPlan', long_href)]
+    workqueue.complete_batch(conn, lease_id, [(long_href, 'HTTP 500')])
+    assert queue_rows() == [('http://portal/0', 'done', 1), (long_href, 'pending', 1)]
+
+    cursor.execute("SELECT href_hash FROM document_queue WHERE href = ?", (long_href,))
+    assert cursor.fetchone()[0] == workqueue.href_hash(long_href)
+    conn.close()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test script for the parallel write sink: partitioning by plan, ordered commits and retries
+"""
+
+import pytest
+
+import datasets
+import writers
+from datasets import DatasetAdapter, create_tables
+from db_utils import get_db_connection
+
+
+def plan_adapter():
+    return DatasetAdapter(
+        identifier='test-plans',
+        directory='./plans/',
+        registry_table='plans_registry',
+        tables={
+            'plans': ['globalid TEXT PRIMARY KEY', 'regnum NVARCHAR(36)', 'name TEXT'],
+            'objects': ['globalid TEXT PRIMARY KEY', 'regnum NVARCHAR(36)', 'object_number TEXT']
+        },
+        mappers={}
+    )
+
+
+def plan_rows(reg_num, name, objects=3):
+    """The {table: rows} of one plan document: the plan and its objects"""
+    return {
+        'plans': [(f'plan-{reg_num}', reg_num, name)],
+        'objects': [(f'object-{reg_num}-{n}', reg_num, str(n)) for n in range(objects)]
+    }
+
+
+def table_rows(query):
+    conn = get_db_connection()
+    rows = conn.execute(query).fetchall()
+    conn.close()
+    return rows
+
+
+def test_plans_are_written_whole_and_in_order(tmp_path, monkeypatch):
+    """Each batch holds whole plans of one partition; later versions of a plan win"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    adapter = plan_adapter()
+    create_tables(adapter)
+
+    batches = []
+
+    def recording_write_batch(conn, adapter, rows):
+        batches.append(rows)
+        return datasets.write_batch(conn, adapter, rows)
+
+    sink = writers.PartitionedWriter(adapter, writers=3, batch_size=4)
+    sink.write_batch = recording_write_batch
+    for version in range(3):
+        for n in range(20):
+            sink.add(f'reg{n}', plan_rows(f'reg{n}', f'version {version}'))
+    assert sink.close() == 60
+
+    assert all(count > 0 for count in sink.batches)
+    assert sink.opened == 3
+    for rows in batches:
+        partitions = {sink.partition(reg_num) for _, reg_num, _ in rows['plans']}
+        assert len(partitions) == 1
+        plans = {reg_num for _, reg_num, _ in rows['plans']}
+        assert {reg_num for _, reg_num, _ in rows['objects']} == plans
+        assert len(rows['objects']) == 3 * len(rows['plans'])
+
+    assert table_rows("SELECT DISTINCT name FROM plans") == [('version 2',)]
+    assert table_rows("SELECT COUNT(*) FROM objects") == [(60,)]
+
+
+def test_failed_batches_are_retried_and_reported(tmp_path, monkeypatch):
+    """A failing transaction is rolled back and retried; a batch that keeps failing is raised by close()"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    monkeypatch.setattr(writers, 'RETRY_DELAY', 0)
+    adapter = plan_adapter()
+    create_tables(adapter)
+    calls = []
+
+    def flaky_write_batch(conn, adapter, rows):
+        calls.append(len(rows['plans']))
+        datasets.write_batch(conn, adapter, {'plans': rows['plans']})
+        if len(calls) == 1:
+            raise RuntimeError('deadlock victim')
+        return datasets.write_batch(conn, adapter, rows)
+
+    sink = writers.PartitionedWriter(adapter, writers=1, batch_size=10)
+    sink.write_batch = flaky_write_batch
+    sink.add('reg1', plan_rows('reg1', 'first'))
+    assert sink.close() == 1
+    assert len(calls) == 2
+    assert table_rows("SELECT COUNT(*) FROM objects") == [(3,)]
+
+    def failing_write_batch(conn, adapter, rows):
+        raise RuntimeError('table is gone')
+
+    sink = writers.PartitionedWriter(adapter, writers=2, batch_size=1)
+    sink.write_batch = failing_write_batch
+    sink.add('reg2', plan_rows('reg2', 'second'))
+    with pytest.raises(RuntimeError, match='table is gone'):
+        sink.close()
+
+
+def test_writers_are_stopped_when_processing_fails(tmp_path, monkeypatch):
+    """An error escaping the fetch loop still stops the writer threads and closes the connection"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TORGIDB', 'SQLITE')
+    adapter = plan_adapter()
+    create_tables(adapter)
+    sinks = []
+    connections = []
+
+    class RecordingWriter(writers.PartitionedWriter):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            sinks.append(self)
+
+    class RecordingConnection:
+        def __init__(self, conn):
+            self.conn = conn
+            self.closed = False
+            connections.append(self)
+
+        def close(self):
+            self.closed = True
+            self.conn.close()
+
+    def broken_fetch_documents(records, workers, session, keep_raw):
+        raise KeyboardInterrupt
+        yield
+
+    monkeypatch.setattr(datasets, 'PartitionedWriter', RecordingWriter)
+    monkeypatch.setattr(datasets, 'fetch_documents', broken_fetch_documents)
+    monkeypatch.setattr(datasets, 'get_db_connection', lambda mode=None: RecordingConnection(get_db_connection(mode)))
+    with pytest.raises(KeyboardInterrupt):
+        datasets.process_documents(adapter, records=[('reg1', 'plan', 'http://portal/reg1')], writers=2)
+    assert [sink.closed for sink in sinks] == [True]
+    assert not any(thread.is_alive() for thread in sinks[0].threads)
+    assert [conn.closed for conn in connections] == [True]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Module with a columnar transform stage for batches of records.
+
+A batch of parsed records is flattened into a pandas DataFrame once and normalized column
+by column (nested dicts to <key>_<nested> columns, lists and deeper objects to JSON text,
+missing values to ''), instead of building each row with its own chain of .get() calls.
+Columns named as dates or amounts are normalized as whole columns to the formats of the
+typed columns in normalize.py (UTC 'YYYY-MM-DDTHH:MM:SS.fff', DECIMAL(18,2) strings, None
+if malformed). The batch shares one timestamp and its ids come from one os.urandom() call,
+and the result is a list of row tuples ready for upsert_rows().
+"""
+
+import json
+import os
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+import pandas as pd
+
+from normalize import CENTS, MAX_AMOUNT
+
+# One encoder for all cells: json.dumps() would set up a new one per call
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+# Sums normalize.to_amount accepts once spaces are removed and the decimal comma replaced
+AMOUNT_PATTERN = r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?'
+
+
+def batch_timestamp():
+    """Return the createdate/updatedate value shared by all rows of a batch"""
+    return datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def batch_ids(count):
+    """Return count random (version 4) uuid strings generated from one block of random bytes"""
+    block = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=block[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+
+def template_columns(template):
+    """Return the column names of a record template: nested dict keys become <key>_<nested>"""
+    columns = []
+    for key, value in template.items():
+        if isinstance(value, dict):
+            columns.extend(f"{key}_{nested_key}" for nested_key in value)
+        else:
+            columns.append(key)
+    return columns
+
+
+def to_text(column):
+    """Serialize dict and list cells of a column as JSON and replace missing values with ''"""
+    nested = column.map(type).isin((dict, list))
+    if nested.any():
+        column = column.copy()
+        column[nested] = column[nested].map(JSON_ENCODER.encode)
+    return column.fillna('')
+
+
+def utc_column(column):
+    """Convert a column of ISO 8601 date-times to UTC like normalize.to_utc (dates without an offset are UTC)"""
+    moments = pd.to_datetime(column.replace('', None), utc=True, errors='coerce', format='ISO8601')
+    text = moments.dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3]
+    return text.astype(object).where(moments.notna(), None)
+
+
+def amount_column(column):
+    """Convert a column of sums published as text to DECIMAL(18,2) strings like normalize.to_amount"""
+    cleaned = column.astype(str).str.replace(r'[\xa0 ]', '', regex=True).str.replace(',', '.', regex=False)
+    valid = cleaned.str.fullmatch(AMOUNT_PATTERN) & column.notna()
+    amounts = cleaned[valid].map(Decimal)
+    amounts = amounts[amounts.abs() < MAX_AMOUNT].map(lambda amount: str(amount.quantize(CENTS)))
+    return amounts.reindex(column.index).astype(object).where(lambda values: values.notna(), None)
+
+
+def flatten(records, template):
+    """
+    Flatten records into a DataFrame with the columns of the template record.
+    Keys the template does not have are dropped, keys a record lacks become ''.
+    """
+    # dtype=object keeps values as parsed (no int -> float promotion for missing cells)
+    frame = pd.DataFrame(records, dtype=object)
+    columns = {}
+    for key, value in template.items():
+        column = frame[key] if key in frame else pd.Series(None, index=frame.index, dtype=object)
+        if isinstance(value, dict):
+            nested = pd.DataFrame([cell if isinstance(cell, dict) else {} for cell in column],
+                                  index=frame.index, dtype=object)
+            for nested_key in value:
+                columns[f"{key}_{nested_key}"] = to_text(nested[nested_key]) if nested_key in nested \
+                    else pd.Series('', index=frame.index, dtype=object)
+        else:
+            columns[key] = to_text(column)
+    return pd.DataFrame(columns, index=frame.index, columns=template_columns(template))
+
+
+def record_rows(records, template, now=None, dates=(), amounts=()):
+    """
+    Return (globalid, createdate, updatedate, *template columns) row tuples of a batch of records.
+    The dates and amounts columns are normalized like the typed columns of normalize.py.
+    """
+    if not records:
+        return []
+    frame = flatten(records, template)
+    for column in dates:
+        frame[column] = utc_column(frame[column])
+    for column in amounts:
+        frame[column] = amount_column(frame[column])
+    now = now or batch_timestamp()
+    frame.insert(0, 'globalid', batch_ids(len(frame)))
+    frame.insert(1, 'createdate', now)
+    frame.insert(2, 'updatedate', now)
+    return list(frame.itertuples(index=False, name=None))
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Module to validate registry entries and documents before they reach the main tables.
+
+Registry entries are checked against the published structure-*.json files, compiled
+once per structure version into nested check functions. Documents are checked against
+DOCUMENT_RULES per document type. Only entries lacking what the pipeline needs (the
+registry key and document link, the required document paths) are written to the
+quarantine table instead of the main tables; other violations are recorded there as
+warnings and the entry is loaded anyway.
+"""
+
+import argparse
+import json
+import re
+import uuid
+from functools import lru_cache
+from mappings import list_object_definition, load_structure, structure_version
+
+QUARANTINE_COLUMNS = [
+    'globalid TEXT PRIMARY KEY',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'dataset TEXT',
+    'source TEXT',
+    'regnum TEXT',
+    'documenttype TEXT',
+    'errors TEXT',
+    'payload TEXT',
+    'severity TEXT'
+]
+
+# Severities of quarantine rows: an entry with errors is not loaded, one with warnings is
+ERROR = 'error'
+WARNING = 'warning'
+
+# Registry properties the loaders cannot do without: the row key and the document it points to
+REGISTRY_REQUIRED = ('regNum', 'documentType', 'href')
+NSI_REGISTRY_REQUIRED = ('NSIType', 'href')
+
+# Stop collecting errors for an entry after this many
+MAX_ERRORS = 10
+
+DATE_TIME_RE = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?$')
+
+JSON_TYPES = {
+    'string': (str,),
+    'integer': (int,),
+    'number': (int, float),
+    'boolean': (bool,),
+    'object': (dict,),
+    'array': (list,),
+    'null': (type(None),)
+}
+
+# Paths, JSON types and whether they are required per document type; the portal does not
+# publish document schemas, so these cover what the mappers read. A document is quarantined
+# only for a required path: the list its rows come from and the publish date its month
+# partition is taken from. Organizations are mapped from hostingOrg of plans and from
+# bidderOrg of decisions, both are optional.
+DOCUMENT_RULES = {
+    'privatizationPlan': [
+        ('id', 'string', False),
+        ('commonInfo', 'object', True),
+        ('commonInfo.planNumber', 'string', False),
+        ('commonInfo.publishDate', 'string', True),
+        ('hostingOrg.code', 'string', False),
+        ('privatizationObjects', 'array', True)
+    ],
+    'privatizationDecision': [
+        ('id', 'string', False),
+        ('commonInfo.decisionNumber', 'string', False),
+        ('commonInfo.publishDate', 'string', True),
+        ('bidderOrg.code', 'string', False)
+    ],
+    'planReport': [
+        ('id', 'string', False),
+        ('commonInfo.publishDate', 'string', True),
+        ('hostingOrg.code', 'string', False)
+    ]
+}
+
+
+def compile_node(schema, definitions):
+    """Compile a JSON schema node into a function check(value, path, errors)"""
+    if '$ref' in schema:
+        return compile_node(definitions[schema['$ref'].split('/')[-1]], definitions)
+
+    checks = []
+
+    if 'type' in schema:
+        names = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+        types = tuple(t for name in names for t in JSON_TYPES.get(name, ()))
+        # bool is a subclass of int, so it must not pass as integer/number
+        reject_bool = 'boolean' not in names
+
+        def check_type(value, path, errors):
+            if not isinstance(value, types) or (reject_bool and isinstance(value, bool)):
+                errors.append(f"{path}: expected {'/'.join(names)}, got {type(value).__name__}")
+                return False
+            return True
+        checks.append(check_type)
+
+    if 'enum' in schema:
+        allowed = frozenset(schema['enum'])
+
+        def check_enum(value, path, errors):
+            if value not in allowed:
+                errors.append(f"{path}: {value!r} is not one of the allowed values")
+            return True
+        checks.append(check_enum)
+
+    min_length = schema.get('minLength')
+    max_length = schema.get('maxLength')
+    if min_length is not None or max_length is not None:
+        def check_length(value, path, errors):
+            if isinstance(value, str):
+                if min_length is not None and len(value) < min_length:
+                    errors.append(f"{path}: shorter than {min_length}")
+                if max_length is not None and len(value) > max_length:
+                    errors.append(f"{path}: longer than {max_length}")
+            return True
+        checks.append(check_length)
+
+    if schema.get('format') == 'date-time':
+        def check_date_time(value, path, errors):
+            if isinstance(value, str) and not DATE_TIME_RE.match(value):
+                errors.append(f"{path}: {value!r} is not a date-time")
+            return True
+        checks.append(check_date_time)
+
+    if 'properties' in schema or 'required' in schema:
+        properties = {name: compile_node(node, definitions)
+                      for name, node in schema.get('properties', {}).items()}
+        required = tuple(schema.get('required', []))
+        closed = schema.get('additionalProperties') is False
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return True
+            for name in required:
+                if name not in value:
+                    errors.append(f"{path}.{name}: required property is missing")
+            for name, item in value.items():
+                check = properties.get(name)
+                if check is not None:
+                    check(item, f"{path}.{name}", errors)
+                elif closed:
+                    errors.append(f"{path}.{name}: unexpected property")
+            return True
+        checks.append(check_object)
+
+    if 'items' in schema:
+        check_item = compile_node(schema['items'], definitions)
+
+        def check_items(value, path, errors):
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    check_item(item, f"{path}[{index}]", errors)
+                    if len(errors) >= MAX_ERRORS:
+                        break
+            return True
+        checks.append(check_items)
+
+    def check(value, path, errors):
+        for step in checks:
+            # A type mismatch makes the remaining checks meaningless
+            if not step(value, path, errors):
+                return
+    return check
+
+
+def make_validator(check, root):
+    """Wrap a compiled check into validate(value) returning a list of errors"""
+    def validate(value):
+        errors = []
+        check(value, root, errors)
+        return errors[:MAX_ERRORS]
+    return validate
+
+
+@lru_cache(maxsize=None)
+def registry_validator(version):
+    """
+    Return a validator for one listObjects entry of the given structure version,
+    or None if the structure file is not available locally.
+    """
+    structure = load_structure(version) if version else None
+    if structure is None:
+        return None
+    definitions = structure.get('definitions', {})
+    return make_validator(compile_node(list_object_definition(structure), definitions), 'listObjects[]')
+
+
+def missing_properties(obj, required, root='listObjects[]'):
+    """Return errors for the required properties an entry lacks (missing, empty or not a string)"""
+    errors = []
+    for name in required:
+        value = obj.get(name)
+        if not value:
+            errors.append(f"{root}.{name}: required value is missing")
+        elif not isinstance(value, str):
+            errors.append(f"{root}.{name}: expected string, got {type(value).__name__}")
+    return errors
+
+
+@lru_cache(maxsize=None)
+def document_validator(document_type):
+    """
+    Return a validator for a structured document of the given type, or None if there are no
+    rules. The validator returns (errors, warnings): violations of required paths and of others.
+    """
+    rules = DOCUMENT_RULES.get(document_type)
+    if rules is None:
+        return None
+
+    compiled = []
+    for path, type_name, required in rules:
+        keys = tuple(path.split('.'))
+        compiled.append((path, keys, JSON_TYPES[type_name], type_name, required))
+
+    def validate(document):
+        errors = []
+        warnings = []
+        for path, keys, types, type_name, required in compiled:
+            value = document
+            for key in keys:
+                value = value.get(key) if isinstance(value, dict) else None
+                if value is None:
+                    break
+            if value is None:
+                message = f"{document_type}.{path}: required value is missing"
+            elif not isinstance(value, types):
+                message = f"{document_type}.{path}: expected {type_name}, got {type(value).__name__}"
+            else:
+                continue
+            (errors if required else warnings).append(message)
+        return errors, warnings
+    return validate
+
+
+class Sampler:
+    """Decides which entries to validate: every entry at rate 1, none at rate 0, every Nth otherwise"""
+
+    def __init__(self, rate=1.0):
+        self.every = 0 if rate <= 0 else max(1, round(1 / min(rate, 1.0)))
+        self.count = 0
+
+    def __call__(self):
+        if self.every == 0:
+            return False
+        self.count += 1
+        return self.every == 1 or self.count % self.every == 0
+
+
+def quarantine_row(dataset, source, reg_num, document_type, errors, payload, now, severity=ERROR):
+    """Build a quarantine table row for an entry that failed validation (or only has warnings)"""
+    return (
+        str(uuid.uuid4()), now, now, dataset, source, reg_num, document_type,
+        json.dumps(errors, ensure_ascii=False),
+        json.dumps(payload, ensure_ascii=False),
+        severity
+    )
+
+
+def add_validation_arguments(parser):
+    """Add the --validate-sample option to a command line parser"""
+    parser.add_argument('--validate-sample', type=float, default=1.0, metavar='RATE',
+                        help='Share of entries/documents to validate, 0 disables validation (default: 1.0)')
+
+
+def validate_file(filepath):
+    """Validate all entries of a registry data-*.json file and return (entries, invalid entries)"""
+    validator = registry_validator(structure_version(filepath))
+    if validator is None:
+        print(f"Structure file for {filepath} not found, skipping")
+        return 0, []
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    entries = data.get('listObjects', [])
+    invalid = []
+    for obj in entries:
+        errors = validator(obj)
+        if errors:
+            invalid.append((obj, errors))
+    return len(entries), invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate registry files against their structure-*.json')
+    parser.add_argument('files', nargs='+', help='Registry data-*.json files')
+
+    args = parser.parse_args()
+
+    for filepath in args.files:
+        total, invalid = validate_file(filepath)
+        rejected = sum(1 for obj, _ in invalid if missing_properties(obj, REGISTRY_REQUIRED))
+        print(f"{filepath}: {total} entries, {len(invalid)} invalid, {rejected} of them would be quarantined")
+        for obj, errors in invalid[:10]:
+            print(f"  {obj.get('regNum')}: {'; '.join(errors)}")
+
+
+if __name__ == '__main__':
+    main()
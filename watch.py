@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Module to run ingestion continuously: poll the meta.json of the privatization plans and
+masterdata with conditional requests and ingest new period files as soon as they appear.
+
+Each feed remembers the ETag, Last-Modified and digest of the last meta.json it saw (also
+in watch-state.json, so a restart stays conditional) and polls at an adaptive interval:
+it resets to the minimum when meta.json changed and grows up to the maximum while it does
+not. One HTTP session with keep-alive connections is used for polls and downloads, and the
+compiled extractors, validators and structure caches stay warm between polls.
+
+New data files are downloaded into the dataset's staging/ directory and moved to loaded/
+only after they were ingested, so a failed download or ingest is retried by the next poll.
+Documents of an ingested file that failed to download or map go to the document queue
+(workqueue.py); every poll gives the queued documents one more attempt.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import signal
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+STATE_FILE = 'watch-state.json'
+STAGING_DIR = 'staging'
+
+MIN_INTERVAL = 300
+MAX_INTERVAL = 3600
+BACKOFF = 1.5
+JITTER = 0.1
+
+MASTERDATA_META_URL = 'https://torgi.gov.ru/new/opendata/7710568760-masterData/meta.json'
+
+
+class Feed:
+    """A polled meta.json with its conditional request validators and polling interval"""
+
+    def __init__(self, name, meta_url, directory, ingest, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 retry=None):
+        self.name = name
+        self.meta_url = meta_url
+        self.directory = directory
+        self.ingest = ingest
+        self.retry = retry
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_poll = 0.0
+        self.etag = None
+        self.last_modified = None
+        self.digest = None
+
+    def validators(self):
+        return {'etag': self.etag, 'last_modified': self.last_modified, 'digest': self.digest}
+
+    def restore(self, saved):
+        self.etag = saved.get('etag')
+        self.last_modified = saved.get('last_modified')
+        self.digest = saved.get('digest')
+
+    def schedule(self, changed, now=None):
+        """Set the next poll: soon after a change, exponentially later while nothing changes"""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+        # Jitter keeps several watchers from polling the portal in lockstep
+        delay = self.interval * random.uniform(1 - JITTER, 1 + JITTER)
+        self.next_poll = (now if now is not None else time.monotonic()) + delay
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def load_state(path):
+    """Return the saved validators per feed name"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(path, feeds):
+    """Write the validators of all feeds atomically"""
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump({feed.name: feed.validators() for feed in feeds}, f, indent=2)
+    os.replace(temporary, path)
+
+
+def poll_meta(session, feed):
+    """
+    Fetch a feed's meta.json conditionally. Returns the parsed meta.json if it changed since
+    the last poll, None if it did not (304, or a server ignoring the validators but
+    returning the same bytes).
+    """
+    headers = {}
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+    if feed.last_modified:
+        headers['If-Modified-Since'] = feed.last_modified
+    response = session.get(feed.meta_url, headers=headers, timeout=60)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+
+    digest = hashlib.sha256(response.content).hexdigest()
+    feed.etag = response.headers.get('ETag')
+    feed.last_modified = response.headers.get('Last-Modified')
+    if digest == feed.digest:
+        return None
+    feed.digest = digest
+    return response.json()
+
+
+def missing_sources(meta, directory):
+    """Return (url, local path in loaded/) of the structure and data files of meta.json not ingested yet"""
+    loaded_dir = os.path.join(directory, 'loaded')
+    missing = []
+    # Structure files first: new data files are read with the structure version they name
+    for section in ('structure', 'data'):
+        for item in meta.get(section, []):
+            url = item.get('source')
+            if not url:
+                continue
+            filename = os.path.basename(urlparse(url).path)
+            path = os.path.join(loaded_dir, filename)
+            # Files downloaded by hand sit in the dataset directory itself
+            if not os.path.exists(path) and not os.path.exists(os.path.join(directory, filename)):
+                missing.append((url, path))
+    return missing
+
+
+def staged_path(path):
+    """Return the staging/ path of a data file of loaded/, where it waits until it is ingested"""
+    directory = os.path.dirname(os.path.dirname(path))
+    return os.path.join(directory, STAGING_DIR, os.path.basename(path))
+
+
+def download(session, url, path):
+    """Download a file through a temporary name, so a partial download is never picked up"""
+    from datasets import fetch_content
+    content, _ = fetch_content(session, url, timeout=300)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.part'
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, path)
+
+
+def clear_structure_caches():
+    """Forget cached structures, so a structure file downloaded just now is used (not a cached miss)"""
+    import mappings
+    import validation
+    mappings.load_structure.cache_clear()
+    mappings.registry_extractor.cache_clear()
+    validation.registry_validator.cache_clear()
+
+
+def registry_records(files):
+    """Return (regnum, documenttype, href) of the newest entries of registry files that reference a document"""
+    from registry_merge import merge_files
+    return merge_files(files).records()
+
+
+def ingest_plans(files, session, options):
+    """Load new registry files of the privatization plans, process their documents and archive them"""
+    import archive
+    from datasets import get_adapter, load_registry, process_documents
+
+    adapter = get_adapter('privatizationPlans')
+    loaded = load_registry(adapter, files=files, batch_size=options.batch_size)
+    records = registry_records(files)
+    failures = []
+    processed, failed = process_documents(adapter, records=records, workers=options.workers,
+                                          batch_size=options.batch_size, session=session, failures=failures)
+    archive.compact(adapter.directory, files=files)
+    log(f"Plans: {loaded} registry entries, {processed} documents processed ({failed} failed)")
+    # The files are not read again once they are in loaded/, so their failed documents are queued for retry
+    if failures:
+        failed_hrefs = {href for href, _ in failures}
+        queued = queue_documents(adapter, [record for record in records if record[2] in failed_hrefs])
+        log(f"Plans: {queued} failed documents queued for retry")
+
+
+def queue_documents(adapter, records):
+    """Add documents to the dataset's document queue; returns the number of newly queued ones"""
+    import workqueue
+    from db_utils import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        workqueue.create_tables(conn.cursor())
+        conn.commit()
+        return workqueue.enqueue(conn, adapter.identifier, records)
+    finally:
+        conn.close()
+
+
+def retry_plans(session, options):
+    """Give the queued plan documents one more attempt: one lease of the queue per poll"""
+    import workqueue
+    from datasets import get_adapter, process_documents
+    from db_utils import get_db_connection
+
+    adapter = get_adapter('privatizationPlans')
+    conn = get_db_connection()
+    try:
+        workqueue.create_tables(conn.cursor())
+        conn.commit()
+        lease_id, records = workqueue.claim_batch(conn, adapter.identifier, f'watch:{os.getpid()}')
+        if not records:
+            return
+        failures = []
+        with workqueue.heartbeat(lease_id):
+            processed, failed = process_documents(adapter, records=records, workers=options.workers,
+                                                  batch_size=options.batch_size, session=session,
+                                                  failures=failures)
+        workqueue.complete_batch(conn, lease_id, failures)
+    finally:
+        conn.close()
+    log(f"Plans: retried {len(records)} queued documents, {processed} processed ({failed} failed)")
+
+
+def ingest_masterdata(files, session, options):
+    """Download the NSI files listed in new masterdata registry files and load them into the NSI tables"""
+    from download_missing_nsi import download_missing_nsi_files
+    from masterdata import create_nsi_tables
+
+    for filepath in files:
+        download_missing_nsi_files(structure_file=filepath, session=session)
+        create_nsi_tables(structure_file=filepath)
+    log(f"Masterdata: {len(files)} registry files loaded")
+
+
+def check_feed(session, feed, options):
+    """Poll one feed and ingest the period files that appeared; returns True if meta.json changed"""
+    if feed.retry:
+        feed.retry(session, options)
+    meta = poll_meta(session, feed)
+    if meta is None:
+        return False
+
+    missing = missing_sources(meta, feed.directory)
+    if not missing:
+        log(f"{feed.name}: meta.json changed, no new files")
+        return True
+
+    # Data files wait in staging/ until they are ingested: a file in loaded/ is never fetched
+    # again, so a failed ingest or download must leave it out of there for the next poll
+    staged = []
+    for url, path in missing:
+        is_data = os.path.basename(path).startswith('data-')
+        target = staged_path(path) if is_data else path
+        if not os.path.exists(target):
+            log(f"{feed.name}: downloading {os.path.basename(path)}")
+            download(session, url, target)
+        if is_data:
+            staged.append((target, path))
+    if any('/structure-' in url for url, _ in missing):
+        clear_structure_caches()
+
+    staged.sort()
+    if staged:
+        feed.ingest([target for target, _ in staged], session, options)
+        for target, path in staged:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(target, path)
+    return True
+
+
+def watch(feeds, session, options, state_path=STATE_FILE, stop=None, once=False):
+    """
+    Poll the feeds until stop is set (or once), ingesting new files as they appear.
+    A failed poll or ingest is logged and retried at a longer interval.
+    """
+    stop = stop or threading.Event()
+    saved = load_state(state_path)
+    for feed in feeds:
+        feed.restore(saved.get(feed.name, {}))
+
+    while not stop.is_set():
+        now = time.monotonic()
+        for feed in feeds:
+            if feed.next_poll > now:
+                continue
+            try:
+                changed = check_feed(session, feed, options)
+            except Exception as e:
+                log(f"{feed.name}: poll failed: {e}")
+                # Validators are dropped so the next poll fetches meta.json in full and ingests the
+                # files still in staging/ (and downloads those that did not make it there)
+                feed.etag = feed.last_modified = feed.digest = None
+                changed = False
+            feed.schedule(changed)
+            save_state(state_path, feeds)
+            log(f"{feed.name}: {'changed' if changed else 'unchanged'}, next poll in {feed.next_poll - now:.0f}s")
+
+        if once:
+            break
+        stop.wait(max(0.0, min(feed.next_poll for feed in feeds) - time.monotonic()))
+
+
+def build_feeds(options):
+    """Return the privatization plans feed and, unless disabled, the masterdata feed"""
+    from datasets import get_adapter
+
+    adapter = get_adapter('privatizationPlans')
+    feeds = [Feed('privatizationPlans', adapter.meta_url, adapter.directory, ingest_plans,
+                  options.min_interval, options.max_interval, retry=retry_plans)]
+    if not options.no_masterdata:
+        feeds.append(Feed('masterData', MASTERDATA_META_URL, './masterdata/', ingest_masterdata,
+                          options.min_interval, options.max_interval))
+    return feeds
+
+
+def main():
+    from datasets import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, create_session
+
+    parser = argparse.ArgumentParser(description='Poll meta.json and ingest new registry files continuously')
+    parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL, help='Shortest poll interval, seconds')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL, help='Longest poll interval, seconds')
+    parser.add_argument('--no-masterdata', action='store_true', help='Do not watch the masterdata feed')
+    parser.add_argument('--once', action='store_true', help='Poll every feed once and exit (for cron)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent document downloads')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows/documents per write transaction')
+    parser.add_argument('--state', default=STATE_FILE, help='File keeping the meta.json validators between runs')
+
+    args = parser.parse_args()
+    stop = threading.Event()
+    # SIGTERM (service stop) and Ctrl+C end the loop between polls
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    log("Watching for new registry files")
+    watch(build_feeds(args), create_session(args.workers), args, state_path=args.state, stop=stop, once=args.once)
+    log("Stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Module to split document processing between several worker processes or machines through
+a queue table in the target database.
+
+The queue holds one row per document href, keyed by the SHA-256 digest of the href (hrefs
+are longer than SQL Server's 900-byte index key allows). A worker claims a batch of pending hrefs by
+stamping them with its lease id and a lease expiry, keeps the lease alive with heartbeats
+while it downloads and writes the documents, and marks them done (or back to pending on
+failure) when the batch is written. Leases of a worker that died expire and their documents
+are claimed again by the others; a document whose lease expired MAX_ATTEMPTS times is
+marked failed. Lease times come from the database clock, so workers on machines with
+skewed clocks agree on expiry.
+
+Processing is at-least-once: a worker that dies after writing a batch but before
+completing it leaves the batch to be processed again.
+"""
+
+import argparse
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from db_utils import (create_index_sql, create_table_sqlite_to_sqlserver, get_db_connection, get_db_type,
+                      optimize_database)
+
+QUEUE_TABLE = 'document_queue'
+
+QUEUE_COLUMNS = [
+    'dataset NVARCHAR(100) NOT NULL',
+    'href_hash BINARY(32) NOT NULL',
+    'href TEXT NOT NULL',
+    'regnum NVARCHAR(36)',
+    'documenttype NVARCHAR(50)',
+    'status NVARCHAR(10) NOT NULL',
+    'attempts INTEGER NOT NULL',
+    'lease_id NVARCHAR(36)',
+    'lease_owner NVARCHAR(100)',
+    'lease_expires DATETIME2',
+    'createdate TEXT',
+    'updatedate TEXT',
+    'error TEXT'
+]
+QUEUE_KEY_COLUMNS = ['dataset', 'href_hash']
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+CLAIM_SIZE = 200
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+
+def href_hash(href):
+    """Return the queue key of a document href"""
+    return hashlib.sha256(href.encode('utf-8')).digest()
+
+
+def create_tables(cursor):
+    """Create the queue table and its claim index"""
+    create_sql = (f"CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} ({', '.join(QUEUE_COLUMNS)}, "
+                  f"PRIMARY KEY ({', '.join(QUEUE_KEY_COLUMNS)}))")
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+    cursor.execute(f"SELECT * FROM {QUEUE_TABLE} WHERE 1 = 0")
+    if 'href_hash' not in {column[0].lower() for column in cursor.description}:
+        rekey_table(cursor, create_sql)
+    cursor.execute(create_index_sql(f'ix_{QUEUE_TABLE}_status', QUEUE_TABLE, ['dataset', 'status', 'lease_expires']))
+    cursor.execute(create_index_sql(f'ix_{QUEUE_TABLE}_lease_id', QUEUE_TABLE, ['lease_id']))
+
+
+def rekey_table(cursor, create_sql):
+    """Recreate a queue table keyed by (dataset, href) with the href_hash key, keeping its rows"""
+    columns = [definition.split()[0] for definition in QUEUE_COLUMNS if definition.split()[0] != 'href_hash']
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {QUEUE_TABLE}")
+    rows = [(href_hash(row[1]),) + tuple(row) for row in cursor.fetchall()]
+    cursor.execute(f"DROP TABLE {QUEUE_TABLE}")
+    cursor.execute(create_table_sqlite_to_sqlserver(create_sql))
+    if rows:
+        cursor.executemany(f"INSERT INTO {QUEUE_TABLE} (href_hash, {', '.join(columns)}) "
+                           f"VALUES ({', '.join('?' * (len(columns) + 1))})", rows)
+    print(f"Rekeyed {len(rows)} queued documents by href hash")
+
+
+def now_sql():
+    """Return the SQL expression of the database's current UTC time"""
+    if get_db_type() == 'SQLSERVER':
+        return "SYSUTCDATETIME()"
+    return "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+
+def expiry_sql(lease_seconds):
+    """Return the SQL expression of the database's UTC time lease_seconds from now"""
+    if get_db_type() == 'SQLSERVER':
+        return f"DATEADD(millisecond, {int(lease_seconds * 1000)}, SYSUTCDATETIME())"
+    return f"strftime('%Y-%m-%dT%H:%M:%f', 'now', '+{float(lease_seconds)} seconds')"
+
+
+def enqueue(conn, dataset, records):
+    """Add (regnum, documenttype, href) records to the queue; hrefs already queued are left as they are"""
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    rows = [(dataset, href_hash(href), href, reg_num, document_type, PENDING, 0, now, now)
+            for reg_num, document_type, href in records]
+    if not rows:
+        return 0
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {QUEUE_TABLE} WHERE dataset = ?", (dataset,))
+    before = cursor.fetchone()[0]
+    if get_db_type() == 'SQLSERVER':
+        cursor.fast_executemany = True
+        cursor.executemany(f"""
+            MERGE [{QUEUE_TABLE}] AS target
+            USING (VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)) AS source
+                (dataset, href_hash, href, regnum, documenttype, status, attempts, createdate, updatedate)
+            ON target.dataset = source.dataset AND target.href_hash = source.href_hash
+            WHEN NOT MATCHED THEN
+                INSERT (dataset, href_hash, href, regnum, documenttype, status, attempts, createdate, updatedate)
+                VALUES (source.dataset, source.href_hash, source.href, source.regnum, source.documenttype,
+                        source.status, source.attempts, source.createdate, source.updatedate);
+        """, rows)
+    else:
+        cursor.executemany(f"""
+            INSERT OR IGNORE INTO {QUEUE_TABLE}
+                (dataset, href_hash, href, regnum, documenttype, status, attempts, createdate, updatedate)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    cursor.execute(f"SELECT COUNT(*) FROM {QUEUE_TABLE} WHERE dataset = ?", (dataset,))
+    added = cursor.fetchone()[0] - before
+    conn.commit()
+    return added
+
+
+def fill_queue(adapter):
+    """Queue every document referenced in the dataset registry that is not queued yet"""
+    from datasets import select_documents
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    create_tables(cursor)
+    conn.commit()
+    added = enqueue(conn, adapter.identifier, select_documents(adapter))
+    conn.close()
+    return added
+
+
+def claim_batch(conn, dataset, worker_id, claim_size=CLAIM_SIZE, lease_seconds=LEASE_SECONDS):
+    """
+    Lease up to claim_size pending documents (or documents whose lease expired) to a worker.
+    Returns (lease id, [(regnum, documenttype, href), ...]).
+    """
+    lease_id = str(uuid.uuid4())
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    claimable = f"(status = '{PENDING}' OR (status = '{LEASED}' AND lease_expires < {now_sql()}))"
+    cursor = conn.cursor()
+
+    # Documents whose workers kept dying give up instead of taking the next worker down
+    cursor.execute(f"""
+        UPDATE {QUEUE_TABLE} SET status = '{FAILED}', lease_id = NULL, updatedate = ?, error = 'lease expired'
+        WHERE dataset = ? AND status = '{LEASED}' AND lease_expires < {now_sql()} AND attempts >= ?
+    """, (now, dataset, MAX_ATTEMPTS))
+
+    assignments = (f"status = '{LEASED}', lease_id = ?, lease_owner = ?, lease_expires = {expiry_sql(lease_seconds)}, "
+                   f"attempts = attempts + 1, updatedate = ?")
+    if get_db_type() == 'SQLSERVER':
+        # READPAST skips rows another worker is claiming at the same moment instead of waiting for them
+        cursor.execute(f"""
+            UPDATE TOP ({int(claim_size)}) {QUEUE_TABLE} WITH (ROWLOCK, UPDLOCK, READPAST)
+            SET {assignments}
+            WHERE dataset = ? AND {claimable}
+        """, (lease_id, worker_id, now, dataset))
+    else:
+        # SQLite runs the UPDATE under its single write lock, so two workers never claim the same row
+        cursor.execute(f"""
+            UPDATE {QUEUE_TABLE} SET {assignments}
+            WHERE dataset = ? AND href_hash IN (
+                SELECT href_hash FROM {QUEUE_TABLE} WHERE dataset = ? AND {claimable} ORDER BY href LIMIT ?
+            )
+        """, (lease_id, worker_id, now, dataset, dataset, claim_size))
+    conn.commit()
+
+    cursor.execute(f"SELECT regnum, documenttype, href FROM {QUEUE_TABLE} WHERE lease_id = ? ORDER BY href",
+                   (lease_id,))
+    return lease_id, [tuple(row) for row in cursor.fetchall()]
+
+
+def extend_lease(conn, lease_id, lease_seconds=LEASE_SECONDS):
+    """Push the expiry of a lease forward; returns the number of documents still held by it"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        UPDATE {QUEUE_TABLE} SET lease_expires = {expiry_sql(lease_seconds)}
+        WHERE lease_id = ? AND status = '{LEASED}'
+    """, (lease_id,))
+    conn.commit()
+    return cursor.rowcount
+
+
+@contextmanager
+def heartbeat(lease_id, lease_seconds=LEASE_SECONDS):
+    """Extend a lease every third of its duration from a background thread while the block runs"""
+    stop = threading.Event()
+
+    def beat():
+        conn = get_db_connection()
+        try:
+            while not stop.wait(lease_seconds / 3):
+                try:
+                    extend_lease(conn, lease_id, lease_seconds)
+                except Exception as e:
+                    # A missed beat is retried on the next one; the lease only expires after three
+                    print(f"Warning: Could not extend lease {lease_id}: {str(e)}")
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def complete_batch(conn, lease_id, failures=()):
+    """
+    Release a lease: failed documents go back to pending (failed after MAX_ATTEMPTS attempts),
+    the rest are marked done. Documents the lease lost to another worker are not touched.
+    """
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    cursor = conn.cursor()
+    cursor.executemany(f"""
+        UPDATE {QUEUE_TABLE}
+        SET status = CASE WHEN attempts >= ? THEN '{FAILED}' ELSE '{PENDING}' END,
+            lease_id = NULL, updatedate = ?, error = ?
+        WHERE lease_id = ? AND href_hash = ? AND status = '{LEASED}'
+    """, [(MAX_ATTEMPTS, now, error, lease_id, href_hash(href)) for href, error in failures])
+    cursor.execute(f"""
+        UPDATE {QUEUE_TABLE} SET status = '{DONE}', lease_id = NULL, updatedate = ?, error = NULL
+        WHERE lease_id = ? AND status = '{LEASED}'
+    """, (now, lease_id))
+    conn.commit()
+
+
+def leases_outstanding(conn, dataset):
+    """Return the number of documents leased to (possibly dead) workers"""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {QUEUE_TABLE} WHERE dataset = ? AND status = '{LEASED}'", (dataset,))
+    return cursor.fetchone()[0]
+
+
+def run_worker(adapter, worker_id=None, claim_size=CLAIM_SIZE, lease_seconds=LEASE_SECONDS, workers=None,
+               batch_size=None, profiler=None, validate_sample=1.0, session=None, writers=1):
+    """
+    Claim and process batches from the queue until it is drained. While other workers still
+    hold leases the worker waits, so it can take over their documents if their leases expire.
+    Statistics and the ingest watermark are refreshed once, after the queue is drained.
+    Returns (processed, failed).
+    """
+    from datasets import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, create_session, process_documents
+
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    workers = workers or DEFAULT_WORKERS
+    session = session or create_session(workers)
+    conn = get_db_connection()
+    create_tables(conn.cursor())
+    conn.commit()
+    processed = 0
+    failed = 0
+
+    while True:
+        lease_id, records = claim_batch(conn, adapter.identifier, worker_id, claim_size, lease_seconds)
+        if not records:
+            if not leases_outstanding(conn, adapter.identifier):
+                break
+            time.sleep(min(lease_seconds / 3, 5))
+            continue
+
+        failures = []
+        with heartbeat(lease_id, lease_seconds):
+            batch_processed, batch_failed = process_documents(
+                adapter, records=records, workers=workers, batch_size=batch_size or DEFAULT_BATCH_SIZE,
+                profiler=profiler, validate_sample=validate_sample, session=session, failures=failures,
+                writers=writers, optimize=False)
+        complete_batch(conn, lease_id, failures)
+        processed += batch_processed
+        failed += batch_failed
+        print(f"Worker {worker_id}: {processed} documents processed ({failed} failed)")
+
+    if processed:
+        optimize_database(conn)
+    conn.close()
+    return processed, failed
+
+
+def queue_status(dataset):
+    """Return {status: documents} of a dataset's queue"""
+    conn = get_db_connection('read')
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT status, COUNT(*) FROM {QUEUE_TABLE} WHERE dataset = ? GROUP BY status", (dataset,))
+    counts = dict(cursor.fetchall())
+    conn.close()
+    return counts
+
+
+def main():
+    from datasets import ADAPTERS, DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, get_adapter
+    from writers import add_writer_arguments, default_writers
+
+    parser = argparse.ArgumentParser(description='Shared queue of documents to process across workers')
+    parser.add_argument('--dataset', default='privatizationPlans', help=f"Dataset name or identifier ({', '.join(ADAPTERS)})")
+    parser.add_argument('--fill', action='store_true', help='Queue the documents of the registry not queued yet')
+    parser.add_argument('--work', action='store_true', help='Process queued documents until the queue is drained')
+    parser.add_argument('--status', action='store_true', help='Show the number of documents per queue status')
+    parser.add_argument('--claim-size', type=int, default=CLAIM_SIZE, help='Documents leased per claim')
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS, help='Lease duration, seconds')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent document downloads')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows/documents per write transaction')
+    add_writer_arguments(parser)
+
+    args = parser.parse_args()
+    adapter = get_adapter(args.dataset)
+
+    if args.fill:
+        print(f"Queued {fill_queue(adapter)} documents")
+
+    if args.work:
+        processed, failed = run_worker(adapter, claim_size=args.claim_size, lease_seconds=args.lease,
+                                       workers=args.workers, batch_size=args.batch_size,
+                                       writers=args.writers or default_writers())
+        print(f"Queue drained: {processed} documents processed ({failed} failed)")
+
+    if args.status:
+        for status, count in sorted(queue_status(adapter.identifier).items()):
+            print(f"{status}\t{count}")
+
+    if not any([args.fill, args.work, args.status]):
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
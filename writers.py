@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Module with a parallel write sink for processed documents.
+
+Documents are partitioned by registry number over a bounded number of writer threads, each
+writing its partition's batches through its own connection (SQLite connections cannot be
+shared between threads, so each writer opens and closes its own). All rows of one
+document (a plan, its objects, its organizations and the derived tables) go to the same
+writer and are committed in one transaction, and a writer commits its batches in arrival
+order, so a plan and its objects are never seen half written and versions of a plan are
+applied in order. With SQL Server several writers keep several round-trips in flight;
+SQLite admits one writer at a time, so there the sink only helps with a single writer.
+
+A batch that fails (e.g. a deadlock between writers updating the same organization or
+aggregate row) is rolled back and retried as a whole.
+"""
+
+import queue
+import threading
+import time
+import zlib
+from db_utils import get_db_connection, get_db_type
+
+DEFAULT_WRITERS = 4
+
+# Batches waiting per writer; a producer faster than the database blocks instead of piling up rows
+QUEUE_DEPTH = 2
+
+WRITE_RETRIES = 5
+RETRY_DELAY = 0.2
+
+
+def default_writers():
+    """Return the default number of writers: several for SQL Server, one for SQLite"""
+    return DEFAULT_WRITERS if get_db_type() == 'SQLSERVER' else 1
+
+
+def add_writer_arguments(parser):
+    """Add the --writers option to a command line parser"""
+    parser.add_argument('--writers', type=int, default=None,
+                        help=f'Parallel database writers (default: {DEFAULT_WRITERS} for SQL Server, 1 for SQLite)')
+
+
+class PartitionedWriter:
+    """
+    Write sink taking the mapped rows of one document at a time. Documents are assigned to
+    writers by a hash of their registry number and written in batches of batch_size documents.
+    """
+
+    def __init__(self, adapter, writers=DEFAULT_WRITERS, batch_size=500):
+        from datasets import write_batch
+
+        self.adapter = adapter
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.queues = [queue.Queue(maxsize=QUEUE_DEPTH) for _ in range(writers)]
+        self.pending = [{} for _ in range(writers)]
+        self.pending_documents = [0] * writers
+        self.errors = []
+        self.written = 0
+        self.opened = 0
+        self.batches = [0] * writers
+        self.closed = False
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, args=(index,), daemon=True) for index in range(writers)]
+        for thread in self.threads:
+            thread.start()
+
+    def partition(self, reg_num):
+        """Return the writer owning a registry number (crc32 is the same in every process, unlike hash())"""
+        return zlib.crc32(str(reg_num).encode('utf-8')) % len(self.queues)
+
+    def add(self, reg_num, document_rows):
+        """Queue the {table: rows} of one document for its writer"""
+        if self.errors:
+            raise self.errors[0]
+        index = self.partition(reg_num)
+        for table_name, table_rows in document_rows.items():
+            self.pending[index].setdefault(table_name, []).extend(table_rows)
+        self.pending_documents[index] += 1
+        if self.pending_documents[index] >= self.batch_size:
+            self.flush(index)
+
+    def flush(self, index):
+        if self.pending_documents[index]:
+            self.queues[index].put((self.pending[index], self.pending_documents[index]))
+            self.pending[index] = {}
+            self.pending_documents[index] = 0
+
+    def run(self, index):
+        """Writer thread: write the batches of one partition in order through the writer's connection"""
+        conn = None
+        try:
+            while True:
+                item = self.queues[index].get()
+                if item is None:
+                    break
+                rows, documents = item
+                # After a failure the remaining batches are drained so the producer is not blocked
+                if self.errors:
+                    continue
+                try:
+                    if conn is None:
+                        conn = get_db_connection('ingest')
+                        with self.lock:
+                            self.opened += 1
+                    self.write(conn, rows)
+                except Exception as e:
+                    self.errors.append(e)
+                    continue
+                with self.lock:
+                    self.written += documents
+                    self.batches[index] += 1
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def write(self, conn, rows):
+        """Write one batch in one transaction, retrying the whole transaction if it fails"""
+        for attempt in range(WRITE_RETRIES):
+            try:
+                self.write_batch(conn, self.adapter, rows)
+                return
+            except Exception as e:
+                conn.rollback()
+                if attempt == WRITE_RETRIES - 1:
+                    raise
+                print(f"Warning: Batch write failed, retrying: {str(e)}")
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+    def close(self):
+        """
+        Write the remaining rows, stop the writers and raise the first write error, if any.
+        Closing again (e.g. in a finally block after a successful close) does nothing.
+        """
+        if self.closed:
+            return self.written
+        self.closed = True
+        for index in range(len(self.queues)):
+            self.flush(index)
+            self.queues[index].put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+        return self.written